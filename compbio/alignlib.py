@@ -573,6 +573,97 @@ class CoordConverter (object):
         return local2global(local_coord, start, end, strand)
 
 
+class CompactCoordConverter (object):
+    """
+    Converts between coordinate systems on a gapped sequence
+
+    Same interface as CoordConverter, but the gapped sequence is stored as
+    NumPy arrays of its runs of non-gap characters rather than as per-position
+    lookup lists.  All conversion methods accept either a single coordinate
+    or an array of coordinates.
+    """
+
+    def __init__(self, seq):
+        import numpy as np
+
+        # find runs of non-gap characters
+        chars = np.frombuffer(seq, dtype=np.uint8)
+        isres = np.concatenate(([False], chars != ord("-"), [False]))
+        edges = np.flatnonzero(isres[1:] != isres[:-1])
+        starts = edges[::2]
+        ends = edges[1::2]
+
+        self.alignlen = len(seq)
+        self.seqlen = int((ends - starts).sum())
+
+        # align and local coordinates of the start of each run
+        self.run_align = starts.astype(np.int64)
+        self.run_local = np.zeros(len(starts) + 1, dtype=np.int64)
+        np.cumsum(ends - starts, out=self.run_local[1:])
+
+    def _check(self, coords, size, clamp):
+        import numpy as np
+
+        coords = np.asarray(coords, dtype=np.int64)
+        if clamp:
+            return np.clip(coords, 0, size - 1)
+        if coords.size and (coords.min() < 0 or coords.max() >= size):
+            raise IndexError("coordinate out of range")
+        return coords
+
+    def _result(self, result):
+        if result.ndim == 0:
+            return int(result)
+        return result
+
+    def local2align(self, i, clamp=False):
+        import numpy as np
+
+        local = self._check(i, self.seqlen, clamp)
+        run = np.searchsorted(self.run_local, local, side="right") - 1
+        return self._result(
+            self.run_align[run] + (local - self.run_local[run]))
+
+    def align2local(self, i, clamp=False):
+        import numpy as np
+
+        col = self._check(i, self.alignlen, clamp)
+        if self.seqlen == 0:
+            return self._result(np.full(col.shape, -1, dtype=np.int64))
+        run = np.maximum(
+            np.searchsorted(self.run_align, col, side="right") - 1, 0)
+
+        # gap columns map to the previous non-gap character (-1 if none)
+        runlen = self.run_local[run+1] - self.run_local[run]
+        offset = np.clip(col - self.run_align[run], -1, runlen - 1)
+        return self._result(self.run_local[run] + offset)
+
+    def global2local(self, gobal_coord, start, end, strand):
+        """Returns local coordinate in a global region"""
+        return global2local(gobal_coord, start, end, strand)
+
+    def local2global(self, local_coord, start, end, strand):
+        """Return global coordinate within a region from a local coordinate"""
+        return local2global(local_coord, start, end, strand)
+
+    def global2align(self, global_coord, start, end, strand):
+        import numpy as np
+
+        local_coord = global2local(np.asarray(global_coord),
+                                   start, end, strand)
+
+        # throw exception for out of bounds
+        if local_coord.size and (local_coord.min() < 0 or
+                                 local_coord.max() >= self.seqlen):
+            raise Exception("coordinate outside [start, end]")
+
+        return self.local2align(local_coord)
+
+    def align2global(self, align_coord, start, end, strand):
+        local_coord = self.align2local(align_coord)
+        return local2global(local_coord, start, end, strand)
+
+
 def local2align(seq):
     """
     Returns list of indices of non-gap characters
@@ -0,0 +1,241 @@
+"""
+
+    Alignments stored as NumPy character matrices
+
+    An AlignMatrix holds an alignment as a (seqs x columns) uint8 array so
+    that column filters and statistics can be computed for all columns at
+    once.  The functions mirror those of alignlib.
+
+"""
+
+# python libs
+from collections import defaultdict
+import math
+
+# numpy libs
+import numpy as np
+
+# compbio libs
+from . import fasta
+from . import seqlib
+
+
+GAP = ord("-")
+
+# map characters to upper case
+_UPPER = np.arange(256, dtype=np.uint8)
+_UPPER[ord("a"):ord("z")+1] -= ord("a") - ord("A")
+
+# map upper case DNA characters to 0-3 (4 for N, 5 for anything else)
+_DNA2INT = np.empty(256, dtype=np.int8)
+_DNA2INT.fill(5)
+for _i, _c in enumerate("ACGTN"):
+    _DNA2INT[ord(_c)] = _i
+    _DNA2INT[ord(_c.lower())] = _i
+
+
+def make_codon_lookup(table=seqlib.CODON_TABLE):
+    """
+    Returns (aas, codon2aa) for translating codons with numpy
+
+    aas is the list of amino acid letters and codon2aa maps the integer
+    16*a + 4*b + c of a codon of DNA integers (0-3) to an index in aas.
+    """
+    aas = sorted(set(aa for codon, aa in table.iteritems() if codon != "---"))
+    lookup = dict((aa, i) for i, aa in enumerate(aas))
+    codon2aa = np.zeros(64, dtype=np.int16)
+    for codon, aa in table.iteritems():
+        if codon == "---":
+            continue
+        a, b, c = [_DNA2INT[ord(x)] for x in codon]
+        codon2aa[16*a + 4*b + c] = lookup[aa]
+    return aas, codon2aa
+
+
+class AlignMatrix (object):
+    """An alignment stored as a (seqs x columns) matrix of characters"""
+
+    def __init__(self, names=None, matrix=None):
+        if names is None:
+            names = []
+        if matrix is None:
+            matrix = np.zeros((len(names), 0), dtype=np.uint8)
+        self.names = list(names)
+        self.matrix = np.asarray(matrix, dtype=np.uint8)
+        assert self.matrix.shape[0] == len(self.names)
+
+    @classmethod
+    def from_align(cls, aln):
+        """Make an AlignMatrix from an alignment (e.g. FastaDict)"""
+        names = aln.keys()
+        seqs = [aln[name] for name in names]
+        if len(set(map(len, seqs))) > 1:
+            raise Exception("sequences in alignment have different lengths")
+        matrix = np.array([np.frombuffer(seq, dtype=np.uint8)
+                           for seq in seqs], dtype=np.uint8)
+        if len(seqs) == 0:
+            matrix = None
+        return cls(names, matrix)
+
+    def to_align(self, aln=None):
+        """Returns the alignment as a FastaDict (or fills 'aln')"""
+        if aln is None:
+            aln = fasta.FastaDict()
+        for name, row in zip(self.names, self.matrix):
+            aln[name] = row.tostring()
+        return aln
+
+    def __len__(self):
+        return len(self.names)
+
+    def alignlen(self):
+        return self.matrix.shape[1]
+
+    def subalign(self, cols):
+        """Returns an AlignMatrix with a subset of the columns
+
+           cols may be a list of indices or a boolean mask"""
+        return AlignMatrix(self.names, self.matrix[:, cols])
+
+    #=========================================================================
+    # column masks
+
+    def gap_mask(self):
+        """Returns a boolean matrix that is True for gaps"""
+        return self.matrix == GAP
+
+    def count_nongaps(self):
+        """Returns the number of non-gap characters in each column"""
+        return len(self) - self.gap_mask().sum(axis=0)
+
+    def nonempty_columns(self, enforce_codon=False):
+        """
+        Returns a mask of columns that contain a non-gap character
+
+        if enforce_codon, a codon's three columns are kept together if any
+        of them contain a non-gap character
+        """
+        mask = self.count_nongaps() > 0
+        if enforce_codon:
+            if self.alignlen() % 3 != 0:
+                raise Exception(
+                    "cannot set enforce_codon if alignment length "
+                    "is not a multiple of three")
+            mask = np.repeat(mask.reshape((-1, 3)).any(axis=1), 3)
+        return mask
+
+    def ungapped_columns(self):
+        """Returns a mask of columns that contain no gaps"""
+        return ~self.gap_mask().any(axis=0)
+
+    def aligned_codon_columns(self):
+        """Returns a mask of columns of codons that have either 0 or 3 gaps
+           in every sequence"""
+        ngaps = self.gap_mask().reshape((len(self), -1, 3)).sum(axis=2)
+        good = ((ngaps == 0) | (ngaps == 3)).all(axis=0)
+        return np.repeat(good, 3)
+
+    def four_fold_columns(self, table=seqlib.CODON_TABLE):
+        """
+        Returns a mask of columns that are completely four-fold degenerate
+
+        Assumes that columns are already filtered for aligned codons.
+        As in seqlib.translate, codons containing N are unknown ('X').
+        Codons containing other non-DNA characters are also treated as
+        unknown.
+        """
+        aas, codon2aa = make_codon_lookup(table)
+        ncodons = self.alignlen() // 3
+
+        # translate every codon
+        dna = _DNA2INT[self.matrix[:, :ncodons*3]].reshape(
+            (len(self), ncodons, 3))
+        valid = (dna < 4).all(axis=2)
+        codons = (16 * dna[:, :, 0].astype(np.int16) +
+                  4 * dna[:, :, 1] + dna[:, :, 2])
+        pep = np.where(valid, codon2aa[np.where(valid, codons, 0)], -1)
+
+        # column is conserved if only one amino acid appears
+        # (ignoring gaps and unknowns)
+        low = np.where(valid, pep, len(aas)).min(axis=0)
+        high = np.where(valid, pep, -1).max(axis=0)
+        conserved = (low == high)
+
+        # lookup degeneracy of conserved amino acids
+        degen = np.array([[fold == 4 for fold in seqlib.AA_DEGEN[aa]]
+                          for aa in aas])
+        mask = np.zeros((ncodons, 3), dtype=bool)
+        mask[conserved] = degen[low[conserved]]
+
+        mask2 = np.zeros(self.alignlen(), dtype=bool)
+        mask2[:ncodons*3] = mask.ravel()
+        return mask2
+
+    #=========================================================================
+    # filters
+
+    def remove_empty_columns(self, enforce_codon=False):
+        return self.subalign(self.nonempty_columns(enforce_codon))
+
+    def remove_gapped_columns(self):
+        return self.subalign(self.ungapped_columns())
+
+    def require_nseqs(self, n):
+        """Keep only columns with atleast 'n' non gapped sequences"""
+        return self.subalign(self.count_nongaps() >= n)
+
+    def filter_aligned_codons(self):
+        return self.subalign(self.aligned_codon_columns())
+
+    def filter_four_fold(self, table=seqlib.CODON_TABLE):
+        """returns an alignment of only four-fold degenerate sites"""
+        aln = self.filter_aligned_codons()
+        return aln.subalign(aln.four_fold_columns(table))
+
+    #=========================================================================
+    # statistics
+
+    def char_counts(self, chars=None):
+        """
+        Returns (chars, counts) where counts[i, j] is the number of times
+        chars[i] appears in column j
+
+        By default, all characters present in the alignment are counted.
+        """
+        if chars is None:
+            chars = [chr(c) for c in np.unique(self.matrix)]
+        counts = np.zeros((len(chars), self.alignlen()), dtype=np.int64)
+        for i, c in enumerate(chars):
+            counts[i] = (self.matrix == ord(c)).sum(axis=0)
+        return chars, counts
+
+    def calc_conservation(self):
+        """Returns an array of percent matching in each column"""
+        chars, counts = self.char_counts()
+        counts = counts[[i for i, c in enumerate(chars) if c != "-"]]
+        if len(counts) == 0 or len(self) == 0:
+            return np.zeros(self.alignlen())
+        return counts.max(axis=0) / float(len(self))
+
+    def compute_bgfreq(self):
+        """Returns background frequencies of A, C, G, T (with pseudocounts)"""
+        counts = np.bincount(_UPPER[self.matrix].ravel(), minlength=256)
+        bgfreq = np.array([counts[ord(c)] for c in "ACGT"]) + 1
+        return list(bgfreq / float(self.matrix.size + 4))
+
+    def align2pssm(self, pseudocounts={}):
+        """Returns a Position Specific Scoring Matrix (list of dicts)"""
+        denom = float(len(self)) + sum(pseudocounts.values())
+        chars, counts = self.char_counts()
+
+        pssm = []
+        for j in xrange(self.alignlen()):
+            freqs = defaultdict(lambda: 0)
+            for i in np.flatnonzero(counts[:, j]):
+                freqs[chars[i]] = counts[i, j]
+            for key in pseudocounts:
+                freqs[key] += pseudocounts[key]
+            for key in freqs:
+                freqs[key] = math.log(freqs[key] / denom, 2)
+            pssm.append(freqs)
+        return pssm
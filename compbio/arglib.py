@@ -11,6 +11,8 @@
 from __future__ import division
 
 # python libs
+from binascii import unhexlify
+from bisect import bisect_left, bisect_right, insort
 import sys
 import random
 from itertools import izip, chain
@@ -751,6 +753,71 @@ def sample_coal_recomb_times(k, n, r, t=0):
     return times, events
 
 
+class FenwickTree (object):
+    """
+    A binary indexed tree of weights for prefix sums and weighted sampling
+    """
+
+    def __init__(self, size=0):
+        self.values = [0.0] * size
+        self.tree = [0.0] * (size + 1)
+
+    def __len__(self):
+        return len(self.values)
+
+    def _grow(self, size):
+        """Grow to hold atleast 'size' weights"""
+        values = self.values + [0.0] * (max(size, 2 * len(self.values)) -
+                                        len(self.values))
+        self.values = values
+        self.tree = tree = [0.0] + values
+        n = len(tree)
+        for i in xrange(1, n):
+            j = i + (i & -i)
+            if j < n:
+                tree[j] += tree[i]
+
+    def set(self, i, weight):
+        """Set the weight of item i"""
+        if i >= len(self.values):
+            self._grow(i + 1)
+        delta = weight - self.values[i]
+        self.values[i] = weight
+        tree = self.tree
+        n = len(tree)
+        i += 1
+        while i < n:
+            tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i):
+        """Returns the sum of the weights of items 0..i-1"""
+        tree = self.tree
+        total = 0.0
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def total(self):
+        return self.prefix(len(self.values))
+
+    def find(self, value):
+        """Returns the first item i where prefix(i+1) > value"""
+        tree = self.tree
+        n = len(tree)
+        pos = 0
+        step = 1
+        while step * 2 < n:
+            step *= 2
+        while step > 0:
+            if pos + step < n and tree[pos + step] <= value:
+                pos += step
+                value -= tree[pos]
+            step //= 2
+        return min(pos, len(self.values) - 1)
+
+
 def sample_arg(k, n, rho, start=0.0, end=1.0, t=0, names=None,
                make_names=True):
     """
@@ -765,6 +832,241 @@ def sample_arg(k, n, rho, start=0.0, end=1.0, t=0, names=None,
     names -- names to use for leaves (default: None)
     make_names -- make names using strings (default: True)
 
+    Lineages are kept in an array with a Fenwick tree of their sequence
+    lengths for sampling recombinations, and block boundaries are kept
+    sorted with a count of lineages ancestral to each block.  Ancestral
+    regions are stored merged, so that only blocks shared by both
+    lineages of a coalescence are visited.
+    """
+
+    arg = ARG(start, end)
+
+    class Lineage (object):
+        __slots__ = ["node", "regions", "seqlen", "index"]
+
+        def __init__(self, node, regions, seqlen):
+            self.node = node
+            self.regions = regions
+            self.seqlen = seqlen
+            self.index = -1
+
+    # ancestral lineages stored in an array with seqlen weights
+    lineages = []
+    weights = FenwickTree(2 * k)
+
+    def add_lineage(lineage):
+        lineage.index = len(lineages)
+        lineages.append(lineage)
+        weights.set(lineage.index, lineage.seqlen)
+
+    def remove_lineage(lineage):
+        # move last lineage into the removed slot
+        last = lineages.pop()
+        weights.set(len(lineages), 0.0)
+        if last is not lineage:
+            last.index = lineage.index
+            lineages[last.index] = last
+            weights.set(last.index, last.seqlen)
+
+    # init ancestral lineages
+    if make_names:
+        names = ["n%d" % i for i in range(k)]
+    for i in xrange(k):
+        if names is None:
+            node = arg.new_node()
+        else:
+            node = arg.new_node(name=names[i])
+        node.data["ancestral"] = [(start, end)]
+        add_lineage(Lineage(node, [(start, end)], end - start))
+    recomb_parent_lineages = {}
+    lineage_parents = {}
+
+    # sorted block starts and lineage count of each block
+    block_starts = [start]
+    block_counts = {start: k}
+
+    # perform coal, recomb
+    while len(lineages) > 1:
+        # sample time and event
+        k = len(lineages)
+        total_seqlen = weights.total()
+        coal_rate = (k * (k-1) / 2) / n  # (k choose 2) / n
+        recomb_rate = rho * total_seqlen
+        rate = coal_rate + recomb_rate
+        t2 = random.expovariate(rate)
+        event = ("coal", "recomb")[int(random.random() < (recomb_rate / rate))]
+        t += t2
+
+        # process event
+        if event == "coal":
+            node = arg.new_node(age=t, event=event)
+
+            # choose lineages to coal
+            i = random.randrange(k)
+            j = random.randrange(k - 1)
+            if j >= i:
+                j += 1
+            a, b = lineages[i], lineages[j]
+            remove_lineage(a)
+            remove_lineage(b)
+            lineage_parents[a] = node
+            lineage_parents[b] = node
+
+            # set parent, child links
+            node.children = [a.node, b.node]
+            a.node.parents.append(node)
+            b.node.parents.append(node)
+
+            # coal each non-overlapping region
+            regions = []
+            lineage_regions = []
+            nblocks = len(block_starts)
+            i = 0
+
+            for reg_start, reg_end, count in count_region_overlaps(
+                    a.regions, b.regions):
+                if count == 0:
+                    continue
+
+                if count == 2:
+                    # blocks shared by both lineages coalesce
+                    i = bisect_left(block_starts, reg_start, i)
+                    start2 = reg_start
+                    while start2 < reg_end:
+                        end2 = block_starts[i+1] if i+1 < nblocks else arg.end
+                        block_counts[start2] -= 1
+                        if block_counts[start2] > 1:
+                            # regions moves on, since not MRCA
+                            _append_region(lineage_regions, start2, end2)
+                        i += 1
+                        start2 = end2
+                else:
+                    # blocks carried by only one lineage are unchanged and
+                    # must still have other lineages (not MRCA)
+                    _append_region(lineage_regions, reg_start, reg_end)
+
+                _append_region(regions, reg_start, reg_end)  # ancestral seq
+            node.data["ancestral"] = regions
+
+            # create 1 new lineage if any regions remain
+            if len(lineage_regions) > 0:
+                seqlen = lineage_regions[-1][1] - lineage_regions[0][0]
+                add_lineage(Lineage(node, lineage_regions, seqlen))
+
+        elif event == "recomb":
+            node = arg.new_node(age=t, event=event)
+
+            # choose lineage and pos to recombine (weighted by seqlen)
+            lineage = lineages[weights.find(random.random() * total_seqlen)]
+
+            # set parent, child links
+            lineage_parents[lineage] = node
+            remove_lineage(lineage)
+            node.children = [lineage.node]
+            lineage.node.parents.append(node)
+            node.data["ancestral"] = lineage.regions
+
+            # choose recomb pos
+            node.pos = random.uniform(lineage.regions[0][0],
+                                      lineage.regions[-1][1])
+
+            # does recomb pos break an existing block?
+            for reg in lineage.regions:
+                if reg[0] < node.pos < reg[1]:
+                    if node.pos not in block_counts:
+                        # split block
+                        i = bisect_left(block_starts, node.pos)
+                        block_counts[node.pos] = \
+                            block_counts[block_starts[i-1]]
+                        insort(block_starts, node.pos)
+                    break
+
+            # create 2 new lineages
+            regions1 = list(split_regions(node.pos, 0, lineage.regions))
+            regions2 = list(split_regions(node.pos, 1, lineage.regions))
+
+            a = Lineage(node, regions1, regions1[-1][1] - regions1[0][0])
+            b = Lineage(node, regions2, regions2[-1][1] - regions2[0][0])
+            add_lineage(a)
+            add_lineage(b)
+            recomb_parent_lineages[node] = (a, b)
+        else:
+            raise Exception("unknown event '%s'" % event)
+
+    assert len(lineages) == 0, (lineages, block_counts.values())
+
+    # fix recomb parent order, so that left is before pos and right after
+    for node, (a, b) in recomb_parent_lineages.iteritems():
+        an = lineage_parents[a]
+        bn = lineage_parents[b]
+        for reg in a.regions:
+            assert reg[1] <= node.pos
+        for reg in b.regions:
+            assert reg[0] >= node.pos
+        node.parents = [an, bn]
+
+    # set root
+    arg.root = max(arg, key=lambda x: x.age)
+
+    return arg
+
+
+def iter_mask_bits(mask):
+    """Iterate through the indices of the set bits of a bitmask"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def masks2matrix(masks, nbits):
+    """
+    Returns a (len(masks) x nbits) NumPy uint8 matrix of the bits of
+    each bitmask
+    """
+    import numpy as np
+
+    nrows = len(masks)
+    nbytes = (nbits + 7) // 8
+    if nrows == 0 or nbits == 0:
+        return np.zeros((nrows, nbits), dtype=np.uint8)
+
+    # convert masks to big-endian bytes
+    fmt = "%%0%dx" % (2 * nbytes)
+    data = np.frombuffer(unhexlify("".join(fmt % mask for mask in masks)),
+                         dtype=np.uint8).reshape((nrows, nbytes))
+
+    # unpack bits so that bit i is column i
+    bits = np.unpackbits(data[:, ::-1], axis=1)
+    return np.ascontiguousarray(
+        bits.reshape((nrows, nbytes, 8))[:, :, ::-1].reshape(
+            (nrows, 8 * nbytes))[:, :nbits])
+
+
+def _append_region(regions, start, end):
+    """Append region (start, end), merging it with a preceding region"""
+    if regions and regions[-1][1] == start:
+        regions[-1] = (regions[-1][0], end)
+    else:
+        regions.append((start, end))
+
+
+def sample_arg_simple(k, n, rho, start=0.0, end=1.0, t=0, names=None,
+                      make_names=True):
+    """
+    Returns an ARG sampled from the coalescent with recombination (pruned).
+
+    This is a simpler (and slower) implementation of sample_arg().
+
+    k   -- chromosomes
+    n   -- effective population size (haploid)
+    rho -- recombination rate (recombinations / site / generation)
+    start -- staring chromosome coordinate
+    end   -- ending chromsome coordinate
+    t   -- initial time (default: 0)
+    names -- names to use for leaves (default: None)
+    make_names -- make names using strings (default: True)
+
     Returns (event, time) where
     event -- 0 for coalesce event, 1 for recombination event
     time  -- time (in generations) of event
@@ -929,10 +1231,210 @@ def sample_arg(k, n, rho, start=0.0, end=1.0, t=0, names=None,
 
 
 def sample_smc_sprs(k, n, rho, start=0.0, end=0.0, init_tree=None,
-                    names=None, make_names=True):
+                    names=None, make_names=True, smcprime=False,
+                    compact=False):
+    """
+    Sample ARG using Sequentially Markov Coalescent (SMC)
+
+    k   -- chromosomes
+    n   -- effective population size (haploid)
+    rho -- recombination rate (recombinations / site / generation)
+    start -- staring chromosome coordinate
+    end   -- ending chromsome coordinate
+    t   -- initial time (default: 0)
+    names -- names to use for leaves (default: None)
+    make_names -- make names using strings (default: True)
+    smcprime -- if True, sample from SMC' where a detached lineage may
+                recoalesce with its own branch (default: False)
+    compact -- if True, SPR leaf sets are given as bitmasks over the
+               sorted leaf names of the initial tree (default: False)
+
+    Yields the initial tree followed by SPRs
+      (pos, (recomb_leaves, recomb_time), (coal_leaves, coal_time))
+
+    The total branch length, the nodes ordered by age and the leaf set of
+    each node are updated as each SPR is applied to the local tree.
+    """
+    # yield initial tree first
+    if init_tree is None:
+        init_tree = sample_arg(k, n, rho=0.0, start=start, end=end,
+                               names=names, make_names=make_names)
+        tree = init_tree.copy()
+    else:
+        init_tree.end = end
+        tree = init_tree.get_marginal_tree(start)
+        remove_single_lineages(tree)
+    yield init_tree
+
+    # leaf bitmask of each node
+    leaves = sorted(tree.leaf_names())
+    leaf_nodes = [tree[name] for name in leaves]
+    nleaves = len(leaves)
+    masks = {}
+    for i, node in enumerate(leaf_nodes):
+        masks[node] = 1 << i
+    for node in tree.postorder():
+        if node.children:
+            masks[node] = masks[node.children[0]] | masks[node.children[1]]
+
+    # internal nodes ordered by age
+    internal = sorted((x for x in tree if not x.is_leaf()),
+                      key=lambda x: x.age)
+    ages = [x.age for x in internal]
+
+    # branch lengths stored by node slot
+    nodes = list(tree)
+    slots = dict((node, i) for i, node in enumerate(nodes))
+    weights = FenwickTree(len(nodes))
+
+    def set_branch(node):
+        weights.set(slots[node], node.get_dist())
+
+    for node in nodes:
+        set_branch(node)
+
+    def choose_lineage(time, i, nlineages, exclude):
+        # choose uniformly among the branches crossing 'time', where 'i' is
+        # the number of internal nodes younger than 'time'
+        nbelow = nleaves + i
+        if 2 * (len(internal) - i) * nlineages < nbelow:
+            # few nodes are older than time, use their children
+            lineages = [child for node in internal[i:]
+                        for child in node.children
+                        if child.age <= time and child is not exclude]
+            return random.choice(lineages)
+        else:
+            # rejection sample nodes younger than time
+            while True:
+                j = random.randrange(nbelow)
+                node = leaf_nodes[j] if j < nleaves else internal[j-nleaves]
+                if node.parents[0].age > time and node is not exclude:
+                    return node
+
+    def remove_age(node):
+        i = bisect_left(ages, node.age)
+        while internal[i] is not node:
+            i += 1
+        del ages[i]
+        del internal[i]
+
+    # sample SPRs
+    pos = start
+    while True:
+        # sample next recomb point
+        treelen = weights.total()
+        pos += random.expovariate(treelen * rho)
+        if pos > end:
+            break
+
+        # choose branch for recombination
+        recomb_node = nodes[weights.find(random.uniform(0.0, treelen))]
+        broken = recomb_node.parents[0]
+
+        # choose age for recombination
+        recomb_time = random.uniform(recomb_node.age, broken.age)
+
+        # choose coal time
+        # the recomb branch is not available for coalescence in the SMC
+        exclude = None if smcprime else recomb_node
+        coal_time = recomb_time
+        i = bisect_right(ages, recomb_time)
+        while i < len(ages):
+            nlineages = nleaves - i
+            if exclude and ages[i] <= broken.age:
+                nlineages -= 1
+            next_time = coal_time + random.expovariate(nlineages / float(n))
+
+            if next_time < ages[i]:
+                # choose coal branch
+                coal_time = next_time
+                coal_node = choose_lineage(coal_time, i, nlineages, exclude)
+                assert coal_node.age < coal_time < coal_node.parents[0].age
+                break
+
+            # coal is older than next node
+            coal_time = ages[i]
+            i += 1
+        else:
+            # coal above tree
+            coal_node = internal[-1]
+            coal_time = coal_node.age + random.expovariate(1.0 / float(n))
+
+        # yield SPR
+        rmask = masks[recomb_node]
+        cmask = masks[coal_node]
+        if compact:
+            yield pos, (rmask, recomb_time), (cmask, coal_time)
+        else:
+            yield (pos, ([leaves[j] for j in iter_mask_bits(rmask)],
+                         recomb_time),
+                   ([leaves[j] for j in iter_mask_bits(cmask)], coal_time))
+
+        if coal_node is recomb_node:
+            # recoalescence with own branch (SMC') leaves tree unchanged
+            continue
+
+        # remove recomb leaves above broken node
+        ptr = broken
+        while ptr.parents:
+            ptr = ptr.parents[0]
+            masks[ptr] &= ~rmask
+
+        # apply SPR to local tree
+        recoal = tree.new_node(age=coal_time,
+                               children=[recomb_node, coal_node])
+
+        # add recoal node to tree
+        recomb_node.parents[0] = recoal
+        broken.children.remove(recomb_node)
+        if coal_node.parents:
+            recoal.parents.append(coal_node.parents[0])
+            util.replace(coal_node.parents[0].children, coal_node, recoal)
+            coal_node.parents[0] = recoal
+        else:
+            coal_node.parents.append(recoal)
+
+        # remove broken node
+        broken_child = broken.children[0]
+        if broken.parents:
+            broken_child.parents[0] = broken.parents[0]
+            util.replace(broken.parents[0].children, broken, broken_child)
+        else:
+            broken_child.parents.remove(broken)
+        del tree.nodes[broken.name]
+
+        # add recomb leaves above recoal node
+        ptr = recoal
+        masks[ptr] = masks[recomb_node] | masks[coal_node]
+        while ptr.parents:
+            ptr = ptr.parents[0]
+            masks[ptr] |= rmask
+        del masks[broken]
+
+        # recoal node takes the slot and age order of broken node
+        slot = slots.pop(broken)
+        nodes[slot] = recoal
+        slots[recoal] = slot
+        remove_age(broken)
+        i = bisect_right(ages, coal_time)
+        ages.insert(i, coal_time)
+        internal.insert(i, recoal)
+
+        # update branch lengths
+        for node in (recomb_node, coal_node, broken_child, recoal):
+            if node is not broken:
+                set_branch(node)
+
+        tree.root = internal[-1]
+
+
+def sample_smc_sprs_simple(k, n, rho, start=0.0, end=0.0, init_tree=None,
+                           names=None, make_names=True):
     """
     Sample ARG using Sequentially Markov Coalescent (SMC)
 
+    This is a simpler (and slower) implementation of sample_smc_sprs().
+
     k   -- chromosomes
     n   -- effective population size (haploid)
     rho -- recombination rate (recombinations / site / generation)
@@ -1054,7 +1556,7 @@ def sample_smc_sprs(k, n, rho, start=0.0, end=0.0, init_tree=None,
 
 
 def sample_arg_smc(k, n, rho, start=0.0, end=0.0, init_tree=None,
-                   names=None, make_names=True):
+                   names=None, make_names=True, smcprime=False):
     """
     Returns an ARG sampled from the Sequentially Markovian Coalescent (SMC)
 
@@ -1066,11 +1568,13 @@ def sample_arg_smc(k, n, rho, start=0.0, end=0.0, init_tree=None,
 
     names -- names to use for leaves (default: None)
     make_names -- make names using strings (default: True)
+    smcprime -- if True, sample from SMC' (default: False)
     """
     it = sample_smc_sprs(k, n, rho, start=start, end=end, init_tree=init_tree,
-                         names=names, make_names=make_names)
+                         names=names, make_names=make_names,
+                         smcprime=smcprime, compact=True)
     tree = it.next()
-    arg = make_arg_from_sprs(tree, it)
+    arg = make_arg_from_sprs(tree, it, leaves=sorted(tree.leaf_names()))
 
     return arg
 
@@ -1345,7 +1849,7 @@ def remove_single_lineages(arg):
 
                 del arg.nodes[node.name]
                 child.parents.remove(node)
-                arg.root = node
+                arg.root = child
 
                 queue.append(child)
 
@@ -1433,6 +1937,210 @@ def subarg_by_leaves(arg, leaves, keep_single=False):
     return arg
 
 
+class ARGLeafIndex (object):
+    """
+    Leaf sets reachable from the nodes of an ARG, for extracting sub-ARGs
+
+    leaves   -- leaf names (bit i of a leaf set is leaves[i])
+    mask     -- leaf set of each node over the whole ARG
+    segments -- list of (start, end, mask) of each node giving its leaf set
+                for positions within [start, end)
+
+    The index is computed in one pass over the ARG.  Sub-ARGs are then
+    built by walking up from the retained leaves, so that only retained
+    nodes are visited, only the nodes of the sub-ARG are copied and the
+    ARG itself is not modified.
+    """
+
+    def __init__(self, arg):
+        self.arg = arg
+        self.leaves = list(arg.leaf_names())
+        self.lookup = dict((name, i) for i, name in enumerate(self.leaves))
+        self.full = (1 << len(self.leaves)) - 1
+        self.mask = mask = {}
+        self.segments = segments = {}
+
+        # pass the segments of each node to its parents
+        incoming = defaultdict(list)
+        for node in arg.postorder():
+            if node.children:
+                segs = _merge_segments(incoming.pop(node, ()))
+            else:
+                segs = [(arg.start, arg.end, 1 << self.lookup[node.name])]
+            segments[node] = segs
+            nodemask = 0
+            for seg in segs:
+                nodemask |= seg[2]
+            mask[node] = nodemask
+
+            for i, parent in enumerate(node.parents):
+                low, high = self.get_edge_region(node, i)
+                incoming[parent].append(
+                    [(max(start, low), min(end, high), m)
+                     for start, end, m in segs
+                     if start < high and end > low])
+
+    def get_mask(self, leaves):
+        """Returns the leaf set of a list of leaf names (or nodes)"""
+        mask = 0
+        for leaf in leaves:
+            if isinstance(leaf, ArgNode):
+                leaf = leaf.name
+            mask |= 1 << self.lookup[leaf]
+        return mask
+
+    def get_edge_region(self, node, i):
+        """Returns the region (low, high) of sequence that node passes to
+           its i'th parent"""
+        if node.event == "recomb":
+            if i == 0:
+                return -util.INF, node.pos
+            else:
+                return node.pos, util.INF
+        return -util.INF, util.INF
+
+    def get_local_mask(self, node, start, end):
+        """Returns the leaf set of a node for positions within (start, end)"""
+        mask = 0
+        if start >= end:
+            return mask
+        for seg in self.segments[node]:
+            if seg[0] >= end:
+                break
+            if seg[1] > start:
+                mask |= seg[2]
+        return mask
+
+    def subarg(self, leaves=None, start=None, end=None, keep_single=False):
+        """
+        Returns a new ARG with the ancestry of a subset of the leaves
+
+        leaves     -- leaf names (or nodes) to keep (default: all leaves)
+        start, end -- region of sequence to keep (optional)
+
+        Without a region every ancestor of the retained leaves is kept, as
+        in subarg_by_leaves().  Within a region, an edge is only kept if it
+        carries sequence of a retained leaf within (start, end).  Unless
+        'keep_single' is True, nodes with a single parent and child are
+        removed (see remove_single_lineages()).
+        """
+        arg = self.arg
+        mask = (self.full if leaves is None else self.get_mask(leaves))
+        region = (start is not None or end is not None)
+        if start is None:
+            start = arg.start
+        if end is None:
+            end = arg.end
+
+        # walk up from the retained leaves
+        queue = [arg[self.leaves[i]] for i in iter_mask_bits(mask)]
+        seen = set(queue)
+        kept_parents = {}
+        for node in queue:
+            if region:
+                parents = []
+                for i, parent in enumerate(node.parents):
+                    low, high = self.get_edge_region(node, i)
+                    if self.get_local_mask(node, max(start, low),
+                                           min(end, high)) & mask:
+                        parents.append(parent)
+            else:
+                parents = node.parents
+            kept_parents[node] = parents
+            for parent in parents:
+                if parent not in seen:
+                    seen.add(parent)
+                    queue.append(parent)
+
+        # skip over nodes with a single parent and child
+        if keep_single:
+            nodes = queue
+        else:
+            nchildren = defaultdict(lambda: 0)
+            for node in queue:
+                for parent in kept_parents[node]:
+                    nchildren[parent] += 1
+            single = set(node for node in queue
+                         if nchildren[node] == 1 and
+                         len(kept_parents[node]) == 1)
+            nodes = [node for node in queue if node not in single]
+            for node in nodes:
+                parents = []
+                for parent in kept_parents[node]:
+                    while parent in single:
+                        parent = kept_parents[parent][0]
+                    parents.append(parent)
+                kept_parents[node] = parents
+
+        # build sub-ARG
+        arg2 = ARG(start, end)
+        arg2.nextname = arg.nextname
+        for node in nodes:
+            arg2.add(node.copy())
+        for node in nodes:
+            node2 = arg2[node.name]
+            for parent in kept_parents[node]:
+                parent2 = arg2[parent.name]
+                node2.parents.append(parent2)
+                parent2.children.append(node2)
+            if not node2.parents and (arg2.root is None or
+                                      node2.age > arg2.root.age):
+                arg2.root = node2
+
+        if not keep_single:
+            remove_single_lineages(arg2)
+
+        return arg2
+
+    def subargs(self, leaf_sets, start=None, end=None, keep_single=False):
+        """Returns a sub-ARG for each set of leaves (see subarg())"""
+        return [self.subarg(leaves, start, end, keep_single=keep_single)
+                for leaves in leaf_sets]
+
+
+def _merge_segments(seglists):
+    """
+    Merge lists of (start, end, mask) segments into one list
+
+    Segments of different lists are assumed to have disjoint leaf sets
+    where they overlap, as is the case for the children of an ARG node.
+    """
+    if len(seglists) == 1:
+        return seglists[0]
+
+    events = []
+    for segs in seglists:
+        for start, end, mask in segs:
+            events.append((start, mask))
+            events.append((end, -mask))
+    events.sort()
+
+    merged = []
+    mask = 0
+    last = None
+    for pos, change in events:
+        if mask and pos > last:
+            if merged and merged[-1][1] == last and merged[-1][2] == mask:
+                merged[-1] = (merged[-1][0], pos, mask)
+            else:
+                merged.append((last, pos, mask))
+        mask += change
+        last = pos
+    return merged
+
+
+def subargs_by_leaf_names(arg, leaf_sets, start=None, end=None,
+                          keep_single=False):
+    """
+    Returns a new sub-ARG for each set of leaf names
+
+    The ARG is indexed once (see ARGLeafIndex) and is not modified.
+    If start and end are given, only the ancestry of that region is kept.
+    """
+    index = ARGLeafIndex(arg)
+    return index.subargs(leaf_sets, start, end, keep_single=keep_single)
+
+
 def apply_spr(tree, rnode, rtime, cnode, ctime, rpos):
     """
     Apply an Subtree Pruning Regrafting (SPR) operation on a tree.
@@ -1708,11 +2416,14 @@ def iter_arg_sprs_simple(arg, start=None, end=None, use_leaves=False):
 
 # TODO: more testing of ignore_self=False is needed
 def make_arg_from_sprs(init_tree, sprs, ignore_self=False,
-                       modify_self=False):
+                       modify_self=False, leaves=None):
     """
     Make an ARG from an initial tree 'init_tree' and a list of SPRs 'sprs'
 
     NOTE: sprs should indicate branches by their leaf set (use_leaves=True)
+
+    If 'leaves' is given, leaf sets are bitmasks over the list of leaf
+    names 'leaves' (see sample_smc_sprs(compact=True)).
     """
 
     def add_node(arg, node, time, pos, event):
@@ -1758,6 +2469,10 @@ def make_arg_from_sprs(init_tree, sprs, ignore_self=False,
     local = set()
 
     for rpos, (rleaves, rtime), (cleaves, ctime) in sprs:
+        if leaves is not None:
+            rleaves = [leaves[i] for i in iter_mask_bits(rleaves)]
+            cleaves = [leaves[i] for i in iter_mask_bits(cleaves)]
+
         if tree is None:
             # create first tree
             tree = arg.get_marginal_tree(rpos)
@@ -1945,6 +2660,82 @@ def arglen(arg, start=None, end=None):
     return treelen
 
 
+ARG_BLOCK_STATS = ("tmrca", "treelen", "arglen", "visible")
+
+
+def iter_arg_block_stats(arg, stats=ARG_BLOCK_STATS, pairs=(),
+                         start=None, end=None):
+    """
+    Iterate through statistics of the recombination blocks of an ARG
+
+    Yields (start, end, values) for each block between recombinations,
+    where values has one value for each name in 'stats' followed by the
+    coalescence time of each pair of leaf names in 'pairs'.
+
+    Statistics:
+      tmrca   -- age of the MRCA of all leaves
+      treelen -- total branch length of the local tree
+      arglen  -- treelen times block length (sums to arglen())
+      visible -- 1 if the recombination starting the block is visible (as
+                 in iter_visible_recombs()), 0 otherwise
+
+    All statistics are computed in one sweep along the ARG (see
+    LocalTreeSweep), where the total branch length is updated only for
+    the branches changed by each recombination.
+    """
+    for name in stats:
+        if name not in ARG_BLOCK_STATS:
+            raise Exception("unknown ARG statistic '%s'" % name)
+
+    sweep = LocalTreeSweep(arg, start, end)
+    parent = sweep.parent
+    pair_masks = []
+    for name1, name2 in pairs:
+        pair_masks.append((1 << sweep.leaves.index(name1)) |
+                          (1 << sweep.leaves.index(name2)))
+
+    # total branch length of local tree
+    treelen = [0.0]
+
+    def remove_branch(node):
+        if sweep.is_branch(node):
+            treelen[0] -= parent[node].age - node.age
+
+    def add_branch(node):
+        if sweep.is_branch(node):
+            treelen[0] += parent[node].age - node.age
+
+    for node in arg:
+        add_branch(node)
+
+    def get_values(block_start, block_end, visible):
+        values = []
+        for name in stats:
+            if name == "tmrca":
+                mrca = sweep.get_mrca()
+                values.append(mrca.age if mrca else util.INF)
+            elif name == "treelen":
+                values.append(treelen[0])
+            elif name == "arglen":
+                values.append(treelen[0] * (block_end - block_start))
+            elif name == "visible":
+                values.append(int(visible))
+        for mask in pair_masks:
+            mrca = sweep.get_mrca(mask)
+            values.append(mrca.age if mrca else util.INF)
+        return values
+
+    block_start = sweep.start
+    visible = False
+    for rnode in sweep.recombs:
+        yield (block_start, rnode.pos,
+               get_values(block_start, rnode.pos, visible))
+        visible = sweep.recombine(rnode, remove_branch, add_branch)
+        block_start = rnode.pos
+    yield (block_start, sweep.end,
+           get_values(block_start, sweep.end, visible))
+
+
 #=============================================================================
 # region functions
 
@@ -2191,6 +2982,39 @@ def split_relation(split1, split2):
     return intersect == 0 or intersect == min(len(split1), len(split2))
 
 
+def mask_relation(mask1, mask2):
+    """
+    Returns the relation of two splits given as leaf bitmasks
+
+    Relations are the same as split_relation().
+    """
+    both = mask1 & mask2
+    if both == 0:
+        return "disjoint"
+    elif both == mask1:
+        if both == mask2:
+            return "equal"
+        else:
+            return "child"
+    elif both == mask2:
+        return "parent"
+    else:
+        return "conflict"
+
+
+def is_mask_compatible(mask1, mask2, full=None):
+    """
+    Returns True if two splits given as leaf bitmasks are compatible
+
+    If 'full' (the bitmask of all leaves) is given, the splits are
+    unpolarized and compared with the four-gamete test.
+    """
+    both = mask1 & mask2
+    if both == 0 or both == mask1 or both == mask2:
+        return True
+    return full is not None and (mask1 | mask2) == full
+
+
 def iter_mutation_splits(arg, mutations):
 
     nleaves = sum(1 for x in arg.leaves())
@@ -2242,8 +3066,402 @@ def make_alignment(arg, mutations, infinite_sites=True,
     return aln
 
 
+class MutationSites (object):
+    """
+    Mutations of an ARG along with the leaves that inherit each mutation
+
+    leaves    -- leaf names
+    positions -- position of each mutation
+    times     -- age of each mutation
+    masks     -- bitmask of the leaves inheriting each mutation, where bit i
+                 is leaves[i]
+    branches  -- (node name, parent name) of each mutation's branch
+    """
+
+    def __init__(self, leaves, positions=None, times=None, masks=None,
+                 branches=None, start=0.0, end=1.0):
+        self.leaves = list(leaves)
+        self.positions = positions if positions is not None else []
+        self.times = times if times is not None else []
+        self.masks = masks if masks is not None else []
+        self.branches = branches if branches is not None else []
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return len(self.positions)
+
+    def get_leaves(self, i):
+        """Returns the names of the leaves inheriting mutation i"""
+        leaves = self.leaves
+        return [leaves[j] for j in iter_mask_bits(self.masks[i])]
+
+    def iter_mutations(self):
+        """Iterate through (pos, time, leaves) of each mutation"""
+        for i in xrange(len(self.positions)):
+            yield self.positions[i], self.times[i], self.get_leaves(i)
+
+    def genotypes(self, packed=False):
+        """
+        Returns a (sites x leaves) NumPy matrix of 0 (ancestral) and 1
+        (derived) alleles
+
+        if packed is True, each row is packed into bytes with
+        numpy.packbits()
+        """
+        import numpy as np
+
+        geno = masks2matrix(self.masks, len(self.leaves))
+        if packed:
+            return np.packbits(geno, axis=1)
+        return geno
+
+
+class LocalTreeSweep (object):
+    """
+    Sweep along an ARG while keeping the leaf set of each node in the
+    current local tree as a bitmask
+
+    leaves -- leaf names (bit i of a leaf set is leaves[i])
+    mask   -- leaf set of each node (0 for nodes outside the local tree)
+    parent -- local parent of each node
+    pos    -- current position
+    """
+
+    def __init__(self, arg, start=None, end=None):
+        self.arg = arg
+        self.start = start if start is not None else arg.start
+        self.end = end if end is not None else arg.end
+        self.pos = self.start
+        self.leaves = list(arg.leaf_names())
+        self.full = (1 << len(self.leaves)) - 1
+
+        # leaf set and local parent of each node
+        self.mask = mask = dict.fromkeys(arg, 0)
+        for i, name in enumerate(self.leaves):
+            mask[arg[name]] = 1 << i
+        self.parent = parent = {}
+        for node in sorted(arg, key=lambda x: x.age):
+            parent[node] = ptr = arg.get_local_parent(node, self.start)
+            if ptr is not None and mask[node]:
+                mask[ptr] |= mask[node]
+
+        # recombinations in sweep
+        self.recombs = sorted((node for node in arg
+                               if node.event == "recomb" and
+                               self.start < node.pos < self.end),
+                              key=lambda x: x.pos)
+
+    def is_branch(self, node):
+        """Returns True if the branch above node is in the local tree"""
+        return 0 < self.mask[node] < self.full and \
+            self.parent[node] is not None
+
+    def get_mrca(self, mask=None):
+        """Returns the lowest node of the local tree containing all the
+           leaves of 'mask' (default: all leaves)"""
+        if mask is None:
+            mask = self.full
+        if mask == 0:
+            return None
+        node = self.arg[self.leaves[(mask & -mask).bit_length() - 1]]
+        while node is not None and self.mask[node] & mask != mask:
+            node = self.parent[node]
+        return node
+
+    def recombine(self, rnode, before=None, after=None):
+        """
+        Move the sweep to recombination 'rnode'
+
+        The functions before(node) and after(node) are called before and
+        after the leaf set or local parent of a node changes.  Returns
+        True if the recombination is visible (within the local tree and
+        below its root).
+        """
+        self.pos = rnode.pos
+        mask = self.mask
+        parent = self.parent
+        old = parent[rnode]
+        new = self.arg.get_local_parent(rnode, rnode.pos)
+        rmask = mask[rnode]
+        visible = 0 < rmask < self.full
+        if rmask == 0 or old is new:
+            parent[rnode] = new
+            return visible
+
+        # find paths from the old and new parents up to where they join
+        old_path = []
+        new_path = []
+        a, b = old, new
+        while a is not b:
+            if b is None or (a is not None and a.age <= b.age):
+                old_path.append(a)
+                a = parent[a]
+            else:
+                new_path.append(b)
+                b = parent[b]
+
+        # move leaf set of recomb node from old path to new path
+        if before:
+            before(rnode)
+        for node in old_path:
+            if before:
+                before(node)
+            mask[node] &= ~rmask
+            if after:
+                after(node)
+        parent[rnode] = new
+        for node in new_path:
+            if before:
+                before(node)
+            mask[node] |= rmask
+            if after:
+                after(node)
+        if after:
+            after(rnode)
+        return visible
+
+
+def sample_mutation_sites(arg, mu, minlen=0):
+    """
+    Sample mutations on an ARG and the leaves that inherit them
+
+    mu -- mutation rate (mutations/site/gen)
+    minlen -- minimum length of an ARG branch
+
+    Mutations are placed during a single sweep along the ARG (see
+    LocalTreeSweep), where each recombination only updates the leaf sets
+    of the nodes above it.  Each branch collects mutations over every
+    interval where its leaf set does not change.
+
+    Returns a MutationSites object sorted by position.
+    """
+    sweep = LocalTreeSweep(arg)
+    mask = sweep.mask
+    parent = sweep.parent
+    positions = []
+    times = []
+    masks = []
+    branches = []
+
+    # start of the current interval of each branch in the local tree
+    branch_starts = {}
+
+    def open_branch(node):
+        if sweep.is_branch(node):
+            branch_starts[node] = sweep.pos
+
+    def close_branch(node):
+        # sample mutations on the branch above node
+        start = branch_starts.pop(node, None)
+        if start is None:
+            return
+        ptr = parent[node]
+        blen = max(ptr.age - node.age, minlen)
+        rate = blen * mu
+        if rate <= 0.0:
+            return
+        i = start
+        while True:
+            i += random.expovariate(rate)
+            if i >= sweep.pos:
+                break
+            positions.append(i)
+            times.append(random.uniform(node.age, node.age + blen))
+            masks.append(mask[node])
+            branches.append((node.name, ptr.name))
+
+    for node in arg:
+        open_branch(node)
+    for rnode in sweep.recombs:
+        sweep.recombine(rnode, close_branch, open_branch)
+    sweep.pos = sweep.end
+    for node in arg:
+        close_branch(node)
+
+    # sort mutations by position
+    order = sorted(xrange(len(positions)), key=positions.__getitem__)
+    return MutationSites(sweep.leaves,
+                         [positions[i] for i in order],
+                         [times[i] for i in order],
+                         [masks[i] for i in order],
+                         [branches[i] for i in order],
+                         start=arg.start, end=arg.end)
+
+
+def make_alignment_sites(sites, ancestral="A", derived="C"):
+    """
+    Make an alignment (FastaDict) from MutationSites
+
+    As in make_alignment(), each mutation sets the column int(pos) and
+    only the first mutation of a column is used.
+    """
+    import numpy as np
+
+    aln = fasta.FastaDict()
+    alnlen = int(sites.end - sites.start)
+    nleaves = len(sites.leaves)
+
+    # find first mutation of each column
+    cols = np.array(sites.positions, dtype=float).astype(np.int64)
+    cols, index = np.unique(cols, return_index=True)
+    keep = cols < alnlen
+    cols, index = cols[keep], index[keep]
+
+    mat = np.empty((nleaves, alnlen), dtype=np.uint8)
+    mat.fill(ord(ancestral))
+    if len(cols) > 0:
+        geno = sites.genotypes()[index].T
+        mat[:, cols] = np.where(geno, ord(derived), ord(ancestral))
+
+    for i, leaf in enumerate(sites.leaves):
+        aln[leaf] = mat[i].tostring()
+
+    return aln
+
+
+class SitePatterns (object):
+    """
+    The unique site patterns of an alignment
+
+    names     -- haplotype names (bit i of a pattern is names[i])
+    patterns  -- bitmask of the haplotypes that differ from the first
+                 haplotype at a site, in order of first appearance
+    counts    -- number of sites with each pattern
+    positions -- alignment columns of each pattern
+    columns   -- columns of all variable sites
+    site_patterns -- pattern index of each variable site
+    """
+
+    def __init__(self, names, patterns=(), counts=(), positions=(),
+                 columns=(), site_patterns=()):
+        self.names = list(names)
+        self.patterns = list(patterns)
+        self.counts = list(counts)
+        self.positions = list(positions)
+        self.columns = columns
+        self.site_patterns = site_patterns
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def get_split(self, i):
+        """
+        Returns the split of pattern i as two sorted tuples of names
+
+        The smaller side is given first (as in iter_align_splits).
+        """
+        mask = self.patterns[i]
+        part1 = tuple(sorted(name for j, name in enumerate(self.names)
+                             if not (mask >> j) & 1))
+        part2 = tuple(sorted(self.names[j] for j in iter_mask_bits(mask)))
+        if len(part1) > len(part2):
+            part1, part2 = part2, part1
+        return part1, part2
+
+    def matrix(self):
+        """Returns a (patterns x haplotypes) NumPy matrix of 0s and 1s"""
+        return masks2matrix(self.patterns, len(self.names))
+
+    def compatibility_matrix(self, chunksize=1024):
+        """
+        Returns a (patterns x patterns) boolean NumPy matrix that is True
+        for pairs of patterns passing the four-gamete test
+        """
+        import numpy as np
+
+        mat = self.matrix().astype(float)
+        nhaps = len(self.names)
+        sizes = mat.sum(axis=1)
+        compat = np.empty((len(mat), len(mat)), dtype=bool)
+
+        for i in xrange(0, len(mat), chunksize):
+            # count haplotypes with each gamete
+            n11 = mat[i:i+chunksize].dot(mat.T)
+            n10 = sizes[i:i+chunksize, None] - n11
+            n01 = sizes[None, :] - n11
+            n00 = nhaps - n11 - n10 - n01
+            compat[i:i+chunksize] = ~((n11 > 0) & (n10 > 0) &
+                                      (n01 > 0) & (n00 > 0))
+        return compat
+
+
+def get_site_patterns(aln):
+    """
+    Returns the unique site patterns (SitePatterns) of an alignment
+
+    A column is variable if any haplotype differs from the first
+    haplotype, and its pattern is the set of haplotypes that differ.
+    """
+    import numpy as np
+    from . import alignmatrix
+
+    amat = alignmatrix.AlignMatrix.from_align(aln)
+    names = amat.names
+    if len(names) == 0:
+        return SitePatterns(names)
+
+    # find variable columns
+    diff = amat.matrix != amat.matrix[0]
+    columns = np.flatnonzero(diff.any(axis=0))
+    if len(columns) == 0:
+        return SitePatterns(names, columns=columns, site_patterns=columns)
+
+    # find unique patterns of bits (last haplotype first)
+    packed = np.packbits(diff[::-1, columns].T, axis=1)
+    uniq, first, inverse, counts = np.unique(
+        packed, axis=0, return_index=True, return_inverse=True,
+        return_counts=True)
+
+    # order patterns by first appearance
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    inverse = rank[inverse]
+    uniq = uniq[order]
+    counts = counts[order]
+
+    shift = 8 * packed.shape[1] - len(names)
+    patterns = [int(row.tostring().encode("hex"), 16) >> shift
+                for row in uniq]
+    positions = np.split(columns[np.argsort(inverse, kind="mergesort")],
+                         np.cumsum(counts)[:-1])
+
+    return SitePatterns(names, patterns, [int(x) for x in counts],
+                        [list(x) for x in positions], columns, inverse)
+
+
 def iter_align_splits(aln, warn=False):
     """Iterates through the splits in an alignment"""
+    patterns = get_site_patterns(aln)
+
+    if warn and len(patterns.columns) > 0:
+        # count characters of each variable column
+        import numpy as np
+        from . import alignmatrix
+        mat = np.sort(alignmatrix.AlignMatrix.from_align(aln).matrix[
+            :, patterns.columns], axis=0)
+        nchars = 1 + (mat[1:] != mat[:-1]).sum(axis=0)
+
+    splits = {}
+    for k, (j, i) in enumerate(izip(patterns.columns,
+                                    patterns.site_patterns)):
+        # check bi-allelic
+        if warn and nchars[k] != 2:
+            print >>sys.stderr, "warning: not bi-allelic (site=%d)" % j
+
+        split = splits.get(i)
+        if split is None:
+            split = splits[i] = patterns.get_split(i)
+        yield int(j), split
+
+
+def iter_align_splits_simple(aln, warn=False):
+    """
+    Iterates through the splits in an alignment
+
+    This is a simpler (and slower) implementation of iter_align_splits().
+    """
     names = aln.keys()
 
     for j in xrange(aln.alignlen()):
@@ -2406,6 +3624,43 @@ def read_tree_tracks(filename):
         yield (int(row[0]), int(row[1])), treelib.parse_newick(row[2])
 
 
+def write_arg_block_stats(filename, arg, stats=ARG_BLOCK_STATS, pairs=(),
+                          start=None, end=None):
+    """
+    Write statistics of the recombination blocks of an ARG
+
+    The file is tab-delimited with a header of column names (start, end,
+    the statistic names and 'tmrca:name1,name2' for each pair) followed by
+    one row per block.  See iter_arg_block_stats().
+    """
+    out = util.open_stream(filename, "w")
+
+    headers = ["start", "end"] + list(stats) + [
+        "tmrca:%s,%s" % pair for pair in pairs]
+    out.write("\t".join(headers) + "\n")
+    for block_start, block_end, values in iter_arg_block_stats(
+            arg, stats, pairs, start, end):
+        util.print_row(block_start, block_end, *values, out=out)
+
+    if isinstance(filename, basestring):
+        out.close()
+
+
+def read_arg_block_stats(filename):
+    """
+    Read statistics of ARG blocks written by write_arg_block_stats()
+
+    Returns (headers, columns) where columns is a list of value lists.
+    """
+    reader = util.DelimReader(filename)
+    headers = reader.next()
+    columns = [[] for header in headers]
+    for row in reader:
+        for column, value in izip(columns, row):
+            column.append(float(value))
+    return headers, columns
+
+
 def write_mutations(filename, arg, mutations):
     out = util.open_stream(filename, "w")
 
@@ -2423,6 +3678,47 @@ def read_mutations(filename):
         yield int(row[0]), float(row[1]), chroms
 
 
+def write_mutation_sites(filename, sites):
+    """Write MutationSites in the format of write_mutations()"""
+    out = util.open_stream(filename, "w")
+
+    for pos, t, leaves in sites.iter_mutations():
+        util.print_row(pos, t, ",".join(map(str, leaves)), out=out)
+
+    if isinstance(filename, basestring):
+        out.close()
+
+
+def write_vcf(filename, sites, chrom="chr", ancestral="A", derived="C"):
+    """
+    Write MutationSites in a VCF-like format
+
+    Each mutation is a haploid biallelic site at the 1-based position
+    int(pos) + 1, with the mutation age in the INFO field.
+    """
+    out = util.open_stream(filename, "w")
+
+    out.write("##fileformat=VCFv4.1\n")
+    out.write('##INFO=<ID=AGE,Number=1,Type=Float,'
+              'Description="Age of mutation">\n')
+    out.write('##FORMAT=<ID=GT,Number=1,Type=String,'
+              'Description="Genotype">\n')
+    util.print_row("#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER",
+                   "INFO", "FORMAT", *sites.leaves, out=out)
+
+    if len(sites) > 0:
+        geno = sites.genotypes()
+        alleles = ("0", "1")
+        for i, (pos, t) in enumerate(izip(sites.positions, sites.times)):
+            out.write("%s\t%d\t.\t%s\t%s\t.\tPASS\tAGE=%s\tGT\t" %
+                      (chrom, int(pos) + 1, ancestral, derived, t))
+            out.write("\t".join(alleles[x] for x in geno[i]))
+            out.write("\n")
+
+    if isinstance(filename, basestring):
+        out.close()
+
+
 def write_ancestral(filename, arg):
     out = util.open_stream(filename, "w")
 
@@ -0,0 +1,326 @@
+"""
+    blastcluster.py
+
+    Cluster genes into families from BLAST hits using a sparse similarity
+    graph.
+
+    Gene names are interned into integer ids and each BLAST file is read once
+    into arrays of (gene1, gene2, bitscore).  The hits are stored as a
+    symmetric CSR score matrix with per-gene best scores, and families are
+    found with an array-based union-find.  Families are written as famtabs
+    readable by genecluster.FamilyDb.
+
+"""
+
+# python libs
+from array import array
+import multiprocessing
+
+# numpy libs
+import numpy as np
+
+# rasmus libs
+from rasmus import tablelib
+from rasmus import util
+
+
+class GeneIndex (object):
+    """Interns gene names into integer ids"""
+
+    def __init__(self, names=()):
+        self.names = []
+        self.lookup = {}
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.lookup
+
+    def add(self, name):
+        """Returns the id of a gene name, adding it if needed"""
+        i = self.lookup.get(name)
+        if i is None:
+            i = self.lookup[name] = len(self.names)
+            self.names.append(name)
+        return i
+
+    def get_id(self, name):
+        return self.lookup[name]
+
+    def get_name(self, i):
+        return self.names[i]
+
+    def merge(self, other):
+        """Add the genes of another index and return an array mapping its
+           ids to ids in this index"""
+        return np.array([self.add(name) for name in other.names],
+                        dtype=np.int64)
+
+
+class SparseScores (object):
+    """A symmetric sparse matrix of hit scores in CSR format"""
+
+    def __init__(self, ngenes, rows, cols, scores):
+        """
+        Build from arrays of hits.  Both directions of each hit are stored
+        and repeated hits between the same genes keep the best score.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        scores = np.asarray(scores, dtype=float)
+
+        # symmetrize and remove self hits
+        keep = rows != cols
+        rows, cols = (np.concatenate((rows[keep], cols[keep])),
+                      np.concatenate((cols[keep], rows[keep])))
+        scores = np.concatenate((scores[keep], scores[keep]))
+
+        # sort by (row, col) and keep the best score of repeated pairs
+        order = np.lexsort((cols, rows))
+        rows, cols, scores = rows[order], cols[order], scores[order]
+        if len(rows) > 0:
+            first = np.concatenate(
+                ([True], (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])))
+            starts = np.flatnonzero(first)
+            scores = np.maximum.reduceat(scores, starts)
+            rows, cols = rows[starts], cols[starts]
+
+        self.ngenes = ngenes
+        self.indptr = np.zeros(ngenes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=ngenes), out=self.indptr[1:])
+        self.indices = cols
+        self.data = scores
+
+        # best score of each gene (0 for genes without hits)
+        self.best = np.zeros(ngenes)
+        np.maximum.at(self.best, rows, scores)
+
+    def __len__(self):
+        """Returns the number of stored (directed) hits"""
+        return len(self.data)
+
+    def row_ids(self):
+        """Returns the row of each stored hit"""
+        return np.repeat(np.arange(self.ngenes), np.diff(self.indptr))
+
+    def get_hits(self, i):
+        """Returns (genes, scores) of the hits of gene i"""
+        start, end = self.indptr[i], self.indptr[i+1]
+        return self.indices[start:end], self.data[start:end]
+
+
+#=============================================================================
+# reading BLAST hits
+
+
+def read_blast_hits(blastfile, genelens=None, bitspersite=0.0,
+                    coverage=0.0, signif=util.INF):
+    """
+    Read a BLAST -m8 file in one pass
+
+    Hits are discarded if they have fewer bits per aligned site than
+    'bitspersite', an e-value larger than 'signif', or (when gene lengths
+    'genelens' are given) a coverage smaller than 'coverage' on both genes.
+
+    Returns (index, rows, cols, scores) where index is a GeneIndex of the
+    genes seen in the file.
+    """
+    index = GeneIndex()
+    add = index.add
+    rows = array("l")
+    cols = array("l")
+    scores = array("d")
+
+    infile = util.open_stream(blastfile)
+    for line in infile:
+        if line[0] in "#\n":
+            continue
+        tokens = line.rstrip("\n").split("\t")
+        if len(tokens) < 12:
+            continue
+        score = float(tokens[11])
+        alnlen = int(tokens[3])
+
+        # discard hits that do not pass basic cutoffs
+        if (score / alnlen < bitspersite or
+                float(tokens[10]) > signif):
+            continue
+        if genelens is not None:
+            cov = max((int(tokens[7]) - int(tokens[6])) /
+                      float(genelens[tokens[0]]),
+                      (int(tokens[9]) - int(tokens[8])) /
+                      float(genelens[tokens[1]]))
+            if cov < coverage:
+                continue
+
+        rows.append(add(tokens[0]))
+        cols.append(add(tokens[1]))
+        scores.append(score)
+    infile.close()
+
+    return (index, np.frombuffer(rows, dtype=np.dtype("l")),
+            np.frombuffer(cols, dtype=np.dtype("l")),
+            np.frombuffer(scores, dtype=float))
+
+
+def _read_blast_hits_task(args):
+    blastfile, kargs = args
+    return read_blast_hits(blastfile, **kargs)
+
+
+def read_blast_scores(blastfiles, index=None, nproc=1, **kargs):
+    """
+    Read many BLAST files into a SparseScores matrix
+
+    blastfiles -- BLAST -m8 files (or streams when nproc=1)
+    index      -- GeneIndex to add genes to (e.g. to include genes without
+                  hits as singleton families)
+    nproc      -- number of processes for reading files in parallel
+
+    Other keyword arguments are passed to read_blast_hits().
+    Returns (index, scores).
+    """
+    if index is None:
+        index = GeneIndex()
+
+    tasks = [(blastfile, kargs) for blastfile in blastfiles]
+    pool = None
+    if nproc > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(nproc, len(tasks)))
+        results = pool.imap(_read_blast_hits_task, tasks)
+    else:
+        results = (_read_blast_hits_task(task) for task in tasks)
+
+    # map each file's gene ids into the shared index
+    rows, cols, scores = [], [], []
+    for index2, rows2, cols2, scores2 in results:
+        remap = index.merge(index2)
+        if len(rows2) > 0:
+            rows.append(remap[rows2])
+            cols.append(remap[cols2])
+            scores.append(scores2)
+
+    if pool:
+        pool.close()
+        pool.join()
+
+    if len(rows) == 0:
+        return index, SparseScores(len(index), [], [], [])
+    return index, SparseScores(len(index), np.concatenate(rows),
+                               np.concatenate(cols),
+                               np.concatenate(scores))
+
+
+#=============================================================================
+# clustering
+
+
+def union_find(n, edges1, edges2):
+    """
+    Returns the component label of each of n items joined by edges
+
+    The union-find is performed on arrays: each round hooks the root of the
+    larger label onto the smaller label for every edge that still joins two
+    components, followed by path compression with pointer jumping.
+    Each item is labeled by the smallest item in its component.
+    """
+    parent = np.arange(n)
+    edges1 = np.asarray(edges1, dtype=np.int64)
+    edges2 = np.asarray(edges2, dtype=np.int64)
+
+    while len(edges1) > 0:
+        root1 = parent[edges1]
+        root2 = parent[edges2]
+        keep = root1 != root2
+        if not keep.any():
+            break
+        edges1, edges2 = edges1[keep], edges2[keep]
+        root1, root2 = root1[keep], root2[keep]
+
+        # hook larger roots onto smaller ones
+        np.minimum.at(parent, np.maximum(root1, root2),
+                      np.minimum(root1, root2))
+
+        # compress paths
+        while True:
+            grandparent = parent[parent]
+            if (grandparent == parent).all():
+                break
+            parent = grandparent
+
+    return parent
+
+
+def cluster_scores(scores, relcutoff=.9):
+    """
+    Returns a family label for each gene
+
+    Two genes are joined when their hit score is at least 'relcutoff' times
+    the best score of either gene (as in genecluster.mergeBuh).
+    """
+    rows = scores.row_ids()
+    cols = scores.indices
+    keep = ((scores.data >= scores.best[rows] * relcutoff) |
+            (scores.data >= scores.best[cols] * relcutoff))
+    return union_find(scores.ngenes, rows[keep], cols[keep])
+
+
+def labels2parts(index, labels):
+    """Returns a list of gene name lists from family labels"""
+    order = np.argsort(labels, kind="mergesort")
+    sorted_labels = labels[order]
+    starts = np.flatnonzero(np.concatenate(
+        ([True], sorted_labels[1:] != sorted_labels[:-1])))
+    names = index.names
+    return [[names[i] for i in part]
+            for part in np.split(order, starts[1:])]
+
+
+def make_famtab(parts, famid=0):
+    """
+    Make a family table from a list of gene name lists
+
+    Family ids are numbered from 'famid'.  This is also
+    genecluster.makeFamtab.
+    """
+
+    famtab = tablelib.Table(headers=["famid", "genes"])
+    for i, part in enumerate(parts):
+        famtab.add(famid=str(famid + i), genes=",".join(part))
+    return famtab
+
+
+def cluster_blast_families(blastfiles, famtab_file=None, genes=None,
+                           relcutoff=.9, nproc=1, **kargs):
+    """
+    Cluster genes into families from BLAST hits
+
+    blastfiles  -- BLAST -m8 files
+    famtab_file -- if given, the family table is written to this file
+    genes       -- optional list of all genes (genes without hits become
+                   singleton families)
+    relcutoff   -- relative score cutoff for joining genes
+    nproc       -- number of processes for reading BLAST files
+
+    Other keyword arguments are passed to read_blast_hits().
+    Returns the family table.
+    """
+    index = GeneIndex(genes if genes is not None else ())
+
+    util.tic("read hits")
+    index, scores = read_blast_scores(blastfiles, index=index, nproc=nproc,
+                                      **kargs)
+    util.toc()
+
+    util.tic("determine clusters")
+    labels = cluster_scores(scores, relcutoff)
+    famtab = make_famtab(labels2parts(index, labels))
+    util.toc()
+
+    if famtab_file is not None:
+        famtab.write(famtab_file)
+
+    return famtab
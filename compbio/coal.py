@@ -15,6 +15,7 @@ you must multiply N by 2 before passing it to any of these functions.
 from __future__ import division
 
 # python imports
+from collections import OrderedDict
 from itertools import chain, izip
 from math import exp, log, sqrt
 import random
@@ -112,6 +113,69 @@ def prob_coal_counts_slow(a, b, t, n):
     return s
 
 
+# recently used lineage count transition matrices
+_prob_coal_counts_cache = util.LRUCache(1000)
+
+
+def prob_coal_counts_matrix(t, n, M, cache=True):
+    """
+    Returns a (M+1) x (M+1) matrix P where P[a, b] is the probability of
+    going from 'a' lineages to 'b' lineages in time 't' with population
+    size 'n' (same as prob_coal_counts(a, b, t, n))
+
+    The matrix is the transition matrix exp(Q t) of the pure-death process
+    with rates Q[a, a-1] = a(a-1)/2n.  It is computed by uniformization and
+    squaring, which only sums nonnegative terms, so it stays accurate for
+    many lineages where the alternating series of prob_coal_counts()
+    cancels.  Matrices are kept in an LRU cache keyed on (t, n, M) and are
+    returned read-only.
+    """
+    key = (t, n, M)
+    if cache and key in _prob_coal_counts_cache:
+        return _prob_coal_counts_cache[key]
+
+    import numpy as np
+
+    P = np.zeros((M+1, M+1))
+    if t == 0 or M < 2:
+        P[1:, 1:] = np.eye(M)
+    else:
+        # uniformized generator R = I + Q/lam for lineage counts 1..M
+        a = np.arange(1, M+1)
+        rates = a * (a-1) / 2.0 / n
+        lam = rates[-1]
+        R = np.diag(1.0 - rates / lam) + np.diag(rates[1:] / lam, -1)
+
+        # exp(Q h) = sum_k Pois(k; lam h) R^k for a short step h = t/2^s
+        nsquare = max(int(np.ceil(np.log2(2 * lam * t))), 0)
+        x = lam * t / 2**nsquare
+        c = exp(-x)
+        term = np.eye(M)
+        Ph = c * term
+        k = 0
+        while c > 1e-20:
+            k += 1
+            c *= x / k
+            term = np.dot(term, R)
+            Ph += c * term
+
+        # exp(Q t) = exp(Q h)^(2^s), keeping rows stochastic
+        for i in xrange(nsquare):
+            Ph = np.dot(Ph, Ph)
+            Ph /= Ph.sum(1)[:, np.newaxis]
+        P[1:, 1:] = Ph
+
+    P.setflags(write=False)
+    if cache:
+        _prob_coal_counts_cache[key] = P
+    return P
+
+
+def clear_prob_coal_counts_cache():
+    """Clears the cache of prob_coal_counts_matrix()"""
+    _prob_coal_counts_cache.clear()
+
+
 def prob_coal_cond_counts(x, a, b, t, n):
     """
     Returns the probability density of a coalescent happening at time 'x'
@@ -507,6 +571,79 @@ def cdf_mrca_bounded_multicoal(gene_counts, T, stree, n,
 
 def calc_prob_counts_table(gene_counts, T, stree, popsizes,
                            sroot, sleaves, stimes):
+    """
+    Returns the probabilities of lineage counts at the start and end of
+    each species branch
+
+    prob_counts[node] = [start, end], where start[a] (end[b]) is the
+    probability of 'a' ('b') lineages at the start (end) of the branch.
+    The counts of two child branches are combined by convolution and
+    counts are moved along a branch with prob_coal_counts_matrix().
+    """
+    import numpy as np
+
+    # use dynamic programming to calc prob of lineage counts
+    # format: prob_counts[node] = [a, b]
+    prob_counts = {}
+    ends = {}
+
+    def walk(node):
+        if node in sleaves:
+            # leaf case
+            M = gene_counts[node.name]
+
+            # populate starting lineage counts
+            start = np.zeros(M+1)
+            start[M] = 1.0
+
+        elif len(node.children) == 2:
+            # internal node case with 2 children
+            # (ending counts are zero for zero lineages)
+            c1, c2 = node.children
+            walk(c1)
+            walk(c2)
+            start = np.convolve(ends[c1], ends[c2])
+            M = len(start) - 1
+
+        elif len(node.children) == 1:
+            # single child case
+            c1 = node.children[0]
+            walk(c1)
+            start = ends[c1]
+            M = len(start) - 1
+
+        else:
+            # unhandled case
+            raise Exception("not implemented")
+
+        # populate ending lineage counts
+        n = popsizes[node.name]
+        ptime = stimes[node.parent] if node.parent else T
+        if ptime is None:
+            # unbounded end time, i.e. complete coalescence
+            end = np.zeros(max(M, 1) + 1)
+            end[1] = 1.0
+        else:
+            # fixed end time
+            t = ptime - stimes[node]
+            end = np.dot(start, prob_coal_counts_matrix(t, n, M))
+
+        ends[node] = end
+        prob_counts[node] = [start.tolist(), end.tolist()]
+
+        assert abs(start.sum() - 1.0) < .001, (start, node.children)
+
+    walk(sroot)
+
+    return prob_counts
+
+
+def calc_prob_counts_table_slow(gene_counts, T, stree, popsizes,
+                                sroot, sleaves, stimes):
+    """
+    Computes the same table as calc_prob_counts_table() with scalar
+    functions.  Slower, but good for testing against.
+    """
 
     # use dynamic programming to calc prob of lineage counts
     # format: prob_counts[node] = [a, b]
@@ -912,9 +1049,9 @@ def sample_multicoal_tree(stree, n, leaf_counts=None,
     recon = {}
 
     # subtrees
-    subtrees = {}
+    subtrees = OrderedDict()
 
-    queue = MultiPushQueue(sleaves)
+    queue = MultiPushQueue(sorted_nodes(sleaves))
 
     # loop through species tree
     for snode in queue:
@@ -974,6 +1111,280 @@ def sample_multicoal_tree(stree, n, leaf_counts=None,
     return tree, recon
 
 
+class MultiCoalSampler (object):
+    """
+    Samples many gene trees from a multi-species coalescent at once
+
+    The species tree traversal, population sizes and species ages are
+    computed once.  All replicates are then sampled together one species
+    branch at a time, with the coalescent times and merged lineages of
+    every replicate drawn as numpy arrays.  The random numbers are drawn
+    from a numpy RandomState seeded from the random module, so seeding the
+    random module makes sampling reproducible.
+
+    The species tree is assumed to be ultrametric.
+    """
+
+    def __init__(self, stree, n, leaf_counts=None, namefunc=None,
+                 sroot=None, sleaves=None):
+        """
+        stree       -- species tree
+        n           -- population size (int or dict)
+        leaf_counts -- dict of species names to a starting gene count.
+                       Default is 1 gene per extant species.
+        namefunc    -- a function that generates new gene names given a
+                       species name.
+        """
+        if sleaves is None:
+            sleaves = set(stree.leaves())
+        if sroot is None:
+            sroot = stree.root
+        if leaf_counts is None:
+            leaf_counts = dict((l, 1) for l in stree.leaf_names())
+        if namefunc is None:
+            spcounts = dict((l, 1) for l in stree.leaf_names())
+
+            def namefunc(sp):
+                name = sp + "_" + str(spcounts[sp])
+                spcounts[sp] += 1
+                return name
+
+        popsizes = init_popsizes(stree, n)
+        stimes = treelib.get_tree_timestamps(stree, sroot, sleaves)
+
+        # species branches in postorder
+        self.snodes = []
+
+        def walk(snode):
+            if snode not in sleaves:
+                for child in snode.children:
+                    walk(child)
+            self.snodes.append(snode)
+        walk(sroot)
+        lookup = dict((snode, i) for i, snode in enumerate(self.snodes))
+
+        self.sroot = sroot
+        self.popsizes = [popsizes[snode.name] for snode in self.snodes]
+        self.ages = [stimes[snode] for snode in self.snodes]
+        self.dists = [snode.dist if snode != sroot else util.INF
+                      for snode in self.snodes]
+        self.children = [[] if snode in sleaves else
+                         [lookup[child] for child in snode.children]
+                         for snode in self.snodes]
+
+        # gene leaves of each extant species
+        self.names = []
+        self.leaf_recon = []
+        self.leaves = []
+        for i, snode in enumerate(self.snodes):
+            start = len(self.names)
+            if snode in sleaves:
+                for j in xrange(leaf_counts[snode.name]):
+                    self.names.append(namefunc(snode.name))
+                    self.leaf_recon.append(i)
+            self.leaves.append(range(start, len(self.names)))
+
+    def sample(self, nreps):
+        """
+        Returns a MultiCoalTrees of 'nreps' gene trees
+
+        Gene leaves are nodes 0..k-1 and the k-1 coalescences of each
+        replicate are numbered k..2k-2 in the order that they occur, so
+        that every node is numbered lower than its parent and the root is
+        node 2k-2.
+        """
+        import numpy as np
+
+        if nreps < 0:
+            raise Exception("nreps must be nonnegative")
+
+        rand = np.random.RandomState(random.randrange(2**32))
+        k = len(self.names)
+        nnodes = max(2*k - 1, k)
+        parents = np.empty((nreps, nnodes), dtype=np.int32)
+        parents.fill(-1)
+        ages = np.zeros((nreps, nnodes))
+        ages[:, :k] = [self.ages[i] for i in self.leaf_recon]
+        recon = np.zeros((nreps, nnodes), dtype=np.int32)
+        recon[:, :k] = self.leaf_recon
+        nextid = np.empty(nreps, dtype=np.int32)
+        nextid.fill(k)
+
+        # lineages[i] = (lins, counts) where lins[r, :counts[r]] are the
+        # lineages of replicate r leaving species branch i
+        lineages = {}
+        for i in xrange(len(self.snodes)):
+            # collect lineages entering the branch
+            if self.children[i]:
+                lins, counts = _concat_lineages(
+                    [lineages.pop(j) for j in self.children[i]], nreps)
+            else:
+                lins = np.empty((nreps, len(self.leaves[i])),
+                                dtype=np.int32)
+                lins[:] = self.leaves[i]
+                counts = np.empty(nreps, dtype=np.int32)
+                counts.fill(len(self.leaves[i]))
+
+            # coalesce lineages within the branch
+            n = self.popsizes[i]
+            dist = self.dists[i]
+            times = np.zeros(nreps)
+            rows = np.flatnonzero(counts >= 2)
+            while len(rows) > 0:
+                c = counts[rows]
+                t = times[rows] + rand.exponential(2.0 * n / (c * (c-1)))
+                keep = t < dist
+                rows, c, t = rows[keep], c[keep], t[keep]
+                times[rows] = t
+
+                # merge a random pair of lineages
+                a = (rand.random_sample(len(rows)) * c).astype(np.int32)
+                b = (rand.random_sample(len(rows)) * (c-1)).astype(np.int32)
+                b += (b >= a)
+                new = nextid[rows]
+                parents[rows, lins[rows, a]] = new
+                parents[rows, lins[rows, b]] = new
+                ages[rows, new] = self.ages[i] + t
+                recon[rows, new] = i
+                nextid[rows] += 1
+                lins[rows, a] = new
+                lins[rows, b] = lins[rows, c-1]
+                counts[rows] -= 1
+                rows = rows[counts[rows] >= 2]
+
+            width = counts.max() if nreps > 0 else 0
+            lineages[i] = (lins[:, :max(width, 1)], counts)
+
+        return MultiCoalTrees(self.names, self.snodes, parents, ages, recon)
+
+
+def _concat_lineages(lineages, nreps):
+    """Concatenate the lineages of several species branches"""
+    import numpy as np
+
+    width = sum(lins.shape[1] for lins, counts in lineages)
+    lins2 = np.zeros((nreps, width), dtype=np.int32)
+    counts2 = np.zeros(nreps, dtype=np.int32)
+    for lins, counts in lineages:
+        rows, cols = np.nonzero(
+            np.arange(lins.shape[1])[np.newaxis, :] < counts[:, np.newaxis])
+        lins2[rows, counts2[rows] + cols] = lins[rows, cols]
+        counts2 += counts
+    return lins2, counts2
+
+
+class MultiCoalTrees (object):
+    """
+    Gene trees sampled by MultiCoalSampler stored as arrays
+
+    names   -- names of the gene leaves (nodes 0..k-1)
+    snodes  -- species branches
+    parents -- parents[r, i] is the parent of node i in replicate r (-1 for
+               the root)
+    ages    -- ages[r, i] is the age of node i in replicate r
+    recon   -- recon[r, i] is the species branch (index into snodes) of
+               node i in replicate r
+    """
+
+    def __init__(self, names, snodes, parents, ages, recon):
+        self.names = names
+        self.snodes = snodes
+        self.parents = parents
+        self.ages = ages
+        self.recon = recon
+        self._children = None
+
+    def __len__(self):
+        return len(self.parents)
+
+    def get_children(self):
+        """
+        Returns an array where children[r, j] are the two children of
+        node k+j in replicate r
+        """
+        import numpy as np
+
+        if self._children is None:
+            # sorting nodes by parent groups the children of each node
+            k = len(self.names)
+            order = np.argsort(self.parents, axis=1, kind="mergesort")
+            self._children = order[:, 1:].reshape((len(self), k-1, 2))
+        return self._children
+
+    def get_dists(self):
+        """Returns the branch length above each node (0 for the root)"""
+        import numpy as np
+
+        rows = np.arange(len(self))[:, np.newaxis]
+        dists = self.ages[rows, self.parents] - self.ages
+        dists[self.parents == -1] = 0.0
+        return dists
+
+    def iter_newick(self):
+        """Iterates over the gene trees as one line newick strings"""
+        k = len(self.names)
+        if k == 1:
+            for i in xrange(len(self)):
+                yield self.names[0] + ";"
+            return
+
+        children = self.get_children()
+        dists = self.get_dists()
+        for i in xrange(len(self)):
+            strs = self.names + [None] * (k-1)
+            dist = dists[i].tolist()
+            for j, (c1, c2) in enumerate(children[i].tolist()):
+                strs[k+j] = "(%s:%f,%s:%f)" % (
+                    strs[c1], dist[c1], strs[c2], dist[c2])
+            yield strs[-1] + ";"
+
+    def get_newick(self, i):
+        """Returns gene tree 'i' as a one line newick string"""
+        for newick in MultiCoalTrees(
+                self.names, self.snodes, self.parents[i:i+1],
+                self.ages[i:i+1], self.recon[i:i+1]).iter_newick():
+            return newick
+
+    def write_newick(self, filename):
+        """Writes the gene trees as newick strings (one per line)"""
+        out = util.open_stream(filename, "w")
+        for newick in self.iter_newick():
+            out.write(newick)
+            out.write("\n")
+        if out is not filename:
+            out.close()
+
+    def get_tree(self, i):
+        """Returns gene tree 'i' and its reconciliation as (tree, recon)"""
+        k = len(self.names)
+        tree = treelib.Tree()
+        nodes = [tree.add(treelib.TreeNode(name)) for name in self.names]
+        for j in xrange(k, len(self.parents[i])):
+            nodes.append(tree.add(treelib.TreeNode(tree.new_name())))
+        dists = self.get_dists()[i]
+        for j, parent in enumerate(self.parents[i]):
+            if parent == -1:
+                tree.root = nodes[j]
+            else:
+                tree.add_child(nodes[parent], nodes[j])
+            nodes[j].dist = float(dists[j])
+        recon = dict((node, self.snodes[self.recon[i, j]])
+                     for j, node in enumerate(nodes))
+        return tree, recon
+
+
+def sample_multicoal_trees(stree, n, nreps, leaf_counts=None,
+                           namefunc=None, sroot=None, sleaves=None):
+    """
+    Returns 'nreps' gene trees from a multi-species coalescence process as a
+    MultiCoalTrees object (see MultiCoalSampler and sample_multicoal_tree)
+    """
+    sampler = MultiCoalSampler(stree, n, leaf_counts=leaf_counts,
+                               namefunc=namefunc, sroot=sroot,
+                               sleaves=sleaves)
+    return sampler.sample(nreps)
+
+
 def sample_bounded_multicoal_tree(stree, n, T, leaf_counts=None, namefunc=None,
                                   sroot=None, sleaves=None, stimes=None,
                                   gene_counts=None):
@@ -1144,11 +1555,11 @@ def coal_cond_lineage_counts(lineages, sroot, sleaves, popsizes, stimes, T,
 
     # init reconciliation and subtree dicts
     recon = {}
-    subtrees = {}
+    subtrees = OrderedDict()
     caps = set()
 
     # sample coalescent times
-    queue = MultiPushQueue(sleaves)
+    queue = MultiPushQueue(sorted_nodes(sleaves))
 
     # loop through species tree
     for snode in queue:
@@ -1269,7 +1680,7 @@ def sample_bounded_multicoal_tree_reject(stree, n, T, leaf_counts=None,
 
     reject = 0
     while True:
-        queue = MultiPushQueue(sleaves)
+        queue = MultiPushQueue(sorted_nodes(sleaves))
 
         # init gene counts
         counts = dict((n.name, 0) for n in stree)
@@ -1279,7 +1690,7 @@ def sample_bounded_multicoal_tree_reject(stree, n, T, leaf_counts=None,
         recon = {}
 
         # subtrees
-        subtrees = {}
+        subtrees = OrderedDict()
 
         # loop through species tree
         for snode in queue:
@@ -1361,11 +1772,11 @@ def make_tree_from_times(times, k=None, t=None, leaves=None, capped=False):
 
     tree = treelib.Tree()
 
-    # initialize k children
+    # initialize k children (a list, so that merges are reproducible)
     if leaves is None:
-        children = set(treelib.TreeNode(tree.new_name()) for i in xrange(k))
+        children = [treelib.TreeNode(tree.new_name()) for i in xrange(k)]
     else:
-        children = set(treelib.TreeNode(name) for name in leaves)
+        children = [treelib.TreeNode(name) for name in leaves]
     for child in children:
         tree.add(child)
         child.data["time"] = 0.0
@@ -1380,10 +1791,10 @@ def make_tree_from_times(times, k=None, t=None, leaves=None, capped=False):
         tree.add_child(parent, a)
         tree.add_child(parent, b)
 
-        # adjust children set
+        # adjust children list
         children.remove(a)
         children.remove(b)
-        children.add(parent)
+        children.append(parent)
 
     # set branch lengths
     for node in tree:
@@ -1449,6 +1860,17 @@ def mle_popsize_tree(tree):
 #=============================================================================
 # helper data structures
 
+def sorted_nodes(nodes):
+    """
+    Returns nodes sorted by name
+
+    Iterating over a set of nodes depends on their memory addresses, so
+    nodes are sorted before sampling to make samples reproducible from
+    the random seed.
+    """
+    return sorted(nodes, key=lambda node: node.name)
+
+
 class MultiPushQueue (object):
     """
     A queue that requires multiple pushes before item is queued
@@ -1761,6 +2183,215 @@ def freq_pdf(x, p, n, t, k=8):
     return sgn * exp(prob)
 
 
+#=============================================================================
+# allele frequency series on arrays
+
+# recently used polynomial tables of small grids of r
+_poly_table_cache = util.LRUCache(100)
+POLY_TABLE_CACHE_SIZE = 1000
+
+
+def legendre_table(r, k, cache=None):
+    """
+    Returns an array L where L[n] is the Legendre polynomial P_n(r) for
+    n = 0..k
+
+    'r' may be a number or an array and L has shape (k+1,) + shape(r).
+    The table is built with the same recurrence as legendre().  If 'cache'
+    is True, or if it is None and 'r' has at most POLY_TABLE_CACHE_SIZE
+    values (e.g. a grid of frequencies), the table is kept in an LRU cache.
+    Cached tables are returned read-only.
+    """
+    return _poly_table("legendre", r, k, cache)
+
+
+def gegenbauer_table(r, k, cache=None):
+    """
+    Returns an array C where C[n] is the Gegenbauer polynomial
+    C^(3/2)_n(r) (the derivative of P_{n+1}(r)) for n = 0..k
+
+    The hypergeometric terms of freq_pdf() are
+    hypergeo(1-i, i+2, 2, z) = 2 C[i-1] / (i (i+1)) with r = 1 - 2z.
+    """
+    return _poly_table("gegenbauer", r, k, cache)
+
+
+def _poly_table(kind, r, k, cache):
+    import numpy as np
+
+    r = np.asarray(r, dtype=float)
+    if cache is None:
+        cache = (r.size <= POLY_TABLE_CACHE_SIZE)
+    if cache:
+        key = (kind, k, r.shape, r.tostring())
+        if key in _poly_table_cache:
+            return _poly_table_cache[key]
+
+    table = np.empty((k+1,) + r.shape)
+    table[0] = 1.0
+    if kind == "legendre":
+        if k >= 1:
+            table[1] = r
+        for n in xrange(2, k+1):
+            table[n] = ((2*n - 1) * r * table[n-1] - (n-1) * table[n-2]) / n
+    else:
+        if k >= 1:
+            table[1] = 3 * r
+        for n in xrange(2, k+1):
+            table[n] = ((2*n + 1) * r * table[n-1] - (n+1) * table[n-2]) / n
+
+    if cache:
+        table.setflags(write=False)
+        _poly_table_cache[key] = table
+    return table
+
+
+def _expand_dims(*arrays):
+    """Returns arrays with leading axes added so that they have the same
+       number of dimensions"""
+    import numpy as np
+
+    arrays = [np.asarray(x, dtype=float) for x in arrays]
+    nd = max(x.ndim for x in arrays)
+    return [x.reshape((1,) * (nd - x.ndim) + x.shape) for x in arrays]
+
+
+def _freq_series(p, N, t, factors, k):
+    """
+    Returns the sum over i = 1..k of the terms
+    .5 * (P_{i-1}(r) - P_{i+1}(r)) * exp(-i(i+1) t / 4N) * factors[i-1]
+    where r = 1 - 2p
+    """
+    import numpy as np
+
+    leg = legendre_table(1.0 - 2*p, k+1, cache=False)
+    t4n = t / (4.0 * N)
+    s = 0.0
+    for i in xrange(1, k+1):
+        s = s + (.5 * (leg[i-1] - leg[i+1]) * factors[i-1] *
+                 np.exp(-i * (i+1) * t4n))
+    return s
+
+
+def prob_fix_array(p, n, t, k=50):
+    """
+    Probability of fixation (see prob_fix) for arrays of frequencies 'p',
+    population sizes 'n' and times 't'
+
+    Arguments are broadcast together and all k terms are summed.
+    """
+    p, n, t = _expand_dims(p, n, t)
+    signs = [(-1.0) ** i for i in xrange(1, k+1)]
+    return p + _freq_series(p, n, t, signs, k)
+
+
+def freq_CDF_array(p, N, t, T, k=50):
+    """
+    Evaluates the CDF derived from Kimura (see freq_CDF) for arrays of
+    starting frequencies 'p', population sizes 'N', times 't' and upper
+    limits 'T'
+
+    Arguments are broadcast together, e.g. p[:, None] and T[None, :] give
+    a matrix of CDFs.
+    """
+    import numpy as np
+
+    p, N, t, T = _expand_dims(p, N, t, T)
+    leg_T = legendre_table(1.0 - 2*T, k)
+    s = (prob_fix_array(1.0 - p, N, t, k) +
+         _freq_series(p, N, t, 1 - leg_T[1:], k))
+    return s + np.where(T >= 1.0, prob_fix_array(p, N, t, k), 0.0)
+
+
+def freq_prob_range_array(p, N, t, T1, T2, k=50):
+    """
+    Probability of a frequency between T1 and T2 excluding loss and
+    fixation (see freq_prob_range) for arrays of arguments
+    """
+    p, N, t, T1, T2 = _expand_dims(p, N, t, T1, T2)
+    factors = legendre_table(1.0 - 2*T1, k)[1:] - \
+        legendre_table(1.0 - 2*T2, k)[1:]
+    return _freq_series(p, N, t, factors, k)
+
+
+def freq_pdf_array(x, p, n, t, k=8):
+    """
+    Probability density of frequency 'x' (see freq_pdf) for arrays of
+    arguments
+
+    The hypergeometric terms are evaluated with gegenbauer_table().
+    """
+    import numpy as np
+
+    x, p, n, t = _expand_dims(x, p, n, t)
+    geg_x = gegenbauer_table(1.0 - 2*x, k-1)
+    geg_p = gegenbauer_table(1.0 - 2*p, k-1, cache=False)
+    t4n = t / (4.0 * n)
+    s = 0.0
+    for i in xrange(1, k+1):
+        s = s + ((2*i + 1) / float(i * (i+1)) * geg_p[i-1] * geg_x[i-1] *
+                 np.exp(-i * (i+1) * t4n))
+    return 4 * p * (1.0 - p) * s
+
+
+def sample_freq_CDF_array(p, N, t, k=50, ngrid=100, tol=1e-10):
+    """
+    Samples new allele frequencies (see sample_freq_CDF) for arrays of
+    starting frequencies 'p', population sizes 'N' and times 't'
+
+    Loss and fixation are sampled as in sample_freq_CDF().  Otherwise the
+    partial CDF of every sample is evaluated on a grid of 'ngrid'
+    frequencies to bracket the new frequency, which is then refined by
+    bisection until the bracket is smaller than 'tol'.  Random numbers are
+    drawn from a numpy RandomState seeded from the random module.
+    """
+    import numpy as np
+
+    p, N, t = np.broadcast_arrays(*_expand_dims(p, N, t))
+    shape = p.shape
+    p, N, t = p.ravel(), N.ravel(), t.ravel()
+    rand = np.random.RandomState(random.randrange(2**32))
+    y = rand.random_sample(len(p))
+
+    # special cases, loss and fixation
+    freqs = p.copy()
+    extinction = prob_fix_array(1.0 - p, N, t, k)
+    fixation = prob_fix_array(p, N, t, k)
+    sample = (p > 0.0) & (p < 1.0) & (t != 0.0)
+    freqs[sample & (y < extinction)] = 0.0
+    freqs[sample & (y > 1.0 - fixation)] = 1.0
+    rows = np.flatnonzero(sample & (y >= extinction) &
+                          (y <= 1.0 - fixation))
+    if len(rows) == 0:
+        return freqs.reshape(shape)
+    target = y[rows] - extinction[rows]
+
+    # series coefficients of each sample
+    leg = legendre_table(1.0 - 2*p[rows], k+1, cache=False)
+    i = np.arange(1, k+1)[:, np.newaxis]
+    coefs = (.5 * (leg[:-2] - leg[2:]) *
+             np.exp(-i * (i+1) * (t[rows] / (4.0 * N[rows]))))
+
+    # bracket new frequencies with the CDF on a grid
+    grid = np.linspace(0.0, 1.0, ngrid+1)
+    cdf = np.dot(coefs.T, 1 - legendre_table(1.0 - 2*grid, k)[1:])
+    above = cdf >= target[:, np.newaxis]
+    high = np.where(above.any(axis=1), above.argmax(axis=1), ngrid)
+    low = grid[np.maximum(high - 1, 0)]
+    high = grid[high]
+
+    # refine by bisection
+    while (high - low).max() > tol:
+        mid = (low + high) / 2.0
+        leg_mid = legendre_table(1.0 - 2*mid, k, cache=False)
+        below = (coefs * (1 - leg_mid[1:])).sum(axis=0) < target
+        low = np.where(below, mid, low)
+        high = np.where(below, high, mid)
+
+    freqs[rows] = (low + high) / 2.0
+    return freqs.reshape(shape)
+
+
 #=============================================================================
 
 if __name__ == "__main__":
@@ -1781,6 +2412,32 @@ if __name__ == "__main__":
         loghypergeo(a, b, c, z, k)
     util.toc()
 
+    #========================
+    # allele frequency speed, scalar vs. arrays
+
+    N = 1000
+    T = [i / 100.0 for i in xrange(101)]
+    times = [[10.0 * (i+1)] for i in xrange(20)]
+
+    util.tic("freq_CDF %d values" % (len(T) * len(times)))
+    for t in times:
+        for y in T:
+            freq_CDF(.3, N, t[0], y)
+    util.toc()
+
+    util.tic("freq_CDF_array")
+    freq_CDF_array(.3, N, times, T)
+    util.toc()
+
+    util.tic("sample_freq_CDF 500 samples")
+    for i in xrange(500):
+        sample_freq_CDF(.3, N, 200.0)
+    util.toc()
+
+    util.tic("sample_freq_CDF_array")
+    sample_freq_CDF_array([.3] * 500, N, 200.0)
+    util.toc()
+
     if 0:
         p0 = .5
         k = 30
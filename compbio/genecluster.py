@@ -13,6 +13,7 @@ from itertools import izip
 
 # rasmus libs
 from compbio import blast
+from compbio import blastcluster
 from compbio.cluster import item2part
 from compbio.cluster import unionPart
 from compbio.sets import UnionFind
@@ -398,15 +399,8 @@ def makeBlastFileLookup(blastfiles):
 #
 
 
-def makeFamtab(parts, famid=0):
-    """Make Family Table"""
-
-    famtab = tablelib.Table(headers=["famid", "genes"])
-
-    for i, part in enumerate(parts):
-        famtab.add(famid=str(famid + i),
-                   genes=",".join(part))
-    return famtab
+# Make Family Table
+makeFamtab = blastcluster.make_famtab
 
 
 def famtab2parts(famtab):
@@ -1,4 +1,11 @@
 
+# python libs
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import izip
+import mmap
+
+# rasmus libs
 from rasmus import util
 from rasmus import tablelib
 
@@ -117,3 +124,269 @@ class GenomeAlign (object):
             cataln[key] = "".join(cataln[key])
 
         return cataln
+
+
+#=============================================================================
+# indexed alignment store
+#
+# The store is a binary data file and a tab-delimited index (filename.idx)
+# with one row per alignment block.  Each block in the data file is laid out
+# as follows:
+#
+#   names      -- tab-delimited sequence names ending with a newline
+#   lens       -- int32[nrows], length of each row (0 for empty rows)
+#   nres       -- int32[nrows], number of non-gap characters in each row
+#   rows       -- the aligned characters of each non-empty row
+#   checkpoints -- for each row, int32[nres // step + 1] giving the column of
+#                  every step'th non-gap character
+#
+# Integers are written in native byte order.
+
+ALIGN_STORE_MAGIC = "#alignstore\n"
+
+
+class AlignStoreWriter (object):
+    """Writes alignment blocks into an indexed alignment store"""
+
+    def __init__(self, filename, step=256):
+        self.filename = filename
+        self.step = step
+        self.out = open(filename, "wb")
+        self.out.write(ALIGN_STORE_MAGIC)
+        self.index = tablelib.Table(headers=[
+            "species", "chromosome", "start", "end",
+            "offset", "nrows", "alignlen", "step"])
+
+    def add(self, species, chrom, start, end, aln):
+        """Add an alignment block that spans [start, end] of chrom"""
+
+        names = aln.keys()
+        rows = [aln[name] for name in names]
+        alignlen = max([len(row) for row in rows] + [0])
+
+        offset = self.out.tell()
+        self.out.write("\t".join(names) + "\n")
+        self.out.write(array("i", [len(row) for row in rows]).tostring())
+        self.out.write(array("i", [len(row) - row.count("-")
+                                   for row in rows]).tostring())
+        for row in rows:
+            if len(row) not in (0, alignlen):
+                raise Exception("sequence lengths differ in alignment")
+            self.out.write(row)
+
+        step = self.step
+        for row in rows:
+            self.out.write(array("i", alignlib.local2align(row)[::step])
+                           .tostring())
+
+        self.index.append({"species": species,
+                           "chromosome": chrom,
+                           "start": start,
+                           "end": end,
+                           "offset": offset,
+                           "nrows": len(rows),
+                           "alignlen": alignlen,
+                           "step": step})
+
+    def close(self):
+        self.out.close()
+        self.index.write(self.filename + ".idx", comments=True)
+
+
+def write_align_store(filename, master_file, step=256):
+    """Convert the alignments listed in a GenomeAlign master file into an
+       indexed alignment store"""
+
+    writer = AlignStoreWriter(filename, step=step)
+    for row in tablelib.iter_table(master_file):
+        writer.add(row["species"], row["chromosome"], row["start"],
+                   row["end"], fasta.read_fasta(row["filename"]))
+    writer.close()
+
+
+class AlignBlock (object):
+    """The layout of one block in an alignment store"""
+
+    def __init__(self, data, record):
+        self.record = record
+        self.alignlen = record["alignlen"]
+        self.step = record["step"]
+        nrows = record["nrows"]
+
+        # read names
+        offset = record["offset"]
+        end = data.find("\n", offset)
+        self.names = data[offset:end].split("\t") if nrows > 0 else []
+        offset = end + 1
+
+        # read row lengths and residue counts
+        size = array("i").itemsize
+        self.lens = array("i", data[offset:offset + nrows*size])
+        offset += nrows * size
+        self.nres = array("i", data[offset:offset + nrows*size])
+        offset += nrows * size
+
+        # row offsets
+        self.row_offsets = []
+        for l in self.lens:
+            self.row_offsets.append(offset)
+            offset += l
+
+        # checkpoint tables
+        self.checkpoints = []
+        for l, n in izip(self.lens, self.nres):
+            nchecks = (n + self.step - 1) // self.step if l > 0 else 0
+            self.checkpoints.append(
+                array("i", data[offset:offset + nchecks*size]))
+            offset += nchecks * size
+
+    def get_row(self, data, row, start, end):
+        """Returns columns [start, end) of a row"""
+        if self.lens[row] == 0:
+            return ""
+        offset = self.row_offsets[row]
+        return data[offset + start:offset + end]
+
+    def residue2col(self, data, row, i):
+        """Returns the column of the i'th non-gap character of a row"""
+        if i < 0:
+            i += self.nres[row]
+        if not 0 <= i < self.nres[row]:
+            raise IndexError("residue index out of range")
+
+        # jump to nearest checkpoint and scan forward
+        j, k = divmod(i, self.step)
+        col = self.checkpoints[row][j]
+        if k == 0:
+            return col
+        if j + 1 < len(self.checkpoints[row]):
+            end = self.checkpoints[row][j+1]
+        else:
+            end = self.alignlen
+        chunk = self.get_row(data, row, col, end)
+        for l, c in enumerate(chunk):
+            if c != "-":
+                if k == 0:
+                    return col + l
+                k -= 1
+        raise IndexError("residue index out of range")
+
+
+class AlignStore (GenomeAlign):
+    """
+    GenomeAlign backed by an indexed alignment store
+
+    Blocks overlapping a query are found with a per-(species, chrom) sorted
+    index and only the needed columns are read from a memory map of the
+    data file.  The layouts of recently used blocks are kept in an LRU cache.
+    """
+
+    def __init__(self, filename=None, seq2species=lambda x: x,
+                 cache_size=1000):
+        self.seq2species = seq2species
+        self.records = []
+        self.lookup = {}
+        self.cache = util.LRUCache(cache_size)
+        self.data = None
+        self._infile = None
+
+        if filename is not None:
+            self.read(filename)
+
+    def read(self, filename):
+        self.close()
+        self.records = list(tablelib.iter_table(filename + ".idx"))
+
+        # build sorted index for each (species, chrom)
+        lookup = {}
+        for i, record in enumerate(self.records):
+            lookup.setdefault((record["species"], record["chromosome"]),
+                              []).append(i)
+        self.lookup = {}
+        for key, ind in lookup.iteritems():
+            ind.sort(key=lambda i: self.records[i]["start"])
+            starts = [self.records[i]["start"] for i in ind]
+            maxends = []
+            maxend = -util.INF
+            for i in ind:
+                maxend = max(maxend, self.records[i]["end"])
+                maxends.append(maxend)
+            self.lookup[key] = (ind, starts, maxends)
+
+        self._infile = open(filename, "rb")
+        self.data = mmap.mmap(self._infile.fileno(), 0,
+                              access=mmap.ACCESS_READ)
+        if self.data[:len(ALIGN_STORE_MAGIC)] != ALIGN_STORE_MAGIC:
+            raise Exception("'%s' is not an alignment store" % filename)
+
+    def close(self):
+        self.cache.clear()
+        if self.data is not None:
+            self.data.close()
+            self._infile.close()
+            self.data = None
+            self._infile = None
+
+    def _get_indices(self, species, chrom, start, end):
+        if (species, chrom) not in self.lookup:
+            return []
+        ind, starts, maxends = self.lookup[(species, chrom)]
+        low = bisect_left(maxends, start)
+        high = bisect_right(starts, end)
+        return [i for i in ind[low:high]
+                if util.overlap(start, end, self.records[i]["start"],
+                                self.records[i]["end"])]
+
+    def get(self, species, chrom, start, end):
+        return [self.records[i]
+                for i in self._get_indices(species, chrom, start, end)]
+
+    def get_block(self, i):
+        """Returns the layout of the i'th block"""
+        block = self.cache.get(i)
+        if block is None:
+            block = AlignBlock(self.data, self.records[i])
+            self.cache[i] = block
+        return block
+
+    def get_aligns(self, species, chrom, start, end,
+                   mainspecies=lambda keys: keys[0],
+                   collapse=False):
+        """By default assumes main species is 1st sequence"""
+
+        data = self.data
+        alns = []
+        for i in self._get_indices(species, chrom, start, end):
+            record = self.records[i]
+            block = self.get_block(i)
+            main = block.names.index(mainspecies(block.names))
+
+            # trim front
+            if start > record["start"]:
+                trimstart = block.residue2col(
+                    data, main, start - record["start"])
+            else:
+                trimstart = 0
+
+            # trim end
+            if end < record["end"]:
+                trimend = block.residue2col(
+                    data, main, -(record["end"] - end))
+            else:
+                trimend = block.alignlen
+
+            # read only the needed columns
+            aln = fasta.FastaDict()
+            for j, name in enumerate(block.names):
+                aln[name] = block.get_row(data, j, trimstart, trimend)
+
+            # collapse alignment
+            if collapse:
+                ind = util.findneq("-", aln[block.names[main]])
+                for key, seq in aln.iteritems():
+                    if len(seq) != 0:
+                        aln[key] = "".join(util.mget(seq, ind))
+
+            alns.append(aln)
+
+        return alns
@@ -0,0 +1,151 @@
+"""
+    replicates.py
+
+    Reproducible simulation of replicates in parallel.
+
+    The coalescent and birth-death samplers draw from the global random
+    module.  Here each replicate seeds the random module with its own seed,
+    derived from a base seed and the replicate number, before calling the
+    sampler.  The results of a replicate therefore do not depend on which
+    process runs it or on how many processes are used.
+
+"""
+
+# python libs
+import hashlib
+from itertools import imap
+import multiprocessing
+import random
+import StringIO
+
+# compbio libs
+from . import arglib
+from . import birthdeath
+from . import coal
+
+
+# models that can be simulated by name
+MODELS = {
+    "arg": arglib.sample_arg,
+    "arg_smc": arglib.sample_arg_smc,
+    "multicoal": coal.sample_multicoal_tree,
+    "bounded_multicoal": coal.sample_bounded_multicoal_tree,
+    "birthdeath": birthdeath.sample_birth_death_gene_tree,
+}
+
+
+def derive_seed(seed, replicate):
+    """Returns the seed of a replicate derived from a base seed"""
+    digest = hashlib.sha1("%d:%d" % (seed, replicate)).hexdigest()
+    return int(digest[:16], 16)
+
+
+def get_model(model):
+    """Returns the sampling function of a model (a name in MODELS or a
+       function)"""
+    if callable(model):
+        return model
+    try:
+        return MODELS[model]
+    except KeyError:
+        raise Exception("unknown model '%s'" % model)
+
+
+def run_replicate(func, args, kargs, seed, summary=None):
+    """
+    Run one replicate of func(*args, **kargs) with the random module seeded
+    by 'seed'
+
+    If 'summary' is given, the result is passed through summary().
+    The state of the random module is restored afterwards.
+    """
+    state = random.getstate()
+    random.seed(seed)
+    try:
+        result = func(*args, **kargs)
+        if summary is not None:
+            result = summary(result)
+    finally:
+        random.setstate(state)
+    return result
+
+
+def _run_replicate_task(task):
+    return run_replicate(*task)
+
+
+def iter_replicates(model, nreps, args=(), kargs={}, seed=None,
+                    summary=None, nproc=1, chunksize=1):
+    """
+    Iterate through the results of 'nreps' replicates of a model in order
+
+    model   -- name of a model in MODELS or a sampling function
+    args    -- positional arguments for the model
+    kargs   -- keyword arguments for the model
+    seed    -- base seed (default: drawn from the random module)
+    summary -- function applied to each result within the worker
+    nproc   -- number of processes
+    chunksize -- number of replicates sent to a process at a time
+
+    Results are the same for any number of processes.  When nproc > 1 the
+    model, its arguments, summary and results must be picklable (use a
+    summary such as format_tree() or format_arg() for large trees and
+    ARGs).
+    """
+    func = get_model(model)
+    if seed is None:
+        seed = random.randrange(2**63)
+
+    tasks = ((func, args, kargs, derive_seed(seed, i), summary)
+             for i in xrange(nreps))
+
+    if nproc > 1 and nreps > 1:
+        pool = multiprocessing.Pool(min(nproc, nreps))
+        try:
+            for result in pool.imap(_run_replicate_task, tasks, chunksize):
+                yield result
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for result in imap(_run_replicate_task, tasks):
+            yield result
+
+
+def sample_replicates(model, nreps, args=(), kargs={}, seed=None,
+                      summary=None, nproc=1, chunksize=1):
+    """Returns a list of the results of 'nreps' replicates of a model
+       (see iter_replicates)"""
+    return list(iter_replicates(model, nreps, args, kargs, seed=seed,
+                                summary=summary, nproc=nproc,
+                                chunksize=chunksize))
+
+
+#=============================================================================
+# summaries
+
+
+def format_tree(result):
+    """Returns a tree (or the tree of a (tree, recon, ...) tuple) as a
+       newick string"""
+    if isinstance(result, tuple):
+        result = result[0]
+    return result.get_one_line_newick()
+
+
+def format_arg(arg):
+    """Returns an ARG in the format of arglib.write_arg"""
+    out = StringIO.StringIO()
+    arglib.write_arg(out, arg)
+    return out.getvalue()
+
+
+def summarize_arg(arg):
+    """Returns summary statistics of an ARG"""
+    return {
+        "nnodes": len(arg),
+        "nrecombs": sum(1 for node in arg if node.event == "recomb"),
+        "tmrca": arg.root.age,
+        "arglen": arglib.arglen(arg),
+    }
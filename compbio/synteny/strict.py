@@ -3,11 +3,13 @@
 
 
 
+import multiprocessing
+
 from rasmus import util
 
 from compbio import regionlib
 
-from . import SyntenyBlock, make_orth
+from . import SyntenyBlock, make_orth, write_synteny_blocks
 
 
 
@@ -167,89 +169,264 @@ def can_append_orth(db, block_orth, block_dir, orth, orthdb={}):
 
 
 
-def find_synteny(species1, species2, regions1, regions2, orths):
+def make_orth_db(orths):
+    """
+    Returns ortholog and inparalog lookups from a list of ortholog pairs
+
+    orthdb:  {gene1 -> orthologs of gene1}
+    inpardb: {gene1 -> gene1a | gene1 and gene1a both have same orthologs}
+    """
 
-    # ortholog db {gene1 -> orthologs of gene1}
     orthdb = util.Dict(default=set())
     for row in orths:
         orthdb[row[0]].add(row[1])
         orthdb[row[1]].add(row[0])
 
-
     # TODO: generalize
-    # inparalogs db {gene1 -> gene1a | gene1 and gene1a both have same orthologs}
     inpardb = util.Dict(default=set())
     for gene, others in orthdb.iteritems():
         inpardb[gene] = orthdb[iter(others).next()]
 
+    return orthdb, inpardb
+
+
+def find_synteny(species1, species2, regions1, regions2, orths):
+
+    orthdb, inpardb = make_orth_db(orths)
 
     # make region db
     regiondb = regionlib.RegionDb(regions1 + regions2)
 
     # get chromosome sets
     chroms1 = regiondb.get_chroms(species1)
-    chroms2 = regiondb.get_chroms(species2)
-
 
     blocks = []
     for chname1, chrom1 in chroms1.iteritems():
-        # skip empty chromosomes
-        if len(chrom1) == 0:
+        blocks.extend(find_synteny_chrom(regiondb, chrom1, orthdb, inpardb))
+
+    return blocks
+
+
+def find_synteny_chrom(regiondb, chrom1, orthdb, inpardb):
+    """
+    Find synteny blocks along one chromosome (list of regions sorted by start)
+
+    orthdb and inpardb should only contain orthologs between the species
+    of chrom1 and the species it is being compared against.
+    """
+
+    blocks = []
+
+    # skip empty chromosomes
+    if len(chrom1) == 0:
+        return blocks
+
+    # start a new block
+    need_new_block = True
+    loss_streak = []
+    for i, gene1 in enumerate(chrom1):
+        names2 = orthdb[gene1.data["ID"]]
+
+        # no orthologs, start a loss streak
+        if len(names2) == 0:
+            #need_new_block = True
+            loss_streak.append(make_orth(regiondb, [gene1.data["ID"]], []))
             continue
-        
-        # start a new block
-        need_new_block = True
-        loss_streak = []
-        for i, gene1 in enumerate(chrom1):
-            names2 = orthdb[gene1.data["ID"]]
-
-            # no orthologs, start a loss streak
-            if len(names2) == 0:
-                #need_new_block = True
-                loss_streak.append(make_orth(regiondb, [gene1.data["ID"]], []))
+
+        # make ortholog cluster
+        names1 = inpardb[gene1.data["ID"]]
+        orth = make_orth(regiondb, names1, names2)
+
+        # orthologs are not contiguous, stop block
+        if not is_orth_contig(regiondb, orth):
+            loss_streak = []
+            need_new_block = True
+            continue
+
+        # try to add to existing block
+        if not need_new_block:
+            block = blocks[-1]
+
+            # just continue if we are still in the last ortholog pair
+            #   i.e. gene1 is a paralog in a tandem set
+            if orth == block.orths[-1]:
                 continue
 
-            # make ortholog cluster
-            names1 = inpardb[gene1.data["ID"]]            
-            orth = make_orth(regiondb, names1, names2)
-            
-            # orthologs are not contiguous, stop block
-            if not is_orth_contig(regiondb, orth):
+            # try to append
+            direction = can_append_orth(regiondb, block.orths[-1],
+                                        block.dir, orth, orthdb)
+            if direction == 0:
                 loss_streak = []
                 need_new_block = True
-                continue
-
-            # try to add to existing block
-            if not need_new_block:
-                block = blocks[-1]
-
-                # just continue if we are still in the last ortholog pair
-                #   i.e. gene1 is a paralog in a tandem set
-                if orth == block.orths[-1]:
-                    continue
-
-                # try to append
-                direction = can_append_orth(regiondb, block.orths[-1],
-                                            block.dir, orth, orthdb)
-                if direction == 0:
-                    loss_streak = []
-                    need_new_block = True
-                else:
-                    for loss in loss_streak:
-                        block.add_orth(loss, direction)
-                    loss_streak = []
-                    block.add_orth(orth, direction)
-
-            # start a new block
-            if need_new_block:
+            else:
+                for loss in loss_streak:
+                    block.add_orth(loss, direction)
                 loss_streak = []
-                if len(blocks) > 0:
-                    blocks[-1].recalc_regions(regiondb)
-                blocks.append(SyntenyBlock(* orth_regions(regiondb, orth)))
-                blocks[-1].add_orth(orth)
-                need_new_block = False
+                block.add_orth(orth, direction)
+
+        # start a new block
+        if need_new_block:
+            loss_streak = []
+            if len(blocks) > 0:
+                blocks[-1].recalc_regions(regiondb)
+            blocks.append(SyntenyBlock(* orth_regions(regiondb, orth)))
+            blocks[-1].add_orth(orth)
+            need_new_block = False
 
-        if len(blocks) > 0:
-            blocks[-1].recalc_regions(regiondb)
+    if len(blocks) > 0:
+        blocks[-1].recalc_regions(regiondb)
 
     return blocks
+
+
+#=============================================================================
+# multi-genome synteny
+
+
+class OrthGraph (object):
+    """
+    Ortholog graph across many genomes
+
+    Orthologs of each gene are indexed by species so that the ortholog and
+    inparalog lookups for any one species pair can be extracted without
+    scanning the whole graph.
+    """
+
+    def __init__(self, regiondb, orths):
+        self.regiondb = regiondb
+
+        # {gene -> {species -> set of orthologs}}
+        self.edges = {}
+
+        for row in orths:
+            gene1, gene2 = row[0], row[1]
+            if not (regiondb.has_region(gene1) and
+                    regiondb.has_region(gene2)):
+                continue
+            sp1 = regiondb.get_region(gene1).species
+            sp2 = regiondb.get_region(gene2).species
+            self.edges.setdefault(gene1, {}).setdefault(sp2, set()).add(gene2)
+            self.edges.setdefault(gene2, {}).setdefault(sp1, set()).add(gene1)
+
+    def get_orth_db(self, species1, species2):
+        """
+        Returns (orthdb, inpardb) restricted to orthologs between
+        species1 and species2 (same format as make_orth_db)
+        """
+
+        orthdb = util.Dict(default=set())
+        for sp, other in ((species1, species2), (species2, species1)):
+            if not self.regiondb.has_species(sp):
+                continue
+            for regions in self.regiondb.get_chroms(sp).itervalues():
+                for region in regions:
+                    gene = region.data["ID"]
+                    others = self.edges.get(gene, {}).get(other)
+                    if others:
+                        orthdb[gene] = set(others)
+
+        inpardb = util.Dict(default=set())
+        for gene, others in orthdb.iteritems():
+            inpardb[gene] = orthdb[iter(others).next()]
+
+        return orthdb, inpardb
+
+
+# state shared with worker processes (inherited on fork)
+_synteny_state = {}
+
+
+def _get_pair_orth_db(species1, species2):
+    """Returns the ortholog lookups for a species pair, cached per process"""
+    key = (species1, species2)
+    cache = _synteny_state.setdefault("cache", {})
+    if key not in cache:
+        # only keep the most recent pair to bound memory
+        cache.clear()
+        cache[key] = _synteny_state["orthgraph"].get_orth_db(
+            species1, species2)
+    return cache[key]
+
+
+def _find_synteny_task(task):
+    """Find synteny blocks for one (index, species1, species2, chrom1) task"""
+    index, species1, species2, chrom = task
+    regiondb = _synteny_state["regiondb"]
+    orthdb, inpardb = _get_pair_orth_db(species1, species2)
+    chrom1 = regiondb.get_regions(species1, chrom)
+    return index, find_synteny_chrom(regiondb, chrom1, orthdb, inpardb)
+
+
+def iter_synteny_tasks(regiondb, species_pairs):
+    """Iterate over (index, species1, species2, chrom1) synteny tasks"""
+    index = 0
+    for species1, species2 in species_pairs:
+        if not regiondb.has_species(species1):
+            continue
+        for chrom in sorted(regiondb.get_chroms(species1)):
+            yield (index, species1, species2, chrom)
+            index += 1
+
+
+def find_synteny_all(regions, orths, species_pairs=None, nproc=None,
+                     out=None, extra=lambda x: ()):
+    """
+    Find synteny blocks between many pairs of genomes
+
+    regions       -- list of gene regions for all species
+    orths         -- list of ortholog pairs (gene1, gene2, ...) across species
+    species_pairs -- list of (species1, species2) pairs to compare
+                     (default: all pairs)
+    nproc         -- number of worker processes (default: number of CPUs,
+                     1 runs serially in this process)
+    out           -- if given, synteny blocks are written to this stream with
+                     write_synteny_blocks() as each task finishes
+
+    The region index and ortholog graph are built once and shared with the
+    workers.  Returns the synteny blocks of all tasks ordered by species pair
+    and chromosome.
+    """
+
+    regiondb = regionlib.RegionDb(regions)
+    orthgraph = OrthGraph(regiondb, orths)
+
+    if species_pairs is None:
+        species = sorted(regiondb.get_species())
+        species_pairs = [(species[i], species[j])
+                         for i in xrange(len(species))
+                         for j in xrange(i+1, len(species))]
+
+    tasks = list(iter_synteny_tasks(regiondb, species_pairs))
+    if nproc is None:
+        nproc = multiprocessing.cpu_count()
+
+    _synteny_state.clear()
+    _synteny_state["regiondb"] = regiondb
+    _synteny_state["orthgraph"] = orthgraph
+
+    results = [None] * len(tasks)
+    pool = None
+    try:
+        if nproc > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(nproc, len(tasks)))
+            # group tasks of a species pair together to reuse its lookups
+            chunksize = max(1, len(tasks) // (4 * nproc))
+            it = pool.imap_unordered(_find_synteny_task, tasks, chunksize)
+        else:
+            it = (_find_synteny_task(task) for task in tasks)
+
+        for index, blocks in it:
+            results[index] = blocks
+            if out:
+                write_synteny_blocks(out, blocks, extra)
+                out.flush()
+
+        if pool:
+            pool.close()
+            pool.join()
+    finally:
+        if pool:
+            pool.terminate()
+        _synteny_state.clear()
+
+    return [block for blocks in results for block in blocks]
@@ -0,0 +1,782 @@
+"""
+columntable.py
+
+Column-oriented tables backed by NumPy arrays.
+
+A ColumnTable stores each column of a table as one typed array instead of
+a list of per-row dicts.  Columns of type int, float and bool are NumPy
+arrays.  Text columns are stored as integer codes into a list of unique
+strings (levels).  Columns of any other type are NumPy object arrays.
+
+ColumnTable reads and writes the same file format as tablelib.Table,
+including directives and the '##types' header, and converts to and from
+Table.
+
+    tab = ColumnTable().read("blast.tab")
+    tab = tab.filter(tab["score"] > 100)
+    tab.sort(cols=["query", "score"], reverse=True)
+    groups = tab.groupby("query")
+
+"""
+
+# python libs
+import copy
+from itertools import imap, izip
+import sys
+
+# numpy libs
+import numpy as np
+
+# rasmus libs
+from rasmus import util
+from rasmus.tablelib import DIR_TYPES
+from rasmus.tablelib import Table
+from rasmus.tablelib import TableException
+from rasmus.tablelib import format_type
+from rasmus.tablelib import guess_type
+from rasmus.tablelib import parse_type
+from rasmus.tablelib import str2bool
+
+
+# numpy dtypes of column types
+_DTYPES = {
+    int: np.int64,
+    long: np.int64,
+    float: np.float64,
+    bool: np.bool_,
+}
+
+
+def is_text_type(type_object):
+    """Returns True if values of this type are stored as string codes"""
+    return type_object in (str, unicode)
+
+
+def _convert_bool(tokens):
+    """Convert an array of strings to booleans"""
+    lower = np.char.lower(tokens)
+    is_true = lower == "true"
+    if not (is_true | (lower == "false")).all():
+        raise ValueError("unknown string for bool")
+    return is_true
+
+
+class ColumnTable (object):
+    """A table of data stored by column"""
+
+    def __init__(self, columns=None, headers=None, types=None,
+                 filename=None, nheaders=1):
+        """
+        columns -- dict of header -> list or array of values
+        headers -- order of columns (default: sorted column names)
+        types   -- dict of header -> type (default: guessed from values)
+        """
+        self.headers = copy.copy(headers) if headers is not None else []
+        self.types = copy.copy(types) if types is not None else {}
+        self.comments = []
+        self.delim = "\t"
+        self.nheaders = nheaders
+        self.filename = filename
+
+        self.data = {}     # header -> array (codes for text columns)
+        self.levels = {}   # header -> list of strings (text columns only)
+        self.nrows = 0
+
+        if columns is not None:
+            if headers is None:
+                self.headers = sorted(columns.keys())
+            for header in self.headers:
+                self.set_col(header, columns[header],
+                             self.types.get(header))
+
+    #===================================================================
+    # Columns
+
+    def __len__(self):
+        return self.nrows
+
+    def set_col(self, header, values, coltype=None):
+        """Set the values of a column (adds the column if needed)"""
+        if coltype is None:
+            coltype = self.types.get(header)
+        if coltype is None:
+            if isinstance(values, np.ndarray) and values.dtype.kind in "biuf":
+                coltype = {"b": bool, "i": int, "u": int,
+                           "f": float}[values.dtype.kind]
+            elif len(values) > 0:
+                coltype = type(values[0])
+            else:
+                coltype = str
+
+        if len(self.data) > 0 and len(values) != self.nrows:
+            raise TableException("column '%s' has %d rows, expected %d" %
+                                 (header, len(values), self.nrows))
+
+        if header not in self.headers:
+            self.headers.append(header)
+        self.types[header] = coltype
+        self.levels.pop(header, None)
+
+        if is_text_type(coltype):
+            self.data[header], self.levels[header] = \
+                self._encode_strings(values)
+        elif coltype in _DTYPES:
+            self.data[header] = np.asarray(values, dtype=_DTYPES[coltype])
+        else:
+            col = np.empty(len(values), dtype=object)
+            col[:] = list(values)
+            self.data[header] = col
+        self.nrows = len(values)
+
+    def _encode_strings(self, values, levels=None):
+        """Returns (codes, levels) for a list of strings"""
+        if levels is None:
+            levels = []
+        lookup = dict((s, i) for i, s in enumerate(levels))
+        codes = np.empty(len(values), dtype=np.int32)
+        for i, val in enumerate(values):
+            code = lookup.get(val)
+            if code is None:
+                code = lookup[val] = len(levels)
+                levels.append(val)
+            codes[i] = code
+        return codes, levels
+
+    def remove_col(self, *cols):
+        """Removes columns from the table"""
+        for col in cols:
+            self.headers.remove(col)
+            del self.types[col]
+            del self.data[col]
+            self.levels.pop(col, None)
+
+    def rename_col(self, oldname, newname):
+        """Renames a column"""
+        col = self.headers.index(oldname)
+        self.headers[col] = newname
+        self.types[newname] = self.types.pop(oldname)
+        self.data[newname] = self.data.pop(oldname)
+        if oldname in self.levels:
+            self.levels[newname] = self.levels.pop(oldname)
+
+    def get_col(self, header):
+        """Returns the values of a column as an array"""
+        if header in self.levels:
+            levels = np.empty(len(self.levels[header]), dtype=object)
+            levels[:] = self.levels[header]
+            return levels[self.data[header]]
+        return self.data[header]
+
+    def get_codes(self, header):
+        """Returns (codes, levels) of a text column"""
+        return self.data[header], self.levels[header]
+
+    def get_sort_key(self, header):
+        """Returns an array whose order matches the order of a column"""
+        if header in self.levels:
+            # rank of each level in sorted order
+            levels = self.levels[header]
+            order = sorted(xrange(len(levels)), key=levels.__getitem__)
+            ranks = np.empty(len(levels), dtype=np.int32)
+            ranks[order] = np.arange(len(levels), dtype=np.int32)
+            return ranks[self.data[header]]
+        return self.data[header]
+
+    def get_group_codes(self, header):
+        """Returns (codes, values) such that values[codes] is the column"""
+        if header in self.levels:
+            return self.data[header], self.levels[header]
+        values, codes = np.unique(self.data[header], return_inverse=True)
+        return codes, list(values.tolist())
+
+    def cget(self, *cols):
+        """Returns columns of the table as separate arrays"""
+        ret = [self.get_col(col) for col in cols]
+        if len(ret) == 1:
+            return ret[0]
+        else:
+            return ret
+
+    #===================================================================
+    # Rows
+
+    def __getitem__(self, key):
+        """
+        tab['col']     -- returns a column as an array
+        tab[i]         -- returns row i as a dict
+        tab[i:j]       -- returns a table of a slice of rows
+        tab[mask]      -- returns a table of rows where mask is True
+        tab[[i, j]]    -- returns a table of rows i, j
+        """
+        if isinstance(key, basestring):
+            return self.get_col(key)
+        elif isinstance(key, (int, long, np.integer)):
+            return self.get_row_dict(key)
+        else:
+            return self.take(key)
+
+    def __iter__(self):
+        """Iterate over rows as dicts"""
+        return self.iter_rows()
+
+    def get_row_dict(self, i):
+        """Returns a row as a dict"""
+        row = {}
+        for header in self.headers:
+            col = self.data[header]
+            if header in self.levels:
+                row[header] = self.levels[header][col[i]]
+            elif col.dtype == object:
+                row[header] = col[i]
+            else:
+                row[header] = col[i].item()
+        return row
+
+    def iter_rows(self, cols=None):
+        """Iterate over rows as dicts"""
+        if cols is None:
+            cols = self.headers
+        for row in self.as_tuples(cols):
+            yield dict(izip(cols, row))
+
+    def as_tuples(self, cols=None, chunksize=10000):
+        """Iterate over rows as tuples"""
+        if cols is None:
+            cols = self.headers
+        for start in xrange(0, self.nrows, chunksize):
+            chunk = [self._get_values(col, start, start + chunksize)
+                     for col in cols]
+            for row in izip(*chunk):
+                yield row
+
+    def as_lists(self, cols=None):
+        """Iterate over rows as lists"""
+        for row in self.as_tuples(cols):
+            yield list(row)
+
+    def _get_values(self, header, start, end):
+        """Returns column values [start, end) as a python list"""
+        col = self.data[header][start:end]
+        if header in self.levels:
+            levels = self.levels[header]
+            return [levels[i] for i in col.tolist()]
+        return col.tolist()
+
+    def new(self, headers=None):
+        """Returns a new table with the same info but no data"""
+        if headers is None:
+            headers = self.headers
+        tab = type(self)(headers=headers,
+                         types=util.subdict(self.types, headers))
+        tab.comments = copy.copy(self.comments)
+        tab.delim = self.delim
+        tab.nheaders = self.nheaders
+        return tab
+
+    def take(self, rows, cols=None):
+        """Returns a table with a subset of rows (slice, mask or indices)
+           and columns"""
+        if cols is None:
+            cols = self.headers
+        tab = self.new(cols)
+        nrows = None
+        for header in cols:
+            tab.data[header] = self.data[header][rows]
+            if header in self.levels:
+                tab.levels[header] = self.levels[header]
+            nrows = len(tab.data[header])
+        if nrows is None:
+            nrows = len(np.arange(self.nrows)[rows])
+        tab.nrows = nrows
+        return tab
+
+    def get(self, rows=None, cols=None):
+        """Returns a table with a subset of the rows and columns"""
+        if rows is None:
+            rows = slice(None)
+        return self.take(rows, cols)
+
+    #===================================================================
+    # Table manipulation
+
+    def filter(self, cond):
+        """
+        Returns a table with a subset of rows
+
+        cond is either a boolean array or a function cond(tab) that returns
+        a boolean array, e.g. tab.filter(lambda t: t['score'] > 10)
+        """
+        if callable(cond):
+            cond = cond(self)
+        return self.take(np.asarray(cond, dtype=bool))
+
+    def argsort(self, cols=None, reverse=False):
+        """Returns the row order that sorts the table by columns"""
+        if cols is None:
+            cols = [self.headers[0]]
+        elif isinstance(cols, basestring):
+            cols = [cols]
+        keys = [self.get_sort_key(col) for col in reversed(cols)]
+        if reverse:
+            keys = [_reverse_key(key) for key in keys]
+        return np.lexsort(keys)
+
+    def sort(self, cols=None, reverse=False, col=None):
+        """Sorts the table inplace by one or more columns (stable)"""
+        if col is not None:
+            cols = [col]
+        order = self.argsort(cols, reverse=reverse)
+        for header in self.headers:
+            self.data[header] = self.data[header][order]
+
+    def groupby(self, key):
+        """
+        Groups the rows of the table into separate tables by the values of
+        one or more columns.  Returns a dict of key -> table, where the key
+        is a tuple when multiple columns are given.
+        """
+        cols = [key] if isinstance(key, basestring) else list(key)
+        codes, keys = self._get_keys(cols)
+
+        groups = {}
+        if self.nrows == 0:
+            return groups
+        order = np.argsort(codes, kind="mergesort")
+        sorted_codes = codes[order]
+        starts = np.flatnonzero(np.concatenate(
+            ([True], sorted_codes[1:] != sorted_codes[:-1])))
+        for rows in np.split(order, starts[1:]):
+            groups[keys[codes[rows[0]]]] = self.take(rows)
+        return groups
+
+    def _get_keys(self, cols):
+        """Returns (codes, keys) where keys[codes[i]] is the key of row i"""
+        if len(cols) == 1:
+            return self.get_group_codes(cols[0])
+
+        # combine the codes of several columns
+        colcodes = []
+        colvalues = []
+        for col in cols:
+            codes, values = self.get_group_codes(col)
+            colcodes.append(np.asarray(codes, dtype=np.int64))
+            colvalues.append(values)
+        combined = np.zeros(self.nrows, dtype=np.int64)
+        for codes, values in izip(colcodes, colvalues):
+            combined = combined * len(values) + codes
+        uniq, codes = np.unique(combined, return_inverse=True)
+        rows = np.zeros(len(uniq), dtype=np.int64)
+        rows[codes] = np.arange(self.nrows)
+        keys = [tuple(values[c[i]] for c, values in izip(colcodes, colvalues))
+                for i in rows]
+        return codes, keys
+
+    def lookup(self, *keys, **options):
+        """
+        Returns a dict of key -> row index based on one or more columns
+
+        With multiple columns the dict key is a tuple.
+
+        extra options:
+        uselast=False    # allow multiple rows, just use last
+        """
+        uselast = options.get("uselast", False)
+        codes, values = self._get_keys(list(keys))
+        if not uselast and self.nrows > 0:
+            counts = np.bincount(codes, minlength=len(values))
+            if counts.max() > 1:
+                raise Exception("duplicate key '%s'" %
+                                str(values[counts.argmax()]))
+        rows = np.zeros(len(values), dtype=np.int64)
+        rows[codes] = np.arange(self.nrows)
+
+        # only keys that occur in the table (levels may be shared with
+        # tables that have other rows)
+        present = np.unique(codes).tolist()
+        return dict((values[c], rows[c]) for c in present)
+
+    def find(self, col, values):
+        """
+        Returns the row indices where a column equals each of the given
+        values (vectorized lookup).  Missing values are given -1.
+        """
+        key = self.get_col(col) if col in self.levels else self.data[col]
+        order = np.argsort(key, kind="mergesort")
+        sorted_key = key[order]
+        values = np.asarray(values, dtype=sorted_key.dtype)
+        pos = np.searchsorted(sorted_key, values)
+        pos2 = np.minimum(pos, max(len(order) - 1, 0))
+        found = (pos < len(order))
+        if len(order) > 0:
+            found &= (sorted_key[pos2] == values)
+            return np.where(found, order[pos2], -1)
+        return np.zeros(len(values), dtype=np.int64) - 1
+
+    #===================================================================
+    # Conversion
+
+    @classmethod
+    def from_table(cls, tab):
+        """Make a ColumnTable from a Table"""
+        ctab = cls(headers=[], types={})
+        ctab.comments = copy.copy(tab.comments)
+        ctab.delim = tab.delim
+        ctab.nheaders = tab.nheaders
+        ctab.filename = tab.filename
+        for header in tab.headers or []:
+            ctab.set_col(header, [row[header] for row in tab],
+                         tab.types.get(header))
+        return ctab
+
+    def to_table(self):
+        """Returns the data as a Table"""
+        tab = Table(headers=self.headers, types=self.types,
+                    nheaders=self.nheaders, filename=self.filename)
+        tab.comments = copy.copy(self.comments)
+        tab.delim = self.delim
+        tab.extend(self.iter_rows())
+        return tab
+
+    #===================================================================
+    # Input/Output
+
+    def read(self, filename, delim="\t", nheaders=1,
+             headers=None, types=None, guess_types=True, usecols=None,
+             bufsize=2**22):
+        """
+        Reads a character delimited file (same format as Table.read)
+
+        The file is parsed with a ChunkReader, so each column is converted
+        to its type in bulk.  If 'usecols' is given, only those columns are
+        read.
+        """
+        reader = ChunkReader(filename, delim=delim, nheaders=nheaders,
+                             headers=headers, types=types,
+                             guess_types=guess_types, usecols=usecols,
+                             bufsize=bufsize)
+        if isinstance(filename, str):
+            self.filename = filename
+        self.delim = delim
+        self.nheaders = nheaders
+        self.headers = list(reader.usecols)
+        self.types = util.subdict(reader.types, self.headers)
+        self.data = {}
+        self.levels = {}
+
+        chunks = dict((header, []) for header in self.headers)
+        lookups = {}
+        for chunk in reader:
+            for header in self.headers:
+                if is_text_type(self.types[header]):
+                    # encode strings with codes shared across chunks
+                    levels = self.levels.setdefault(header, [])
+                    lookup = lookups.setdefault(header, {})
+                    for val in set(chunk[header]):
+                        if val not in lookup:
+                            lookup[val] = len(levels)
+                            levels.append(val)
+                    chunks[header].append(np.fromiter(
+                        imap(lookup.__getitem__, chunk[header]),
+                        dtype=np.int32, count=len(chunk[header])))
+                else:
+                    chunks[header].append(chunk[header])
+        self.comments = reader.comments
+
+        for header in self.headers:
+            coltype = self.types[header]
+            if is_text_type(coltype):
+                self.levels.setdefault(header, [])
+                dtype = np.int32
+            else:
+                dtype = _DTYPES.get(coltype, object)
+            if chunks[header]:
+                self.data[header] = np.concatenate(chunks[header])
+            else:
+                self.data[header] = np.zeros(0, dtype=dtype)
+        self.nrows = reader.nrows
+
+        return self
+
+    def write(self, filename=sys.stdout, delim="\t", comments=False,
+              nheaders=None, chunksize=10000):
+        """Write a table to a file or stream (same format as Table.write)"""
+        if isinstance(filename, str):
+            self.filename = filename
+        out = util.open_stream(filename, "w")
+        if nheaders is None:
+            nheaders = self.nheaders
+
+        # write comments
+        if comments:
+            if DIR_TYPES not in self.comments:
+                self.comments.insert(0, DIR_TYPES)
+            for line in self.comments:
+                if line == DIR_TYPES:
+                    out.write("##types:" + delim.join(
+                        format_type(self.types[h]) for h in self.headers) +
+                        "\n")
+                else:
+                    out.write(line)
+                    out.write('\n')
+
+        # write header
+        if nheaders > 0:
+            out.write(delim.join(map(str, self.headers)))
+            out.write('\n')
+
+        # write data one chunk of rows at a time
+        for start in xrange(0, self.nrows, chunksize):
+            end = start + chunksize
+            cols = []
+            for header in self.headers:
+                fmt = self.types[header].__str__
+                if header in self.levels:
+                    cols.append(self._get_values(header, start, end))
+                else:
+                    cols.append(map(fmt, self._get_values(header, start,
+                                                          end)))
+            out.write("".join(delim.join(row) + "\n" for row in izip(*cols)))
+
+    def write_pretty(self, out=sys.stdout, spacing=2):
+        self.to_table().write_pretty(out, spacing=spacing)
+
+
+def _reverse_key(key):
+    """Returns a sort key with the reversed order"""
+    if key.dtype == np.bool_:
+        return ~key
+    elif key.dtype.kind in "iuf":
+        return -key
+    else:
+        ranks = np.unique(key, return_inverse=True)[1]
+        return -ranks
+
+
+#===========================================================================
+# Convenience functions
+
+def read_column_table(filename, delim="\t", headers=None,
+                      nheaders=1, types=None, guess_types=True,
+                      usecols=None):
+    """Read a ColumnTable from a file"""
+    return ColumnTable().read(filename, delim=delim, headers=headers,
+                              nheaders=nheaders, types=types,
+                              guess_types=guess_types, usecols=usecols)
+
+
+#===========================================================================
+# Chunked reading of delimited files
+
+
+class ChunkReader (object):
+    """
+    Reads a delimited file in large chunks of rows
+
+    The file is read in buffers of about 'bufsize' bytes.  All the lines of
+    a buffer are split at once and each column is converted to its type in
+    bulk: int, float and bool columns become NumPy arrays, text columns
+    lists of strings and other types object arrays.  Each iteration yields a
+    dict of header -> column values for one chunk of rows.
+
+    Headers, comments, directives and type guessing are handled as in
+    tablelib.Table.read_iter().  Use nheaders=0 to read plain delimited
+    files (as util.DelimReader), in which case columns are numbered.
+    Only the columns in 'usecols' (default: all) are converted.  Parse
+    errors raise TableException with the file name and line number.
+    """
+
+    def __init__(self, filename, delim="\t", nheaders=1, headers=None,
+                 types=None, guess_types=True, usecols=None,
+                 bufsize=2**22):
+        self.infile = util.open_stream(filename)
+        self.filename = filename if isinstance(filename, str) else None
+        self.delim = delim
+        self.nheaders = nheaders
+        self.headers = copy.copy(headers) if headers is not None else None
+        self.types = copy.copy(types) if types is not None else {}
+        self.comments = []
+        self.bufsize = bufsize
+        self.nrows = 0
+
+        self._lineno = 0      # number of lines read from the file
+        self._rest = ""       # incomplete line at end of last buffer
+        self._pending = None  # (lineno, lines) read while parsing headers
+
+        self._read_header(guess_types)
+
+        if usecols is None:
+            usecols = self.headers
+        for col in usecols:
+            if col not in self.types:
+                raise TableException("unknown column '%s'" % col,
+                                     self.filename)
+        self.usecols = list(usecols)
+        self._colindex = [self.headers.index(col) for col in self.usecols]
+
+    def _read_lines(self):
+        """Returns (lineno, lines) for the next buffer of complete lines or
+           None at the end of the file.  lineno is the line number of the
+           first line."""
+        while True:
+            buf = self.infile.read(self.bufsize)
+            if not buf:
+                if self._rest:
+                    lines = [self._rest]
+                    self._rest = ""
+                    break
+                return None
+            buf = self._rest + buf
+            end = buf.rfind("\n")
+            if end == -1:
+                self._rest = buf
+                continue
+            self._rest = buf[end+1:]
+            lines = buf[:end].split("\n")
+            break
+
+        lineno = self._lineno + 1
+        self._lineno += len(lines)
+        return lineno, lines
+
+    def _read_header(self, guess_types):
+        """Read lines until the headers and first data row are known"""
+        tmptypes = None
+        while True:
+            chunk = self._read_lines()
+            if chunk is None:
+                break
+            lineno, lines = chunk
+
+            for i, line in enumerate(lines):
+                if len(line) == 0:
+                    continue
+                if line[0] == "#":
+                    if line.startswith("##types:"):
+                        self.comments.append(DIR_TYPES)
+                        tmptypes = map(parse_type, line[len("##types:"):]
+                                       .split(self.delim))
+                    else:
+                        self.comments.append(line)
+                    continue
+
+                tokens = line.split(self.delim)
+
+                # if no headers read yet, use this line as a header
+                if not self.headers:
+                    if self.nheaders > 0:
+                        if len(set(tokens)) != len(tokens):
+                            raise TableException(
+                                "Duplicate header", self.filename,
+                                lineno + i)
+                        self.headers = tokens
+                        continue
+                    else:
+                        self.headers = range(len(tokens))
+
+                # first data line: determine types
+                self._set_types(tmptypes, tokens, guess_types)
+                self._pending = (lineno + i, lines[i:])
+                return
+
+        # no data in file
+        if self.headers is None:
+            self.headers = []
+        self._set_types(tmptypes, None, guess_types)
+
+    def _set_types(self, tmptypes, tokens, guess_types):
+        if tmptypes:
+            if len(tmptypes) != len(self.headers):
+                raise TableException("wrong number of types", self.filename)
+            self.types = dict(zip(self.headers, tmptypes))
+        elif guess_types and tokens is not None:
+            for header, token in zip(self.headers, tokens):
+                self.types.setdefault(header, guess_type(token))
+        else:
+            for header in self.headers:
+                self.types.setdefault(header, str)
+
+    def __iter__(self):
+        if self._pending:
+            chunk = self._parse(*self._pending)
+            self._pending = None
+            if chunk is not None:
+                yield chunk
+
+        while True:
+            lines = self._read_lines()
+            if lines is None:
+                break
+            chunk = self._parse(*lines)
+            if chunk is not None:
+                yield chunk
+
+    def _data_lines(self, lineno, lines):
+        """Iterate over (lineno, line) of the data lines of a buffer"""
+        for i, line in enumerate(lines):
+            if line and line[0] != "#":
+                yield lineno + i, line
+
+    def _parse(self, lineno, rawlines):
+        """Parse a buffer of lines into columns"""
+        delim = self.delim
+        ncols = len(self.headers)
+
+        # remove blank lines and comments
+        lines = [line for line in rawlines if line and line[0] != "#"]
+        if len(lines) < len(rawlines):
+            self.comments.extend(line for line in rawlines
+                                 if line.startswith("#"))
+        if len(lines) == 0:
+            return None
+
+        # split all lines at once
+        if any(line.count(delim) != ncols - 1 for line in lines):
+            for lineno2, line in self._data_lines(lineno, rawlines):
+                if line.count(delim) != ncols - 1:
+                    raise TableException(
+                        "expected %d columns" % ncols,
+                        self.filename, lineno2)
+        tokens = delim.join(lines).split(delim)
+
+        chunk = {}
+        for col, j in izip(self.usecols, self._colindex):
+            values = tokens[j::ncols]
+            try:
+                chunk[col] = self._convert(self.types[col], values)
+            except Exception, e:
+                self._raise_error(self.types[col], j, lineno, rawlines, e)
+        self.nrows += len(lines)
+        return chunk
+
+    def _convert(self, coltype, values):
+        """Convert a column of strings to its type"""
+        if is_text_type(coltype):
+            return values
+        elif coltype is bool:
+            return _convert_bool(np.array(values, dtype=str))
+        elif coltype in _DTYPES:
+            return np.array(values, dtype=str).astype(_DTYPES[coltype])
+        else:
+            col = np.empty(len(values), dtype=object)
+            col[:] = [coltype(value) for value in values]
+            return col
+
+    def _raise_error(self, coltype, j, lineno, rawlines, error):
+        """Find the line that caused a conversion error"""
+        parse = str2bool if coltype is bool else coltype
+        for lineno2, line in self._data_lines(lineno, rawlines):
+            try:
+                parse(line.split(self.delim)[j])
+            except Exception, e:
+                raise TableException(str(e), self.filename, lineno2)
+        raise TableException(str(error), self.filename, lineno)
+
+
+def iter_table_chunks(filename, delim="\t", nheaders=1, headers=None,
+                      types=None, guess_types=True, usecols=None,
+                      bufsize=2**22):
+    """Iterate through chunks of a delimited file as dicts of columns"""
+    return iter(ChunkReader(filename, delim=delim, nheaders=nheaders,
+                            headers=headers, types=types,
+                            guess_types=guess_types, usecols=usecols,
+                            bufsize=bufsize))
@@ -0,0 +1,529 @@
+"""
+compress.py
+
+Reading compressed streams (gzip, bzip2, xz and BGZF).
+
+Compressed files are detected by extension or magic bytes and decompressed
+in a background thread with large read buffers, so that decompression
+overlaps with parsing.  util.open_stream() uses these streams
+transparently.
+
+BGZF files (blocked gzip, as used by samtools/tabix) can also be opened
+with BgzfReader, which supports seeking to virtual offsets.
+
+"""
+
+# python libs
+import bz2
+import gzip
+import os
+from Queue import Queue
+import struct
+import subprocess
+import threading
+import zlib
+
+# xz support is optional
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+# magic bytes of compression formats
+COMPRESS_MAGIC = [
+    ("\x1f\x8b", "gz"),
+    ("BZh", "bz2"),
+    ("\xfd7zXZ\x00", "xz"),
+]
+
+COMPRESS_EXTS = {
+    ".gz": "gz",
+    ".bgz": "gz",
+    ".bz2": "bz2",
+    ".xz": "xz",
+}
+
+# default size of compressed reads
+BUFSIZE = 2**20
+
+
+def detect_compression(filename):
+    """Returns the compression format ('gz', 'bz2', 'xz') of a file or None
+
+       The format is determined by the file extension or, for regular files
+       with other extensions, by the file's magic bytes.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in COMPRESS_EXTS:
+        return COMPRESS_EXTS[ext]
+
+    if os.path.isfile(filename):
+        infile = open(filename, "rb")
+        head = infile.read(6)
+        infile.close()
+        for magic, fmt in COMPRESS_MAGIC:
+            if head.startswith(magic):
+                return fmt
+    return None
+
+
+def _make_decompressor(fmt):
+    if fmt == "gz":
+        # auto-detect gzip header
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif fmt == "bz2":
+        return bz2.BZ2Decompressor()
+    elif fmt == "xz":
+        return lzma.LZMADecompressor()
+    else:
+        raise Exception("unknown compression format '%s'" % fmt)
+
+
+def iter_decompress(infile, fmt, bufsize=BUFSIZE):
+    """Iterate the decompressed chunks of a compressed stream
+
+       Concatenated members (e.g. BGZF blocks or pbzip2 output) are
+       decompressed in turn.
+    """
+    decomp = _make_decompressor(fmt)
+    new_member = False
+    while True:
+        data = infile.read(bufsize)
+        if not data:
+            break
+
+        while data:
+            if new_member and fmt == "gz":
+                # like gzip, ignore zero padding after a member
+                data = data.lstrip("\x00")
+                if not data:
+                    break
+            new_member = False
+
+            try:
+                chunk = decomp.decompress(data)
+            except EOFError:
+                # previous member ended exactly at the end of a read
+                decomp = _make_decompressor(fmt)
+                new_member = True
+                continue
+            if chunk:
+                yield chunk
+
+            # start a new member if there is data after this one
+            data = decomp.unused_data
+            if data:
+                decomp = _make_decompressor(fmt)
+                new_member = True
+
+    if fmt == "gz":
+        chunk = decomp.flush()
+        if chunk:
+            yield chunk
+
+
+def _produce_chunks(chunks, queue, stop):
+    """Put chunks into a queue (None marks the end)"""
+    try:
+        for chunk in chunks:
+            if stop.is_set():
+                break
+            queue.put(chunk)
+        queue.put(None)
+    except Exception, e:
+        queue.put(e)
+
+
+class _ThreadedReader (object):
+    """A file-like reader over chunks produced in a background thread"""
+
+    def __init__(self, chunks, maxqueue=8):
+        self._queue = Queue(maxqueue)
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._stop = threading.Event()
+        self.closed = False
+
+        self._thread = threading.Thread(
+            target=_produce_chunks, args=(chunks, self._queue, self._stop))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _fill(self):
+        """Read the next chunk into the buffer, returns False at EOF"""
+        if self._eof:
+            return False
+        chunk = self._queue.get()
+        if chunk is None:
+            self._eof = True
+            return False
+        if isinstance(chunk, Exception):
+            self._eof = True
+            raise chunk
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while self._fill():
+                pass
+            data = self._buf[self._pos:]
+            self._buf = ""
+            self._pos = 0
+            return data
+
+        while len(self._buf) - self._pos < size and self._fill():
+            pass
+        data = self._buf[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+    def readline(self):
+        start = self._pos
+        while True:
+            end = self._buf.find("\n", start)
+            if end != -1:
+                line = self._buf[self._pos:end + 1]
+                self._pos = end + 1
+                return line
+            start = len(self._buf) - self._pos
+            if not self._fill():
+                line = self._buf[self._pos:]
+                self._buf = ""
+                self._pos = 0
+                return line
+
+    def readlines(self):
+        return list(self)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._stop.set()
+
+        # unblock the producer thread
+        while self._thread.is_alive():
+            while not self._queue.empty():
+                self._queue.get()
+            self._thread.join(.01)
+        self._close()
+
+    def _close(self):
+        pass
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+
+class DecompressStream (_ThreadedReader):
+    """Reads a compressed stream, decompressing in a background thread
+
+       The compressed stream is available as 'rawfile' (e.g. for measuring
+       progress through the input)."""
+
+    def __init__(self, infile, fmt, bufsize=BUFSIZE, maxqueue=8):
+        self.rawfile = infile
+        _ThreadedReader.__init__(self, iter_decompress(infile, fmt, bufsize),
+                                 maxqueue=maxqueue)
+
+    def _close(self):
+        self.rawfile.close()
+
+
+class PipeStream (_ThreadedReader):
+    """Reads the output of a decompression program (e.g. 'xz -dc')"""
+
+    def __init__(self, cmd, filename, bufsize=BUFSIZE, maxqueue=8):
+        self._proc = subprocess.Popen(cmd + [filename],
+                                      stdout=subprocess.PIPE)
+        stdout = self._proc.stdout
+        chunks = iter(lambda: stdout.read(bufsize), "")
+        _ThreadedReader.__init__(self, chunks, maxqueue=maxqueue)
+
+    def _close(self):
+        self._proc.stdout.close()
+        self._proc.wait()
+
+
+def open_compressed(filename, mode="r", fmt=None, bufsize=BUFSIZE):
+    """Open a compressed file
+
+       For reading, decompression happens in a background thread.
+       If fmt is None, the format is detected with detect_compression().
+    """
+    if fmt is None:
+        fmt = detect_compression(filename)
+
+    if "w" in mode or "a" in mode:
+        if fmt == "gz":
+            return gzip.open(filename, mode)
+        elif fmt == "bz2":
+            return bz2.BZ2File(filename, mode)
+        elif fmt == "xz" and lzma is not None:
+            return lzma.LZMAFile(filename, mode)
+        raise Exception("cannot write compression format '%s'" % fmt)
+
+    if fmt == "xz" and lzma is None:
+        return PipeStream(["xz", "-dc"], filename, bufsize=bufsize)
+    return DecompressStream(open(filename, "rb"), fmt, bufsize=bufsize)
+
+
+#=============================================================================
+# BGZF
+
+
+# BGZF block header: gzip header with an extra field 'BC' holding the
+# block size
+_BGZF_HEADER = struct.Struct("<4BI2BH2BHH")
+_BGZF_MAGIC = "\x1f\x8b\x08\x04"
+
+
+def is_bgzf(filename):
+    """Returns True if a file is in BGZF format"""
+    infile = open(filename, "rb")
+    head = infile.read(_BGZF_HEADER.size)
+    infile.close()
+    return (len(head) == _BGZF_HEADER.size and
+            head.startswith(_BGZF_MAGIC) and head[12:14] == "BC")
+
+
+def make_virtual_offset(block_start, within_block):
+    """Returns a BGZF virtual offset"""
+    return (block_start << 16) | within_block
+
+
+def split_virtual_offset(voffset):
+    """Returns (block_start, within_block) of a BGZF virtual offset"""
+    return voffset >> 16, voffset & 0xffff
+
+
+class BgzfReader (object):
+    """
+    Reads a BGZF file with seeking by virtual offsets
+
+    A virtual offset combines the file offset of a compressed block with an
+    offset into the decompressed block (see make_virtual_offset()).
+    tell() and seek() use virtual offsets.  When reading ahead, 'nthreads'
+    blocks are decompressed in parallel (zlib releases the GIL).
+    """
+
+    def __init__(self, filename, nthreads=1, nblocks=64):
+        self.filename = filename
+        self._infile = open(filename, "rb")
+        self._nthreads = nthreads
+        self._nblocks = nblocks
+        self._pool = None
+        if nthreads > 1:
+            from multiprocessing.pool import ThreadPool
+            self._pool = ThreadPool(nthreads)
+
+        # current block and queue of decompressed blocks
+        self._block_start = 0
+        self._block = ""
+        self._pos = 0
+        self._next_blocks = []
+        self.closed = False
+
+    def _read_raw_block(self):
+        """Returns (start, compressed data) of the next block or None"""
+        start = self._infile.tell()
+        header = self._infile.read(_BGZF_HEADER.size)
+        if not header:
+            return None
+        if (len(header) < _BGZF_HEADER.size or
+                not header.startswith(_BGZF_MAGIC) or
+                header[12:14] != "BC"):
+            raise Exception("invalid BGZF block at offset %d in '%s'" %
+                            (start, self.filename))
+        bsize = _BGZF_HEADER.unpack(header)[-1]
+        data = self._infile.read(bsize + 1 - _BGZF_HEADER.size)
+        return start, data
+
+    def _load_blocks(self):
+        """Read and decompress the next blocks, returns False at EOF"""
+        raw = []
+        for i in xrange(self._nblocks if self._pool else 1):
+            block = self._read_raw_block()
+            if block is None:
+                break
+            raw.append(block)
+        if not raw:
+            return False
+
+        if self._pool:
+            blocks = self._pool.map(_inflate_block, [x[1] for x in raw])
+        else:
+            blocks = map(_inflate_block, [x[1] for x in raw])
+        self._next_blocks = [(start, data) for (start, raw_data), data
+                             in zip(raw, blocks)]
+        self._next_blocks.reverse()
+        return True
+
+    def _next_block(self):
+        """Move to the next block, returns False at EOF"""
+        while True:
+            if not self._next_blocks and not self._load_blocks():
+                return False
+            self._block_start, self._block = self._next_blocks.pop()
+            self._pos = 0
+            if self._block:
+                # skip empty blocks (such as the EOF marker)
+                return True
+
+    def tell(self):
+        """Returns the virtual offset of the current position"""
+        if self._pos == len(self._block) and self._next_blocks:
+            return make_virtual_offset(self._next_blocks[-1][0], 0)
+        if self._pos == len(self._block):
+            return make_virtual_offset(self._infile.tell(), 0)
+        return make_virtual_offset(self._block_start, self._pos)
+
+    def seek(self, voffset):
+        """Seek to a virtual offset"""
+        start, pos = split_virtual_offset(voffset)
+        self._next_blocks = []
+        self._infile.seek(start)
+        self._block_start = start
+        self._block = ""
+        self._pos = 0
+        if pos > 0:
+            if not self._next_block() or pos > len(self._block):
+                raise Exception("invalid virtual offset %d" % voffset)
+            self._pos = pos
+
+    def read(self, size=-1):
+        chunks = []
+        while size != 0:
+            if self._pos == len(self._block) and not self._next_block():
+                break
+            if size < 0:
+                end = len(self._block)
+            else:
+                end = min(self._pos + size, len(self._block))
+                size -= end - self._pos
+            chunks.append(self._block[self._pos:end])
+            self._pos = end
+        return "".join(chunks)
+
+    def readline(self):
+        chunks = []
+        while True:
+            if self._pos == len(self._block) and not self._next_block():
+                break
+            end = self._block.find("\n", self._pos)
+            if end != -1:
+                chunks.append(self._block[self._pos:end + 1])
+                self._pos = end + 1
+                break
+            chunks.append(self._block[self._pos:])
+            self._pos = len(self._block)
+        return "".join(chunks)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._infile.close()
+        if self._pool:
+            self._pool.close()
+            self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+
+def _inflate_block(data):
+    # raw deflate data is followed by an 8 byte CRC32/ISIZE footer
+    return zlib.decompress(data[:-8], -15)
+
+
+class BgzfWriter (object):
+    """Writes a BGZF file"""
+
+    # maximum uncompressed size of a block
+    BLOCK_SIZE = 65280
+
+    def __init__(self, filename, level=6):
+        self._out = open(filename, "wb")
+        self._level = level
+        self._buf = []
+        self._buflen = 0
+        self.closed = False
+
+    def tell(self):
+        """Returns the virtual offset of the current position"""
+        return make_virtual_offset(self._out.tell(), self._buflen)
+
+    def write(self, data):
+        while data:
+            n = min(len(data), self.BLOCK_SIZE - self._buflen)
+            self._buf.append(data[:n])
+            self._buflen += n
+            data = data[n:]
+            if self._buflen == self.BLOCK_SIZE:
+                self.flush()
+
+    def flush(self):
+        if self._buflen > 0:
+            self._write_block("".join(self._buf))
+            self._buf = []
+            self._buflen = 0
+
+    def _write_block(self, data):
+        comp = zlib.compressobj(self._level, zlib.DEFLATED, -15)
+        cdata = comp.compress(data) + comp.flush()
+        bsize = _BGZF_HEADER.size + len(cdata) + 8 - 1
+        self._out.write(_BGZF_HEADER.pack(
+            0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord("B"), ord("C"), 2, bsize))
+        self._out.write(cdata)
+        self._out.write(struct.pack("<II", zlib.crc32(data) & 0xffffffff,
+                                    len(data)))
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        # empty EOF block
+        self._write_block("")
+        self._out.close()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
@@ -1,6 +1,13 @@
+from collections import deque
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os
+from Queue import Empty
+from Queue import Queue
+import subprocess
 import sys
 import time
+import traceback
 
 
 # states for jobs
@@ -515,6 +522,417 @@ class Pipeline:
                     return
 
 
+#=============================================================================
+# pool-based pipeline
+
+
+class JobJournal:
+    """
+    Append-only journal of job states
+
+    Each line is 'status<TAB>jobname'.  The last valid line for a job gives
+    its state, so a partially written final line (e.g. after a crash) is
+    ignored.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.out = None
+
+    def load(self):
+        """Returns a dict of job states recorded in the journal"""
+        status = {}
+        if os.path.exists(self.filename):
+            for line in file(self.filename):
+                if not line.endswith("\n"):
+                    break
+                tokens = line.rstrip("\n").split("\t", 1)
+                if len(tokens) == 2 and tokens[0] in VALID_STATUS:
+                    status[tokens[1]] = tokens[0]
+        return status
+
+    def compact(self, status):
+        """Rewrite the journal with one line per job"""
+        self.close()
+        tmp = self.filename + ".tmp"
+        out = file(tmp, "w")
+        for name, state in status.iteritems():
+            if state != STATUS_UNDONE:
+                out.write("%s\t%s\n" % (state, name))
+        out.close()
+        os.rename(tmp, self.filename)
+
+    def record(self, name, status):
+        if self.out is None:
+            self.out = file(self.filename, "a")
+        self.out.write("%s\t%s\n" % (status, name))
+        self.out.flush()
+
+    def close(self):
+        if self.out is not None:
+            self.out.close()
+            self.out = None
+
+
+def getNumCpus():
+    """Returns the number of CPUs of this machine"""
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def getAvailableMemory():
+    """Returns the available memory in bytes (or None if unknown)"""
+    try:
+        for line in file("/proc/meminfo"):
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    return None
+
+
+# jobs of the pipeline being processed (inherited by forked pool workers)
+_pool_jobs = {}
+
+
+def _runPoolJob(args):
+    """Run a job in a pool worker, returns (name, success, msg, runtime)"""
+    name, cmd = args
+    start = time.time()
+    msg = ""
+    try:
+        if cmd is None:
+            success = bool(_pool_jobs[name].task())
+        else:
+            success = (subprocess.call(["bash", "-c", cmd]) == 0)
+    except Exception:
+        success = False
+        msg = traceback.format_exc()
+    return name, success, msg, time.time() - start
+
+
+class PoolPipeline (Pipeline):
+    """
+    A Pipeline that runs jobs on a local pool of worker processes
+
+    Jobs whose parents are done are kept in a ready queue and dispatched
+    to the pool (in the order they became ready) while the running jobs'
+    CPU and memory requirements (see add()) fit within maxCpus and
+    maxMemory.  Function jobs run in the workers as well, which are
+    forked when process() is called (use threads=True for a thread pool).
+
+    Job states are kept in memory and recorded in a single append-only
+    journal file in the status directory.
+    """
+
+    def __init__(self,
+                 statusDir="pipeline",
+                 maxCpus=None,
+                 maxMemory=None,
+                 threads=False,
+                 dispatch=BASH_DISPATCH):
+        Pipeline.__init__(self, statusDir, background=True,
+                          dispatch=dispatch)
+
+        self.maxCpus = maxCpus if maxCpus is not None else getNumCpus()
+        self.maxMemory = maxMemory
+        self.threads = threads
+        self.journal = None
+        self.journalStatus = {}
+        self.runtimes = {}
+        self.pool = None
+
+        # seconds between checks that pool workers are alive
+        self.checkInterval = 1.0
+
+    def getJournalFile(self):
+        return os.path.join(self.statusDir, "pipeline.journal")
+
+    def setMaxNumProc(self, nproc):
+        self.maxCpus = nproc
+
+    def setMaxMemory(self, memory):
+        self.maxMemory = memory
+
+    def add(self, name, task, depends=[], background=None, dispatch=None,
+            cpus=1, memory=0):
+        """Add a job requiring 'cpus' CPUs and 'memory' bytes"""
+        Pipeline.add(self, name, task, depends, background, dispatch)
+        job = self.jobs[name]
+        job.cpus = cpus
+        job.memory = memory
+        if self.isInit:
+            job.status = self.getRecordedStatus(job)
+        return name
+
+    def addGroup(self, name, subjobnames, depends=[], background=None,
+                 dispatch=None):
+        Pipeline.addGroup(self, name, subjobnames, depends, background,
+                          dispatch)
+        job = self.jobs[name]
+        job.cpus = max([1] + [getattr(x, "cpus", 1) for x in job.subjobs])
+        job.memory = max([0] + [getattr(x, "memory", 0)
+                                for x in job.subjobs])
+        if self.isInit:
+            job.status = self.getRecordedStatus(job)
+        return name
+
+    #=========================================================================
+    # job status
+
+    def getJournal(self):
+        if self.journal is None:
+            self.ensureStatusDir()
+            self.journal = JobJournal(self.getJournalFile())
+        return self.journal
+
+    def init(self):
+        if self.needReset:
+            self.getJournal().compact({})
+            self.needReset = False
+            self.isInit = False
+
+        if not self.isInit:
+            # read in the status of all jobs (afterwards states are kept
+            # up to date in memory)
+            self.readStatus()
+
+            # clear any pending jobs
+            self.pending = {}
+
+            # jobs that were running are now back to pending
+            for job in self.jobs.itervalues():
+                if job.status in [STATUS_RUNNING,
+                                  STATUS_PENDING,
+                                  STATUS_ERROR]:
+                    job.status = STATUS_UNDONE
+            self.getJournal().compact(dict((job.name, job.status)
+                                      for job in self.jobs.itervalues()))
+            self.isInit = True
+
+    def readStatus(self, retry=True):
+        self.journalStatus = self.getJournal().load()
+        for job in self.jobs.itervalues():
+            job.status = self.getRecordedStatus(job)
+
+    def getRecordedStatus(self, job):
+        status = self.journalStatus.get(job.name, STATUS_UNDONE)
+        if self.isInit and status != STATUS_DONE:
+            # unfinished jobs of a previous run are incomplete
+            return STATUS_UNDONE
+        return status
+
+    def readJobStatus(self, job, retry=True):
+        # job states are kept up to date in memory
+        pass
+
+    def writeJobStatus(self, job, status=None):
+        if status is not None:
+            job.status = status
+        self.getJournal().record(job.name, job.status)
+
+    #=========================================================================
+    # scheduling
+
+    def run(self, name):
+        """Mark a job and its incomplete ancestors as pending"""
+        self.init()
+
+        if name not in self.jobs:
+            raise PipelineException("unknown job '%s'" % name)
+
+        stack = [self.jobs[name]]
+        while stack:
+            job = stack.pop()
+            if job.status == STATUS_DONE or job in self.pending:
+                continue
+            elif job.status == STATUS_ERROR:
+                job.raiseError()
+            self.addPending(job)
+            stack.extend(job.parents)
+
+    def getJobCommand(self, job):
+        """Returns the shell command for a job (None for function jobs)"""
+        if job.tasktype == "function":
+            return None
+
+        if not job.background:
+            return job.task
+
+        # save task into script file and expand dispatch
+        script = self.getJobScriptFile(job)
+        out = file(script, "w")
+        out.write(job.task)
+        out.close()
+
+        dispatch = job.dispatch
+        dispatch = dispatch.replace("$JOBNAME", job.name)
+        dispatch = dispatch.replace("$SCRIPT", script)
+        dispatch = dispatch.replace("$STATUSDIR", self.statusDir)
+        return dispatch
+
+    def process(self, poll=False):
+        """
+        Run all pending jobs, returns when they are all done
+
+        If poll is True, finished jobs are collected and new jobs are
+        dispatched without waiting, and process() returns while jobs are
+        still running.  Call process(poll=True) again to continue.
+        """
+        self.init()
+
+        if self.pool is None:
+            if len(self.pending) == 0:
+                return
+            self.startPool()
+
+        try:
+            # jobs made pending since the last call
+            for job in self.pending:
+                if job not in self.nwaits and job not in self.running:
+                    self.nwaits[job] = sum(1 for parent in job.parents
+                                           if parent.status != STATUS_DONE)
+                    if self.nwaits[job] == 0:
+                        self.ready.append(job)
+
+            while True:
+                self.dispatchJobs()
+                if not self.running:
+                    break
+
+                # wait for a job to finish
+                result = self.getResult(block=not poll)
+                if result is not None:
+                    self.finishResult(result)
+                elif poll:
+                    return
+        except:
+            self.stopPool(terminate=True)
+            raise
+
+        # the tasks of dead workers never finish, so a pool with errors is
+        # terminated rather than joined
+        self.stopPool(terminate=bool(self.errors))
+        if self.errors:
+            self.errors[0].raiseError()
+
+    def startPool(self):
+        """Start the worker pool and the scheduling state of process()"""
+        global _pool_jobs
+
+        # jobs are inherited by forked workers
+        _pool_jobs = self.jobs
+        nworkers = max(1, min(self.maxCpus, len(self.pending)))
+        if self.threads:
+            self.pool = ThreadPool(nworkers)
+        else:
+            self.pool = multiprocessing.Pool(nworkers)
+        self.workers = list(self.pool._pool)
+        self.results = Queue()
+
+        self.availMemory = self.maxMemory
+        if self.availMemory is None:
+            self.availMemory = getAvailableMemory()
+
+        # count unfinished parents of each pending job
+        self.nwaits = {}
+        self.ready = deque()
+        self.running = {}
+        self.usedCpus = 0
+        self.usedMemory = 0
+        self.errors = []
+
+    def stopPool(self, terminate=False):
+        """Stop the worker pool"""
+        global _pool_jobs
+
+        if terminate:
+            self.pool.terminate()
+        else:
+            self.pool.close()
+        self.pool.join()
+        self.pool = None
+        _pool_jobs = {}
+
+    def dispatchJobs(self):
+        """Dispatch ready jobs that fit within resource limits"""
+        while self.ready and not self.errors:
+            job = self.ready[0]
+            cpus = getattr(job, "cpus", 1)
+            memory = getattr(job, "memory", 0)
+            if self.running and (
+                    self.usedCpus + cpus > self.maxCpus or
+                    (self.availMemory is not None and
+                     self.usedMemory + memory > self.availMemory)):
+                break
+            self.ready.popleft()
+
+            self.log("%s: BEGIN" % job.name)
+            if self.testing:
+                print "* running job '%s'\n" % job.name
+                self.results.put((job.name, True, "", 0.0))
+            else:
+                self.pool.apply_async(
+                    _runPoolJob, [(job.name, self.getJobCommand(job))],
+                    callback=self.results.put)
+            self.writeJobStatus(job, STATUS_RUNNING)
+            self.running[job] = (cpus, memory)
+            self.usedCpus += cpus
+            self.usedMemory += memory
+
+    def getResult(self, block=True):
+        """
+        Returns the result of the next finished job or None if no job
+        finished (without blocking, or within checkInterval seconds)
+
+        If a worker process has died, its job can never report back, so
+        all running jobs are failed.
+        """
+        try:
+            return self.results.get(block, self.checkInterval)
+        except Empty:
+            pass
+
+        # check that no worker has died (the pool replaces dead workers)
+        alive = set(worker for worker in self.pool._pool
+                    if worker.exitcode is None)
+        if any(worker not in alive for worker in self.workers):
+            for job in self.running.keys():
+                self.finishResult((job.name, False, "a pool worker died",
+                                   0.0))
+        return None
+
+    def finishResult(self, result):
+        """Record the result of a finished job"""
+        name, success, msg, runtime = result
+        job = self.jobs[name]
+        cpus, memory = self.running.pop(job)
+        self.usedCpus -= cpus
+        self.usedMemory -= memory
+        self.runtimes[name] = runtime
+
+        if not success:
+            self.log("%s: ERROR" % name)
+            if msg:
+                self.log(msg)
+            self.removePending(job, STATUS_ERROR)
+            self.errors.append(job)
+            return
+
+        self.log("%s: END" % name)
+        self.removePending(job, STATUS_DONE)
+        job.notifyChildren()
+
+        # queue children that are no longer waiting
+        for child in job.children:
+            if child in self.nwaits:
+                self.nwaits[child] -= 1
+                if self.nwaits[child] == 0:
+                    self.ready.append(child)
+
+
 def hasLsf():
     """Returns True only if LSF is available"""
 
@@ -22,6 +22,13 @@
     ilmat -- iterate sparse label matrix
              [(labeli, labelj, v), ...]
 
+    Binary formats (require numpy):
+
+    npy   -- dense matrix as a NumPy array (.npy file, can be memory-mapped)
+
+    csr   -- sparse compressed-row matrix as NumPy arrays
+             (indptr, indices, data), stored in a .npz file
+
 """
 
 # python libs
@@ -242,6 +249,80 @@ def dmat2dlmat(dmat, rowlabels, collabels):
     return dlmat
 
 
+def imat2csr(nrows, ncols, nnz, imat):
+    """
+    Converts an index matrix iterator to a compressed-row matrix
+    (indptr, indices, data) of NumPy arrays
+
+    As with imat2rmat, the last value of a repeated entry is kept.
+    """
+    import numpy as np
+
+    if isinstance(imat, tuple) and len(imat) == 3:
+        # imat given as arrays (rows, cols, vals)
+        rows, cols, vals = map(np.asarray, imat)
+    else:
+        entries = list(imat)
+        rows = np.array([x[0] for x in entries], dtype=np.int64)
+        cols = np.array([x[1] for x in entries], dtype=np.int64)
+        vals = np.array([x[2] for x in entries], dtype=float)
+
+    # sort entries by row and column (stable, so repeats stay in order)
+    order = np.lexsort((cols, rows))
+    rows, cols, vals = rows[order], cols[order], vals[order]
+    if len(rows) > 0:
+        last = np.concatenate(
+            ((rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1]), [True]))
+        rows, cols, vals = rows[last], cols[last], vals[last]
+
+    indptr = np.zeros(nrows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=nrows), out=indptr[1:])
+    return indptr, cols, vals
+
+
+def csr2imat(csr):
+    """Converts a compressed-row matrix to an index matrix iterator"""
+    indptr, indices, data = csr
+    for i in xrange(len(indptr) - 1):
+        for k in xrange(indptr[i], indptr[i+1]):
+            yield i, int(indices[k]), float(data[k])
+
+
+def csr2dense(nrows, ncols, csr):
+    """Converts a compressed-row matrix to a dense NumPy array"""
+    import numpy as np
+
+    indptr, indices, data = csr
+    mat = np.zeros((nrows, ncols))
+    rows = np.repeat(np.arange(nrows), np.diff(indptr))
+    mat[rows, indices] = data
+    return mat
+
+
+def dense2csr(mat):
+    """Converts a dense matrix to a compressed-row matrix of its non-zeros
+
+       Returns nrows, ncols, nnz, csr
+    """
+    import numpy as np
+
+    mat = np.asarray(mat, dtype=float)
+    nrows, ncols = mat.shape
+    rows, cols = np.nonzero(mat)
+    indptr = np.zeros(nrows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=nrows), out=indptr[1:])
+    return nrows, ncols, len(cols), (indptr, cols.astype(np.int64),
+                                     mat[rows, cols])
+
+
+def csr2scipy(nrows, ncols, csr):
+    """Converts a compressed-row matrix to a scipy.sparse.csr_matrix"""
+    from scipy import sparse
+
+    indptr, indices, data = csr
+    return sparse.csr_matrix((data, indices, indptr), shape=(nrows, ncols))
+
+
 #=============================================================================
 # dense matrix I/O
 
@@ -361,9 +442,39 @@ def write_dmat(out, dmat, square=False):
 
     # write data
     for row in dmat:
-        for val in row[:-1]:
-            out.write("%f\t" % val)
-        out.write("%f\n" % row[-1])
+        out.write("\t".join(["%f" % val for val in row]))
+        out.write("\n")
+
+
+def read_dmat_array(infile, header=False):
+    """
+    Reads a dense matrix into a NumPy array
+    header -- can be True,False,None specifying whether to read a header (True)
+              or auto-detect it (None)
+
+    The whole file is converted at once rather than value by value.
+    """
+    import numpy as np
+
+    text = infile.read()
+    lines = text.split("\n", 2)
+    first_row = lines[0].split()
+    second_row = lines[1].split() if len(lines) > 1 else []
+    nrows, ncols = parse_dmat_header(first_row, header,
+                                     [first_row, second_row])
+    if nrows is not None:
+        # skip header
+        text = text[len(lines[0]):]
+    else:
+        ncols = len(first_row)
+
+    data = np.array(text.split(), dtype=float)
+    if ncols == 0 or len(data) % ncols != 0:
+        raise Exception("rows are not equal length")
+    data = data.reshape((-1, ncols))
+    if nrows is not None:
+        assert nrows == data.shape[0], "wrong number of rows"
+    return data
 
 
 #=============================================================================
@@ -538,3 +649,51 @@ def write_dlmat(out, dlmat):
         for i in xrange(len(row)-1):
             out.write(str(row[i]) + "\t")
         out.write(str(row[-1]) + "\n")
+
+
+#=============================================================================
+# binary matrix I/O
+
+
+def write_npy(out, mat):
+    """Write a dense matrix as a NumPy .npy file"""
+    import numpy as np
+
+    np.save(out, np.asarray(mat, dtype=float))
+
+
+def read_npy(filename, mmap=True):
+    """
+    Read a dense matrix from a NumPy .npy file
+
+    if mmap is True, the matrix is memory-mapped (read-only) rather than
+    loaded into memory.
+    """
+    import numpy as np
+
+    return np.load(filename, mmap_mode="r" if mmap else None)
+
+
+def write_csr(out, nrows, ncols, csr):
+    """Write a compressed-row matrix as a NumPy .npz file"""
+    import numpy as np
+
+    indptr, indices, data = csr
+    np.savez(out, shape=np.array([nrows, ncols], dtype=np.int64),
+             indptr=indptr, indices=indices, data=data)
+
+
+def read_csr(infile):
+    """
+    Read a compressed-row matrix from a NumPy .npz file
+    Returns nrows, ncols, nnz, (indptr, indices, data)
+    """
+    import numpy as np
+
+    arrays = np.load(infile)
+    try:
+        nrows, ncols = [int(x) for x in arrays["shape"]]
+        csr = (arrays["indptr"], arrays["indices"], arrays["data"])
+    finally:
+        arrays.close()
+    return nrows, ncols, len(csr[2]), csr
@@ -3,6 +3,11 @@
 
 # TODO: add curses support?
 
+import json
+import os
+import sys
+import time
+
 from rasmus import util
 
 
@@ -106,9 +111,207 @@ class FancyProgressBar (Progress):
         self.bar += amount
 
 
-if __name__ == "__main__":
-    import time
+#=============================================================================
+# throughput progress
+
+
+def format_duration(secs):
+    """Format a duration in seconds as e.g. '1h02m', '3m05s' or '12s'"""
+    secs = int(secs)
+    if secs >= 3600:
+        return "%dh%02dm" % (secs // 3600, secs % 3600 // 60)
+    elif secs >= 60:
+        return "%dm%02ds" % (secs // 60, secs % 60)
+    else:
+        return "%ds" % secs
+
+
+class ThroughputProgress:
+    """
+    Progress reporting for streaming jobs
+
+    Counts items (and optionally bytes) and reports the rates of both, the
+    percent done and an ETA when a total is known.  Reports are written at
+    most once every 'interval' seconds, and the clock is only checked once
+    every 'check' updates, so update() is cheap enough for inner loops.
+
+    The current byte position can be given with update(), set with
+    setBytes(), or polled from 'getBytes', a function called at each
+    report.
+
+    If 'status_file' is given, each report is also written to it as a JSON
+    dict (replaced atomically) for monitoring by other programs.
+    """
+
+    def __init__(self, title="progress", total=None, total_bytes=None,
+                 unit="items", interval=1.0, check=100,
+                 out=sys.stderr, status_file=None, getBytes=None):
+        self.title = title
+        self.total = total
+        self.total_bytes = total_bytes
+        self.unit = unit
+        self.interval = interval
+        self.check = check
+        self.out = out
+        self.status_file = status_file
+        self.getBytes = getBytes
+
+        self.items = 0
+        self.nbytes = 0
+        self.done = False
+        self.start = self.last = time.time()
+        self._countdown = check
+
+    def update(self, items=1, nbytes=0):
+        """Record progress of 'items' items and 'nbytes' bytes"""
+        self.items += items
+        self.nbytes += nbytes
+        self._countdown -= 1
+        if self._countdown <= 0:
+            self._countdown = self.check
+            if time.time() - self.last >= self.interval:
+                self.report()
+
+    def setBytes(self, nbytes):
+        self.nbytes = nbytes
+
+    def getStatus(self):
+        """Returns a dict of the current progress"""
+        now = time.time()
+        if self.getBytes is not None:
+            self.nbytes = self.getBytes()
+        elapsed = now - self.start
+
+        status = {
+            "title": self.title,
+            "unit": self.unit,
+            "items": self.items,
+            "bytes": self.nbytes,
+            "elapsed": elapsed,
+            "items_per_sec": self.items / elapsed if elapsed > 0 else 0.0,
+            "mb_per_sec": (self.nbytes / 1e6 / elapsed
+                           if elapsed > 0 else 0.0),
+            "fraction": None,
+            "eta": None,
+            "done": self.done,
+        }
+
+        # estimate fraction done from bytes or items
+        if self.total_bytes:
+            status["fraction"] = min(1.0, self.nbytes /
+                                     float(self.total_bytes))
+        elif self.total:
+            status["fraction"] = min(1.0, self.items / float(self.total))
+        if status["fraction"]:
+            status["eta"] = elapsed * (1.0 - status["fraction"]) / \
+                status["fraction"]
+        return status
+
+    def formatStatus(self, status):
+        text = "%s: %s %s (%.1f/s)" % (
+            self.title, util.int2pretty(status["items"]), self.unit,
+            status["items_per_sec"])
+        if status["bytes"]:
+            text += ", %.1f MB (%.2f MB/s)" % (status["bytes"] / 1e6,
+                                               status["mb_per_sec"])
+        if status["fraction"] is not None:
+            text += ", %.1f%%" % (100 * status["fraction"])
+            if not status["done"]:
+                text += ", ETA %s" % format_duration(status["eta"])
+        text += ", elapsed %s" % format_duration(status["elapsed"])
+        return text
+
+    def report(self):
+        """Write the current progress"""
+        self.last = time.time()
+        status = self.getStatus()
+
+        if self.out is not None:
+            self.out.write(self.formatStatus(status) + "\n")
+            self.out.flush()
 
+        if self.status_file is not None:
+            self.writeStatus(status)
+
+    def writeStatus(self, status):
+        tmp = self.status_file + ".tmp"
+        out = open(tmp, "w")
+        json.dump(status, out, sort_keys=True)
+        out.write("\n")
+        out.close()
+        os.rename(tmp, self.status_file)
+
+    def finish(self):
+        """Write the final progress"""
+        self.done = True
+        self.report()
+
+
+class ProgressStream:
+    """
+    A stream that reports progress through its input file
+
+    Lines are counted as items, and the byte position is taken from the
+    underlying file (the compressed file for compressed input), so the
+    percent done and ETA are known for regular files.
+    """
+
+    def __init__(self, filename, title=None, **options):
+        self.stream = util.open_stream(filename)
+        if title is None:
+            title = filename if isinstance(filename, basestring) else \
+                "progress"
+
+        # determine how to measure the bytes read
+        rawfile = getattr(self.stream, "rawfile", self.stream)
+        total_bytes = None
+        getBytes = None
+        if isinstance(filename, basestring) and os.path.isfile(filename):
+            total_bytes = os.path.getsize(filename)
+            if hasattr(rawfile, "tell"):
+                getBytes = rawfile.tell
+        options.setdefault("unit", "lines")
+        self._count_bytes = getBytes is None
+
+        self.progress = ThroughputProgress(
+            title, total_bytes=total_bytes, getBytes=getBytes, **options)
+
+    def __iter__(self):
+        update = self.progress.update
+        if self._count_bytes:
+            for line in self.stream:
+                update(1, len(line))
+                yield line
+        else:
+            for line in self.stream:
+                update()
+                yield line
+
+    def readline(self):
+        line = self.stream.readline()
+        if line:
+            self.progress.update(1, len(line) if self._count_bytes else 0)
+        return line
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        if self._count_bytes:
+            self.progress.nbytes += len(data)
+        return data
+
+    def close(self):
+        self.progress.finish()
+        self.stream.close()
+
+
+def open_progress_stream(filename, title=None, **options):
+    """Open a stream with util.open_stream() that reports its progress
+
+       Options are passed to ThroughputProgress."""
+    return ProgressStream(filename, title=title, **options)
+
+
+if __name__ == "__main__":
     util.tic("hi")
 
     prog = FancyProgressBar(100)
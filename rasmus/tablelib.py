@@ -40,7 +40,8 @@ Table can also handle custom types.  Custom types must do the following
 
 # python libs
 import copy
-from itertools import chain, imap, izip
+from itertools import chain, groupby, imap, islice, izip
+from operator import itemgetter
 import os
 from sqlite3 import dbapi2 as sqlite
 from StringIO import StringIO
@@ -159,12 +160,75 @@ def format_type(type_object):
     raise Exception("unknown type '%s'" % type_object)
 
 
+#===========================================================================
+# Table indexes
+
+class TableIndex (object):
+    """
+    A hash index of the rows of a table on one or more key columns
+
+    Single column indexes use the column value as the key and composite
+    indexes use a tuple of values.  Each key maps to the list of matching
+    rows (in table order).
+    """
+
+    def __init__(self, rows, keys, unique=False):
+        self.keys = tuple(keys)
+        self.unique = unique
+        self.rows = {}
+        self.version = None
+        self.nrows = None
+
+        keyfunc = itemgetter(*self.keys)
+        lookup = self.rows
+        for row in rows:
+            key = keyfunc(row)
+            group = lookup.get(key)
+            if group is None:
+                lookup[key] = [row]
+            elif unique:
+                raise Exception("duplicate key '%s'" % str(key))
+            else:
+                group.append(row)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __getitem__(self, key):
+        """Returns the row for 'key' (the last row if key is not unique)"""
+        return self.rows[key][-1]
+
+    def get(self, key, default=None):
+        """Returns the row for 'key' or 'default' if key is not present"""
+        group = self.rows.get(key)
+        if group is None:
+            return default
+        return group[-1]
+
+    def get_rows(self, key):
+        """Returns the list of all rows with 'key'"""
+        return self.rows.get(key, [])
+
+    def iterkeys(self):
+        return self.rows.iterkeys()
+
+
 #===========================================================================
 # Table class
 
 class Table (list):
     """A table of data"""
 
+    # default for tables whose rows are restored before their attributes
+    # (e.g. by pickle)
+    _version = 0
+
     def __init__(self, rows=None,
                  headers=None,
                  types={},
@@ -179,6 +243,10 @@ class Table (list):
         self.nheaders = nheaders
         self.filename = filename
 
+        # indexes and a counter of modifications for invalidating them
+        self._indexes = {}
+        self._version = 0
+
         # set data
         if rows:
             self._set_data(rows)
@@ -599,11 +667,7 @@ class Table (list):
     def filter(self, cond):
         """Returns a table with a subset of rows such that cond(row) == True"""
         tab = self.new()
-
-        for row in self:
-            if cond(row):
-                tab.append(row)
-
+        tab.extend(row for row in self if cond(row))
         return tab
 
     def map(self, func, headers=None):
@@ -644,19 +708,22 @@ class Table (list):
         if col is not None:
             key = lambda x: x[col]
 
-        if key is None:
-            last_row = self[0]
-            for row in self[1:]:
-                if row != last_row:
-                    tab.append(row)
-                last_row = row
-        else:
-            last_row = key(self[0])
-            for row in self[1:]:
-                key_row = key(row)
-                if key_row != last_row:
-                    tab.append(row)
-                last_row = key_row
+        def iter_uniq():
+            yield self[0]
+            if key is None:
+                last_row = self[0]
+                for row in self[1:]:
+                    if row != last_row:
+                        yield row
+                    last_row = row
+            else:
+                last_row = key(self[0])
+                for row in self[1:]:
+                    key_row = key(row)
+                    if key_row != last_row:
+                        yield row
+                    last_row = key_row
+        tab.extend(iter_uniq())
 
         return tab
 
@@ -724,6 +791,38 @@ class Table (list):
         lookup.insert = False
         return lookup
 
+    def get_index(self, *keys, **options):
+        """Returns a TableIndex of the rows on one or more key columns
+
+           The index is kept with the table and reused by later calls until
+           the table is modified.  Rows that are edited in place are not
+           detected; call invalidate_indexes() after such edits.  Appended
+           rows are detected by the length of the table, so that append()
+           and extend() stay as fast as for a list.
+
+           extra options:
+           unique=False     # raise an exception on duplicate keys
+        """
+        unique = options.get("unique", False)
+        index = self._indexes.get(keys)
+        if (index is not None and index.table is self and
+                index.version == self._version and
+                index.nrows == len(self) and
+                (index.unique or not unique)):
+            return index
+
+        index = TableIndex(self, keys, unique=unique)
+        index.table = self
+        index.version = self._version
+        index.nrows = len(self)
+        self._indexes[keys] = index
+        return index
+
+    def invalidate_indexes(self):
+        """Discard all indexes of the table"""
+        self._indexes = {}
+        self._version += 1
+
     def get(self, rows=None, cols=None):
         """Returns a table with a subset of the rows and columns"""
 
@@ -737,12 +836,7 @@ class Table (list):
         tab = self.new(cols)
 
         # copy data
-        for i in rows:
-            row = self[i]
-            row2 = {}
-            for j in cols:
-                row2[j] = row[j]
-            tab.append(row2)
+        tab.extend(dict((j, self[i][j]) for j in cols) for i in rows)
 
         return tab
 
@@ -786,6 +880,50 @@ class Table (list):
             key = lambda row: row[self.headers[0]]
 
         list.sort(self, cmp=cmp, key=key, reverse=reverse)
+        self._version += 1
+
+    #===================================================================
+    # list modifications (these invalidate indexes)
+    #
+    # append() and extend() are not overridden since they always change the
+    # length of the table, which get_index() checks.
+
+    def insert(self, i, row):
+        list.insert(self, i, row)
+        self._version += 1
+
+    def pop(self, *args):
+        self._version += 1
+        return list.pop(self, *args)
+
+    def remove(self, row):
+        list.remove(self, row)
+        self._version += 1
+
+    def reverse(self):
+        list.reverse(self)
+        self._version += 1
+
+    def __setitem__(self, key, value):
+        list.__setitem__(self, key, value)
+        self._version += 1
+
+    def __delitem__(self, key):
+        list.__delitem__(self, key)
+        self._version += 1
+
+    def __setslice__(self, a, b, rows):
+        list.__setslice__(self, a, b, rows)
+        self._version += 1
+
+    def __delslice__(self, a, b):
+        list.__delslice__(self, a, b)
+        self._version += 1
+
+    def __imul__(self, n):
+        list.__imul__(self, n)
+        self._version += 1
+        return self
 
     def __getitem__(self, key):
         if isinstance(key, slice):
@@ -893,33 +1031,25 @@ def join_tables(*args, **kwargs):
     if len(args) == 0:
         return Table()
 
-    # determine common keys
-    tab, key, cols = args[0]
-    if isinstance(key, str):
-        keys = tab.cget(key)
-        lookups = [tab.lookup(key)]
-    else:
-        keys = map(key, tab)
-        lookup = {}
-        for row in tab:
-            lookup[key(row)] = row
-        lookups = [lookup]
-
-    keyset = set(keys)
-
-    for tab, key, cols in args[1:]:
+    # build (or reuse) an index for each table
+    lookups = []
+    for tab, key, cols in args:
         if isinstance(key, str):
-            keyset = keyset & set(tab.cget(key))
-            lookups.append(tab.lookup(key))
+            lookups.append(tab.get_index(key, unique=True))
         else:
-            keyset = keyset & set(map(key, tab))
             lookup = {}
             for row in tab:
                 lookup[key(row)] = row
-
             lookups.append(lookup)
 
-    keys = filter(lambda x: x in keyset, keys)
+    # determine common keys in the order of the first table
+    tab, key, cols = args[0]
+    if isinstance(key, str):
+        keys = tab.cget(key)
+    else:
+        keys = map(key, tab)
+    for lookup in lookups[1:]:
+        keys = [x for x in keys if x in lookup]
 
     # build new table
     if "headers" not in kwargs:
@@ -937,6 +1067,229 @@ def join_tables(*args, **kwargs):
     return tab
 
 
+#===========================================================================
+# join engine
+
+JOIN_TYPES = ("inner", "left", "right", "outer")
+
+
+def _make_key_func(key):
+    """Returns a function mapping a row to its key
+
+       key may be a column name, a list of column names (composite key)
+       or a function"""
+    if isinstance(key, str):
+        return itemgetter(key)
+    elif isinstance(key, (list, tuple)):
+        return itemgetter(*key)
+    else:
+        return key
+
+
+def _get_join_cols(rows, cols):
+    """Returns the columns a side of the join contributes or None if they
+       should be determined from the rows"""
+    if cols is not None:
+        return list(cols)
+    return copy.copy(getattr(rows, "headers", None))
+
+
+def _merge_rows(left_row, right_row, left_cols, right_cols):
+    """Combine a left and right row (either may be None for outer joins)
+
+       On column name conflicts the left value is kept."""
+    row = {}
+    for row2, cols in ((right_row, right_cols), (left_row, left_cols)):
+        if row2 is None:
+            continue
+        elif cols is None:
+            row.update(row2)
+        else:
+            for col in cols:
+                row[col] = row2[col]
+
+    # fill in missing values of outer joins
+    if left_row is None:
+        for col in left_cols:
+            row.setdefault(col, None)
+    if right_row is None:
+        for col in right_cols:
+            row.setdefault(col, None)
+    return row
+
+
+def _hash_join(left, right, left_key, right_key, how,
+               left_cols, right_cols):
+    """Hash join: the right rows are indexed and the left rows streamed"""
+
+    # reuse a persistent index when possible
+    if isinstance(right, Table) and isinstance(right_key, (str, list, tuple)):
+        keys = ((right_key,) if isinstance(right_key, str)
+                else tuple(right_key))
+        lookup = right.get_index(*keys).rows
+        right_rows = right
+    else:
+        keyfunc = _make_key_func(right_key)
+        lookup = {}
+        right_rows = []
+        for row in right:
+            right_rows.append(row)
+            lookup.setdefault(keyfunc(row), []).append(row)
+
+    if right_cols is None and how in ("left", "outer"):
+        right_cols = sorted(right_rows[0].keys()) if right_rows else []
+
+    keep_left = how in ("left", "outer")
+    keep_right = how in ("right", "outer")
+    matched = set()
+    left_keyfunc = _make_key_func(left_key)
+
+    for left_row in left:
+        if left_cols is None and keep_right:
+            left_cols = sorted(left_row.keys())
+        key = left_keyfunc(left_row)
+        group = lookup.get(key)
+        if group is None:
+            if keep_left:
+                yield _merge_rows(left_row, None, left_cols, right_cols)
+        else:
+            if keep_right:
+                matched.add(key)
+            for right_row in group:
+                yield _merge_rows(left_row, right_row, left_cols, right_cols)
+
+    # unmatched right rows (in the order of the right table)
+    if keep_right:
+        right_keyfunc = _make_key_func(right_key)
+        if left_cols is None:
+            left_cols = []
+        for right_row in right_rows:
+            if right_keyfunc(right_row) not in matched:
+                yield _merge_rows(None, right_row, left_cols, right_cols)
+
+
+def _iter_key_groups(rows, keyfunc, name):
+    """Iterate (key, rows) of consecutive rows with the same key, checking
+       that keys are sorted"""
+    last = None
+    first = True
+    for key, group in groupby(rows, keyfunc):
+        if not first and key < last:
+            raise Exception("%s table is not sorted by join key ('%s' after "
+                            "'%s')" % (name, str(key), str(last)))
+        first = False
+        last = key
+        yield key, list(group)
+
+
+def _merge_join(left, right, left_key, right_key, how,
+                left_cols, right_cols):
+    """Merge join: both inputs are streamed and must be sorted by key"""
+
+    keep_left = how in ("left", "outer")
+    keep_right = how in ("right", "outer")
+    lefts = _iter_key_groups(left, _make_key_func(left_key), "left")
+    rights = _iter_key_groups(right, _make_key_func(right_key), "right")
+
+    lkey, lgroup = next(lefts, (None, None))
+    rkey, rgroup = next(rights, (None, None))
+
+    while lgroup is not None or rgroup is not None:
+        if lgroup is not None and left_cols is None:
+            left_cols = sorted(lgroup[0].keys())
+        if rgroup is not None and right_cols is None:
+            right_cols = sorted(rgroup[0].keys())
+
+        if rgroup is None or (lgroup is not None and lkey < rkey):
+            # left only
+            if keep_left:
+                for left_row in lgroup:
+                    yield _merge_rows(left_row, None, left_cols,
+                                      right_cols or [])
+            lkey, lgroup = next(lefts, (None, None))
+
+        elif lgroup is None or rkey < lkey:
+            # right only
+            if keep_right:
+                for right_row in rgroup:
+                    yield _merge_rows(None, right_row, left_cols or [],
+                                      right_cols)
+            rkey, rgroup = next(rights, (None, None))
+
+        else:
+            # matching keys
+            for left_row in lgroup:
+                for right_row in rgroup:
+                    yield _merge_rows(left_row, right_row,
+                                      left_cols, right_cols)
+            lkey, lgroup = next(lefts, (None, None))
+            rkey, rgroup = next(rights, (None, None))
+
+
+def iter_join(left, right, key, right_key=None, how="inner", method="hash",
+              left_cols=None, right_cols=None):
+    """Iterate the rows of a join of two tables
+
+       left, right -- tables or iterators of row dicts (e.g. iter_table())
+       key         -- join key of the left rows: a column name, a list of
+                      column names or a function of a row
+       right_key   -- join key of the right rows (default: same as key)
+       how         -- 'inner', 'left', 'right' or 'outer'
+       method      -- 'hash': the right rows are held in memory and the left
+                             rows are streamed (output is in left order,
+                             followed by unmatched right rows)
+                      'merge': both inputs are streamed and must be sorted
+                             by key (output is in key order)
+       left_cols, right_cols -- columns to keep from each side
+
+       Missing values of outer joins are None.  On column name conflicts the
+       left value is kept.  When a Table is joined on columns with the hash
+       method, its persistent index is used.
+    """
+    if how not in JOIN_TYPES:
+        raise Exception("unknown join type '%s'" % how)
+    if right_key is None:
+        right_key = key
+
+    left_cols = _get_join_cols(left, left_cols)
+    right_cols = _get_join_cols(right, right_cols)
+
+    if method == "hash":
+        return _hash_join(left, right, key, right_key, how,
+                          left_cols, right_cols)
+    elif method == "merge":
+        return _merge_join(left, right, key, right_key, how,
+                           left_cols, right_cols)
+    else:
+        raise Exception("unknown join method '%s'" % method)
+
+
+def join(left, right, key, right_key=None, how="inner", method="hash",
+         left_cols=None, right_cols=None, headers=None):
+    """Join two tables into a new table (see iter_join())"""
+
+    if headers is None:
+        cols1 = _get_join_cols(left, left_cols)
+        cols2 = _get_join_cols(right, right_cols)
+        if cols1 is not None and cols2 is not None:
+            headers = cols1 + [x for x in cols2 if x not in cols1]
+
+    # keep the column types of the input tables
+    types = {}
+    for tab in (right, left):
+        types.update(getattr(tab, "types", {}))
+    if headers is not None:
+        types = util.subdict(types, [x for x in headers if x in types])
+
+    tab = Table(iter_join(left, right, key, right_key=right_key, how=how,
+                          method=method, left_cols=left_cols,
+                          right_cols=right_cols),
+                headers=headers, types=types)
+    if tab.headers is None:
+        tab.headers = []
+    return tab
+
+
 def showtab(tab, name='table'):
     """Show a table in a new xterm"""
 
@@ -947,10 +1300,27 @@ def showtab(tab, name='table'):
               (name, name, tmp, tmp))
 
 
-def sqlget(dbfile, query, maxrows=None, headers=None, headernum=False):
-    """Get a table from a sqlite file"""
+# pragmas for fast bulk loading (trading durability for speed)
+SQL_BULK_PRAGMAS = [
+    ("synchronous", "OFF"),
+    ("journal_mode", "MEMORY"),
+    ("temp_store", "MEMORY"),
+    ("cache_size", "100000"),
+]
+
+
+def _sql_set_pragmas(cur, pragmas):
+    """Set (name, value) pragmas and return their previous values"""
+    old = []
+    for name, value in pragmas:
+        cur.execute("PRAGMA %s" % name)
+        old.append((name, cur.fetchone()[0]))
+        cur.execute("PRAGMA %s = %s" % (name, value))
+    return old
 
-    # open database
+
+def _sql_connect(dbfile):
+    """Returns (con, cur, auto_close) for a sqlite filename or connection"""
     if hasattr(dbfile, "cursor"):
         con = dbfile
         cur = con.cursor()
@@ -959,40 +1329,75 @@ def sqlget(dbfile, query, maxrows=None, headers=None, headernum=False):
         con = sqlite.connect(dbfile, isolation_level="DEFERRED")
         cur = con.cursor()
         auto_close = True
+    return con, cur, auto_close
+
+
+def sqlget(dbfile, query, maxrows=None, headers=None, headernum=False,
+           params=()):
+    """Get a table from a sqlite file"""
 
-    cur.execute(query)
+    con, cur, auto_close = _sql_connect(dbfile)
+    cur.execute(query, params)
 
     # infer header names
-    if headers is None and not headernum:
-        headers = [x[0] for x in cur.description]
+    if headers is None:
+        if headernum:
+            headers = range(len(cur.description))
+        else:
+            headers = [x[0] for x in cur.description]
 
+    # rows are tuples of values (no header row)
     if maxrows is not None:
-        lst = []
-        try:
-            for i in xrange(maxrows):
-                lst.append(cur.next())
-        except StopIteration:
-            pass
-        tab = Table(lst, headers=headers)
+        rows = cur.fetchmany(maxrows)
     else:
-        tab = Table(list(cur), headers=headers)
+        rows = cur
+    tab = Table((dict(izip(headers, row)) for row in rows), headers=headers)
 
     if auto_close:
         con.close()
     return tab
 
 
+def iter_sqlget(dbfile, query, headers=None, params=(), chunksize=10000):
+    """Iterate the rows (as dicts) of a query without building a table"""
+
+    for chunk in iter_sqlget_chunks(dbfile, query, headers=headers,
+                                    params=params, chunksize=chunksize,
+                                    columns=False):
+        for row in chunk:
+            yield row
+
+
+def iter_sqlget_chunks(dbfile, query, headers=None, params=(),
+                       chunksize=10000, columns=True):
+    """Iterate the results of a query in chunks of 'chunksize' rows
+
+       if columns is True, each chunk is a dict of column lists,
+       otherwise each chunk is a list of row dicts.
+    """
+
+    con, cur, auto_close = _sql_connect(dbfile)
+    try:
+        cur.execute(query, params)
+        if headers is None:
+            headers = [x[0] for x in cur.description]
+
+        while True:
+            rows = cur.fetchmany(chunksize)
+            if not rows:
+                break
+            if columns:
+                yield dict(izip(headers, izip(*rows)))
+            else:
+                yield [dict(izip(headers, row)) for row in rows]
+    finally:
+        if auto_close:
+            con.close()
+
+
 def sqlexe(dbfile, sql):
 
-    # open database
-    if hasattr(dbfile, "cursor"):
-        con = dbfile
-        cur = con.cursor()
-        auto_close = False
-    else:
-        con = sqlite.connect(dbfile, isolation_level="DEFERRED")
-        cur = con.cursor()
-        auto_close = True
+    con, cur, auto_close = _sql_connect(dbfile)
 
     cur.execute(sql)
 
@@ -1035,68 +1440,120 @@ def sql_create_table(cur, table_name, tab, overwrite=True):
     cur.execute("""CREATE TABLE %s (%s);""" % (table_name, cols))
 
 
-def sqlput(dbfile, table_name, tab, overwrite=True, create=True):
-    """Insert a table into a sqlite file"""
+def sql_create_index(cur, table_name, cols, index_name=None):
+    """Create an index on one or more columns of an SQL table"""
 
-    # open database
-    if hasattr(dbfile, "cursor"):
-        con = dbfile
-        cur = con.cursor()
-        auto_close = False
-    else:
-        con = sqlite.connect(dbfile, isolation_level="DEFERRED")
-        cur = con.cursor()
-        auto_close = True
+    if isinstance(cols, basestring):
+        cols = [cols]
+    if index_name is None:
+        index_name = "__".join([table_name] + list(cols))
+    cur.execute("CREATE INDEX IF NOT EXISTS %s ON %s (%s);" %
+                (index_name, table_name, ",".join(cols)))
 
-    # read table from file
-    if not isinstance(tab, Table):
-        filename = tab
-        tab = Table()
-        it = tab.read_iter(filename)
 
-        try:
-            # force a reading of the headers
-            row = it.next()
-            rows = chain([row], it)
-        except StopIteration:
-            rows = []
-            pass
-    else:
-        rows = tab
-
-    if create:
-        sql_create_table(cur, table_name, tab, overwrite=overwrite)
+def sql_insert_rows(con, table_name, rows, ncols, batchsize=100000):
+    """Insert rows (sequences of values) into an SQL table
 
-    # determine text columns
-    def issubclass2(t1, t2):
-        if type(t1) != type:
-            return False
-        return issubclass(t1, t2)
+       Rows are inserted with executemany() in transactions of 'batchsize'
+       rows.  Returns the number of rows inserted.
+    """
 
-    text = set()
-    for header in tab.headers:
-        t = tab.types[header]
+    sql = "INSERT INTO %s VALUES (%s);" % (table_name,
+                                           ",".join(["?"] * ncols))
+    cur = con.cursor()
+    rows = iter(rows)
+    nrows = 0
+    while True:
+        batch = list(islice(rows, batchsize))
+        if not batch:
+            break
+        cur.executemany(sql, batch)
+        con.commit()
+        nrows += len(batch)
+    return nrows
+
+
+def sqlput(dbfile, table_name, tab, overwrite=True, create=True,
+           batchsize=100000, indexes=(), bulk=None):
+    """Insert a table into a sqlite file
+
+       tab       -- a Table or the filename of a table
+       batchsize -- number of rows inserted per transaction
+       indexes   -- columns (or tuples of columns) to index after loading
+       bulk      -- if True, set pragmas for fast bulk loading.  The default
+                    is True for filenames and False for connections.
+                    Pragmas set on a connection are restored afterwards.
+    """
 
-        if issubclass2(t, basestring) or not (
-                issubclass2(t, int) or
-                issubclass2(t, float) or
-                issubclass2(t, bool)):
-            text.add(header)
-
-    # insert rows
-    for row in rows:
-        vals = []
-        for header in tab.headers:
-            if header in text:
-                vals.append('"%s"' % row[header])
-            else:
-                vals.append(tab.types[header].__str__(row[header]))
-        vals = ",".join(vals)
-        cur.execute("INSERT INTO %s VALUES (%s);" % (table_name, vals))
+    con, cur, auto_close = _sql_connect(dbfile)
+    if bulk is None:
+        bulk = auto_close
+    if bulk:
+        old_pragmas = _sql_set_pragmas(cur, SQL_BULK_PRAGMAS)
 
-    con.commit()
-    if auto_close:
-        con.close()
+    try:
+        # read table from file
+        if not isinstance(tab, Table):
+            filename = tab
+            tab = Table()
+            it = tab.read_iter(filename)
+
+            try:
+                # force a reading of the headers
+                row = it.next()
+                rows = chain([row], it)
+            except StopIteration:
+                rows = []
+                pass
+        else:
+            rows = tab
+
+        if create:
+            sql_create_table(cur, table_name, tab, overwrite=overwrite)
+
+        # determine text columns
+        def issubclass2(t1, t2):
+            if type(t1) != type:
+                return False
+            return issubclass(t1, t2)
+
+        headers = tab.headers
+        convert = []
+        for i, header in enumerate(headers):
+            t = tab.types[header]
+
+            if issubclass2(t, basestring) or not (
+                    issubclass2(t, int) or
+                    issubclass2(t, float) or
+                    issubclass2(t, bool)):
+                convert.append(i)
+
+        # insert rows
+        def iter_values():
+            for row in rows:
+                values = [row[header] for header in headers]
+                for i in convert:
+                    if not isinstance(values[i], basestring):
+                        values[i] = str(values[i])
+                yield values
+
+        sql_insert_rows(con, table_name, iter_values(), len(headers),
+                        batchsize=batchsize)
+
+        # create indexes after loading
+        for cols in indexes:
+            sql_create_index(cur, table_name, cols)
+
+        con.commit()
+    except:
+        # discard the failed batch (restoring pragmas would commit it)
+        con.rollback()
+        raise
+    finally:
+        if bulk and not auto_close:
+            _sql_set_pragmas(cur, old_pragmas)
+        if auto_close:
+            con.close()
 
 
 #===========================================================================
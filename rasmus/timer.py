@@ -5,20 +5,173 @@
     author: Matt Rasmussen
     date:   2/4/2005
 
+    A Timer can also record its sections into a Profile, a call tree of
+    section counts, wall and CPU times and peak memory, which can be
+    exported as JSON or as collapsed stacks for flamegraphs.
+
 """
 
 # python libs
+import json
 import os
 import sys
 import traceback
 import time
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
 
 # GLOBALS
 _RASMUS_TIMER = None
 _GLOBAL_NOTES = None
 
 
+def getCpuTime():
+    """Returns the user and system CPU time of this process in seconds"""
+    t = os.times()
+    return t[0] + t[1]
+
+
+def getPeakMemory():
+    """Returns the peak resident memory of this process in bytes"""
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # reported in bytes
+        return rss
+    # reported in kilobytes
+    return rss * 1024
+
+
+class ProfileNode:
+    """A named section in a profile call tree"""
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.children = {}
+        self.order = []
+        self.count = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peakMemory = 0
+
+    def getChild(self, name):
+        child = self.children.get(name)
+        if child is None:
+            child = self.children[name] = ProfileNode(name, self)
+            self.order.append(child)
+        return child
+
+    def selfWall(self):
+        """Wall time not spent in child sections"""
+        return self.wall - sum(child.wall for child in self.order)
+
+    def selfCpu(self):
+        """CPU time not spent in child sections"""
+        return self.cpu - sum(child.cpu for child in self.order)
+
+    def path(self):
+        """Returns the names of the sections from the root to this node"""
+        names = []
+        node = self
+        while node.parent is not None:
+            names.append(node.name)
+            node = node.parent
+        names.reverse()
+        return names
+
+    def toDict(self):
+        return {"name": self.name,
+                "count": self.count,
+                "wall": self.wall,
+                "self_wall": self.selfWall(),
+                "cpu": self.cpu,
+                "self_cpu": self.selfCpu(),
+                "peak_memory": self.peakMemory,
+                "children": [child.toDict() for child in self.order]}
+
+
+class Profile:
+    """
+    A call tree of timed sections
+
+    Each section records the number of times it was run, total and self
+    (excluding subsections) wall and CPU time, and the peak resident
+    memory of the process when it ended.  Sections with the same name
+    under the same parent are merged.
+    """
+
+    def __init__(self):
+        self.root = ProfileNode("root")
+        self.stack = []
+
+    def start(self, name):
+        node = (self.stack[-1][0] if self.stack else self.root).getChild(name)
+        self.stack.append((node, time.time(), getCpuTime()))
+
+    def stop(self):
+        if not self.stack:
+            # section was started before profiling was enabled
+            return
+        node, wall, cpu = self.stack.pop()
+        node.count += 1
+        node.wall += time.time() - wall
+        node.cpu += getCpuTime() - cpu
+        node.peakMemory = max(node.peakMemory, getPeakMemory())
+
+    def section(self, name):
+        """Returns a context manager for timing a section"""
+        return _ProfileSection(self, name)
+
+    def iterNodes(self, node=None):
+        """Iterate all sections in depth-first order"""
+        if node is None:
+            node = self.root
+        for child in node.order:
+            yield child
+            for node2 in self.iterNodes(child):
+                yield node2
+
+    def toDict(self):
+        return self.root.toDict()["children"]
+
+    def writeJson(self, out=sys.stdout):
+        """Write the call tree as JSON"""
+        json.dump(self.toDict(), out, indent=2, sort_keys=True)
+        out.write("\n")
+
+    def writeCollapsed(self, out=sys.stdout, cpu=False):
+        """
+        Write the call tree as collapsed stacks for flamegraph tools
+
+        Each line is 'section1;section2;... value' where value is the self
+        wall (or CPU) time in microseconds.
+        """
+        for node in self.iterNodes():
+            value = node.selfCpu() if cpu else node.selfWall()
+            names = [name.replace(";", ":") for name in node.path()]
+            value = max(0, int(round(value * 1e6)))
+            out.write("%s %d\n" % (";".join(names), value))
+
+
+class _ProfileSection:
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.profile.start(self.name)
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.profile.stop()
+
+
 class Timer:
     def __init__(self, stream=sys.stderr, maxdepth=1e1000):
         self.reset()
@@ -26,6 +179,7 @@ class Timer:
         self.showErrors = True
         self.showWarnings = True
         self.quiets = 0
+        self.profile = None
 
     def start(self, msg=""):
         """Start a new timer"""
@@ -35,17 +189,21 @@ class Timer:
             self._write("BEGIN %s:\n" % msg)
         self.msg.append(msg)
         self.flush()
+        if self.profile is not None:
+            self.profile.start(msg)
         self.starts.append(time.time())
 
     def time(self):
         """Get the current duration of the timer"""
 
-        return self.starts[-1] - time.clock()
+        return time.time() - self.starts[-1]
 
     def stop(self):
         """Stop the last created timer and return duration in seconds"""
 
         duration = time.time() - self.starts.pop()
+        if self.profile is not None:
+            self.profile.stop()
         msg = self.msg.pop()
         if msg != "":
             self.indent()
@@ -115,6 +273,24 @@ class Timer:
         """Stop all timers"""
         self.msg = []
         self.starts = []
+        if getattr(self, "profile", None) is not None:
+            self.profile.stack = []
+
+    def enableProfile(self, profile=None):
+        """Record timed sections into a Profile (returns the profile)
+
+           When profiling is disabled (the default), the only overhead is
+           one attribute check per section."""
+        if profile is None:
+            profile = Profile()
+        self.profile = profile
+        return profile
+
+    def disableProfile(self):
+        """Stop recording timed sections, returns the last profile"""
+        profile = self.profile
+        self.profile = None
+        return profile
 
     def depth(self):
         """Get the current number of running timers"""
@@ -191,6 +367,14 @@ def indent():
     return globalTimer().indent()
 
 
+def enableProfile(profile=None):
+    return globalTimer().enableProfile(profile)
+
+
+def disableProfile():
+    return globalTimer().disableProfile()
+
+
 def warn(text, offset=0):
     return globalTimer().warn(text, offset+1)
 
@@ -19,7 +19,7 @@ import os
 import re
 import sys
 from itertools import imap, izip
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 
 #
@@ -154,6 +154,44 @@ class PushIter (object):
         return next
 
 
+class LRUCache (object):
+    """A dictionary-like cache that holds at most 'size' items.
+
+       When full, the least recently used item is discarded."""
+
+    def __init__(self, size=100):
+        self.size = size
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getitem__(self, key):
+        val = self._data.pop(key)
+        self._data[key] = val
+        return val
+
+    def __setitem__(self, key, val):
+        if key in self._data:
+            del self._data[key]
+        elif len(self._data) >= self.size:
+            self._data.popitem(last=False)
+        self._data[key] = val
+
+    def get(self, key, default=None):
+        """Returns a cached value or 'default' if key is not cached"""
+        if key in self._data:
+            return self[key]
+        return default
+
+    def clear(self):
+        """Remove all items from the cache"""
+        self._data.clear()
+
+
 #=============================================================================
 # List and dict functions for functional programming
 
@@ -1122,7 +1160,7 @@ class IgnoreCloseFile (object):
         pass
 
 
-def open_stream(filename, mode="r", ignore_close=True):
+def open_stream(filename, mode="r", ignore_close=True, sniff=False):
     """Returns a file stream depending on the type of 'filename' and 'mode'
 
        filename: the following types for 'filename' are handled:
@@ -1130,10 +1168,15 @@ def open_stream(filename, mode="r", ignore_close=True):
            iterator       - returns 'filename' unchanged
            URL string     - opens http pipe
            '-'            - opens stdin or stdout, depending on 'mode'
+           compressed     - opens a gzip, bzip2 or xz file (detected by
+                            extension) and decompresses it in a background
+                            thread
            other string   - opens file with name 'filename'
        mode: standard mode for file(): r,w,a,b
        ignore_close: if True and filename is a stream, then close() calls on
            the returned stream will be ignored.
+       sniff: if True, files read with an unknown extension are checked for
+           compression by their magic bytes.
     """
 
     is_stream = False
@@ -1166,9 +1209,17 @@ def open_stream(filename, mode="r", ignore_close=True):
             else:
                 raise Exception("stream '-' can only be opened with modes r/w")
 
-        # open regular file
+        # open regular or compressed file
         else:
-            stream = open(filename, mode)
+            from rasmus import compress
+            ext = os.path.splitext(filename)[1].lower()
+            fmt = compress.COMPRESS_EXTS.get(ext)
+            if fmt is None and sniff and "r" in mode:
+                fmt = compress.detect_compression(filename)
+            if fmt:
+                stream = compress.open_compressed(filename, mode, fmt=fmt)
+            else:
+                stream = open(filename, mode)
 
     # cannot handle other types for filename
     else:
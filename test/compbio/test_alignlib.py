@@ -1,3 +1,6 @@
+import random
+
+import numpy as np
 
 from compbio import alignlib
 from compbio import fasta
@@ -17,3 +20,35 @@ def test_align_subsets():
 
     aln2 = alignlib.require_nseqs(aln, 2)
     assert aln2 == {'a': 'AAAA', 'c': 'A-D-', 'b': '-BDC'}
+
+
+def test_compact_coord_converter():
+    """CompactCoordConverter should match CoordConverter"""
+
+    random.seed(1)
+    seqs = ["ATG---CTG-CG", "--AT-G--", "----", "ACGT", ""]
+    for i in range(20):
+        seqs.append("".join(random.choice("A--") for j in range(100)))
+
+    for seq in seqs:
+        conv = alignlib.CoordConverter(seq)
+        conv2 = alignlib.CompactCoordConverter(seq)
+
+        local = range(len(conv.local2alignLookup))
+        align = range(len(seq))
+        assert [conv.local2align(i) for i in local] == \
+            [conv2.local2align(i) for i in local]
+        assert [conv.align2local(i) for i in align] == \
+            [conv2.align2local(i) for i in align]
+        assert list(conv2.local2align(np.array(local, dtype=int))) == \
+            conv.local2alignLookup
+        assert list(conv2.align2local(align)) == conv.align2localLookup
+
+        # global coordinates on both strands
+        start, end = 1001, 1000 + len(local)
+        glob = range(start, end + 1)
+        for strand in [1, -1]:
+            assert list(conv2.global2align(glob, start, end, strand)) == \
+                [conv.global2align(i, start, end, strand) for i in glob]
+            assert list(conv2.align2global(align, start, end, strand)) == \
+                [conv.align2global(i, start, end, strand) for i in align]
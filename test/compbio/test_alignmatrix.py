@@ -0,0 +1,94 @@
+
+import random
+from unittest import TestCase
+
+from compbio import alignlib
+from compbio import fasta
+from compbio import seqlib
+from compbio.alignmatrix import AlignMatrix
+
+
+def make_coding_align(nseqs, ncodons, seed):
+    """Make a random alignment of mostly similar codons"""
+    random.seed(seed)
+    codons = [codon for codon in seqlib.CODON_TABLE
+              if codon != "---"]
+    cols = []
+    for i in range(ncodons):
+        codon = random.choice(codons)
+        col = []
+        for j in range(nseqs):
+            r = random.random()
+            if r < .1:
+                col.append("---")
+            elif r < .15:
+                col.append(codon[:2] + "-")
+            elif r < .2:
+                col.append("NNN")
+            elif r < .5:
+                col.append(codon[:2] + random.choice("ACGTacgt"))
+            else:
+                col.append(codon)
+        cols.append(col)
+
+    aln = fasta.FastaDict()
+    for j in range(nseqs):
+        aln["seq%d" % j] = "".join(col[j] for col in cols)
+    return aln
+
+
+class AlignMatrixTest (TestCase):
+
+    def setUp(self):
+        self.alns = [make_coding_align(nseqs, 200, seed)
+                     for seed, nseqs in enumerate([1, 2, 5, 10])]
+
+    def test_convert(self):
+        for aln in self.alns:
+            mat = AlignMatrix.from_align(aln)
+            self.assertEqual(mat.to_align(), aln)
+            self.assertEqual(mat.to_align().keys(), aln.keys())
+            self.assertEqual(mat.alignlen(), aln.alignlen())
+
+    def test_filters(self):
+        """Column filters should match alignlib"""
+        for aln in self.alns:
+            mat = AlignMatrix.from_align(aln)
+            self.assertEqual(mat.remove_empty_columns().to_align(),
+                             alignlib.remove_empty_columns(aln))
+            self.assertEqual(
+                mat.remove_empty_columns(enforce_codon=True).to_align(),
+                alignlib.remove_empty_columns(aln, enforce_codon=True))
+            self.assertEqual(mat.remove_gapped_columns().to_align(),
+                             alignlib.remove_gapped_columns(aln))
+            self.assertEqual(mat.require_nseqs(2).to_align(),
+                             alignlib.require_nseqs(aln, 2))
+            self.assertEqual(mat.filter_aligned_codons().to_align(),
+                             alignlib.filter_aligned_codons(aln))
+
+    def test_four_fold(self):
+        """Four-fold degenerate sites should match alignlib"""
+        for aln in self.alns:
+            aln = alignlib.filter_aligned_codons(aln)
+            mat = AlignMatrix.from_align(aln)
+            self.assertEqual(list(mat.four_fold_columns().nonzero()[0]),
+                             alignlib.find_four_fold(aln))
+            self.assertEqual(mat.filter_four_fold().to_align(),
+                             alignlib.filter_four_fold(aln))
+
+    def test_stats(self):
+        """Column statistics should match alignlib"""
+        for aln in self.alns:
+            mat = AlignMatrix.from_align(aln)
+            self.assertEqual(list(mat.calc_conservation()),
+                             alignlib.calc_conservation(aln))
+            self.assertEqual(mat.compute_bgfreq(),
+                             alignlib.compute_bgfreq(aln))
+
+            # align2pssm expects sequences indexed by number
+            aln2 = fasta.FastaDict()
+            for i, seq in enumerate(aln.values()):
+                aln2[i] = seq
+            pseudo = {"A": 1, "C": 1, "G": 1, "T": 1}
+            self.assertEqual(mat.align2pssm(pseudo),
+                             alignlib.align2pssm(aln2, pseudo))
@@ -1,8 +1,12 @@
 
 import StringIO
+import random
 import unittest
 
 from compbio import arglib
+from compbio import fasta
+from rasmus import stats
+from rasmus import treelib
 from rasmus import util
 from rasmus.common import izip
 from rasmus.rplotting import rp
@@ -100,6 +104,120 @@ class Arg (unittest.TestCase):
                 b = set(arglib.get_marginal_leaves(arg, node, mid))
                 self.assertEqual(a, b)
 
+    def test_sample_arg(self):
+        """Sample an ARG with the coalescent with recombination"""
+
+        rho = 1.5e-8   # recomb/site/gen
+        l = 100000     # length of locus
+        k = 20         # number of lineages
+        n = 2*10000    # effective popsize
+
+        arg = arglib.sample_arg(k, n, rho, 0, l)
+        arglib.assert_arg(arg)
+        self.assertEqual(len(list(arg.leaves())), k)
+
+        # every block has a complete local tree
+        for (start, end), tree in arglib.iter_local_trees(arg):
+            self.assertEqual(len(list(tree.leaves())), k)
+
+        # ancestral regions are sorted and merged
+        for node in arg:
+            regions = node.data["ancestral"]
+            for reg1, reg2 in zip(regions[:-1], regions[1:]):
+                self.assertTrue(reg1[0] < reg1[1] < reg2[0] < reg2[1])
+
+    def test_sample_arg_simple(self):
+        """sample_arg() and sample_arg_simple() have the same distribution"""
+
+        rho = 1.5e-8   # recomb/site/gen
+        l = 50000      # length of locus
+        k = 8          # number of lineages
+        n = 2*10000    # effective popsize
+        nsamples = 400
+
+        def sample_stats(sample_arg):
+            nrecombs = []
+            tmrcas = []
+            for i in xrange(nsamples):
+                arg = sample_arg(k, n, rho, 0, l)
+                nrecombs.append(len([node for node in arg
+                                     if node.event == "recomb"]))
+                tmrcas.append(arg.root.age)
+            return nrecombs, tmrcas
+
+        for a, b in zip(sample_stats(arglib.sample_arg),
+                        sample_stats(arglib.sample_arg_simple)):
+            # compare means with a two sample z-test
+            se = ((stats.variance(a) + stats.variance(b)) / nsamples) ** .5
+            self.assertTrue(abs(stats.mean(a) - stats.mean(b)) < 4 * se,
+                            (stats.mean(a), stats.mean(b), se))
+
+    def test_fenwick_tree(self):
+        weights = arglib.FenwickTree()
+        values = [3.0, 0.0, 1.0, 0.0, 0.0, 2.5, 4.0]
+        for i, value in enumerate(values):
+            weights.set(i, value)
+        self.assertEqual(weights.total(), sum(values))
+        for i in xrange(len(values) + 1):
+            self.assertEqual(weights.prefix(i), sum(values[:i]))
+
+        # zero weights are never found
+        self.assertEqual(weights.find(0.0), 0)
+        self.assertEqual(weights.find(2.99), 0)
+        self.assertEqual(weights.find(3.0), 2)
+        self.assertEqual(weights.find(4.0), 5)
+        self.assertEqual(weights.find(6.5), 6)
+
+        weights.set(0, 0.0)
+        self.assertEqual(weights.find(0.0), 2)
+
+    def test_arg_block_stats(self):
+        """Statistics of ARG blocks agree with the local trees"""
+
+        rho = 1.5e-8   # recomb/site/gen
+        l = 100000     # length of locus
+        k = 10         # number of lineages
+        n = 2*10000    # effective popsize
+
+        arg = arglib.sample_arg(k, n, rho, 0, l)
+        leaves = sorted(arg.leaf_names())
+        pairs = [(leaves[0], leaves[1]), (leaves[3], leaves[8])]
+        rows = list(arglib.iter_arg_block_stats(arg, pairs=pairs))
+
+        self.assertEqual(rows[0][0], arg.start)
+        self.assertEqual(rows[-1][1], arg.end)
+        for row1, row2 in zip(rows[:-1], rows[1:]):
+            self.assertEqual(row1[1], row2[0])
+
+        for start, end, (tmrca, treelen, blocklen, visible,
+                         pair1, pair2) in rows:
+            tree = arg.get_marginal_tree((start + end) / 2.0)
+            arglib.remove_single_lineages(tree)
+            tree2 = tree.get_tree()
+            self.assertAlmostEqual(tmrca, tree[tree2.root.name].age)
+            self.assertAlmostEqual(treelen,
+                                   sum(node.get_dist() for node in tree))
+            self.assertAlmostEqual(blocklen, treelen * (end - start))
+            for pair, age in ((pairs[0], pair1), (pairs[1], pair2)):
+                lca = treelib.lca([tree2[name] for name in pair])
+                self.assertAlmostEqual(age, tree[lca.name].age)
+
+        self.assertAlmostEqual(sum(row[2][2] for row in rows) /
+                               arglib.arglen(arg), 1.0)
+        self.assertEqual(sum(row[2][3] for row in rows),
+                         len(list(arglib.iter_visible_recombs(arg))))
+
+        # write and read stats
+        stream = StringIO.StringIO()
+        arglib.write_arg_block_stats(stream, arg, ("tmrca", "visible"),
+                                     pairs=pairs[:1])
+        stream.seek(0)
+        headers, columns = arglib.read_arg_block_stats(stream)
+        self.assertEqual(headers, ["start", "end", "tmrca", "visible",
+                                   "tmrca:%s,%s" % pairs[0]])
+        self.assertEqual(len(columns[0]), len(rows))
+        self.assertEqual(sum(columns[3]), sum(row[2][3] for row in rows))
+
     #----------------------------------
     # SPRs
 
@@ -192,6 +310,71 @@ class Arg (unittest.TestCase):
         arglib.subarg_by_leaf_names(arg, keep)
         arg = arglib.smcify_arg(arg)
 
+    def test_arg_leaf_index(self):
+        """Extract sub-ARGs by leaves with an ARGLeafIndex"""
+
+        rho = 1.5e-8   # recomb/site/gen
+        l = 100000     # length of locus
+        k = 8          # number of lineages
+        n = 2*10000    # effective popsize
+
+        arg = arglib.sample_arg(k, n, rho, 0, l)
+        names = sorted(arg.leaf_names())
+        nnodes = len(arg)
+        index = arglib.ARGLeafIndex(arg)
+
+        # leaf sets of the root cover every leaf at every position
+        for start, end, mask in index.segments[arg.root]:
+            self.assertEqual(mask, index.full)
+
+        leaf_sets = [random.sample(names, i) for i in range(1, k+1)]
+        for keep, arg2 in zip(leaf_sets, index.subargs(leaf_sets)):
+            arg3 = arglib.subarg_by_leaf_names(arg.copy(), keep)
+            self.assertEqual(sorted(arg2.leaf_names()), sorted(keep))
+            self.assertEqual(set(arg2.nodes), set(arg3.nodes))
+            for node in arg2:
+                self.assertTrue(node.equal(arg3[node.name]))
+            arglib.assert_arg(arg2)
+
+        # original ARG is unchanged
+        self.assertEqual(len(arg), nnodes)
+        arglib.assert_arg(arg)
+
+    def test_arg_leaf_index_region(self):
+        """Extract sub-ARGs by leaves and region with an ARGLeafIndex"""
+
+        rho = 1.5e-8   # recomb/site/gen
+        l = 100000     # length of locus
+        k = 8          # number of lineages
+        n = 2*10000    # effective popsize
+
+        def get_clusters(tree):
+            clusters = set()
+            for node in tree:
+                if len(node.children) > 1:
+                    clusters.add((node.name,
+                                  frozenset(tree.leaf_names(node))))
+            return clusters
+
+        arg = arglib.sample_arg(k, n, rho, 0, l)
+        names = sorted(arg.leaf_names())
+        start, end = 20000, 60000
+        keep = random.sample(names, 5)
+        arg2 = arglib.subargs_by_leaf_names(arg, [keep], start, end)[0]
+        arg3 = arglib.subarg_by_leaf_names(arg.copy(), keep)
+
+        self.assertEqual((arg2.start, arg2.end), (start, end))
+        self.assertTrue(set(arg2.nodes) <= set(arg3.nodes))
+        self.assertTrue(len(arg2) <= len(arg3))
+        for pos in range(start, end, 1000):
+            self.assertEqual(get_clusters(arg2.get_marginal_tree(pos)),
+                             get_clusters(arg3.get_marginal_tree(pos)))
+
+        # region sub-ARG only contains recombinations within the region
+        for node in arg2:
+            if node.event == "recomb":
+                self.assertTrue(start < node.pos < end)
+
     #----------------------------
     # SMC sampling
 
@@ -205,3 +388,252 @@ class Arg (unittest.TestCase):
 
         arg = arglib.sample_arg_smc(k, n, rho, 0, length)
         arglib.assert_arg(arg)
+
+    def test_sample_smc_sprs(self):
+        """SMC SPRs agree with the SPRs of the resulting ARG"""
+
+        length = 100000    # length of locus
+        k = 8              # number of lineages
+        n = 2*10000        # effective popsize
+        rho = 1.5e-8       # recomb/site/gen
+
+        it = arglib.sample_smc_sprs(k, n, rho, 0, length)
+        tree = it.next()
+        sprs = list(it)
+        arg = arglib.make_arg_from_sprs(tree.copy(), iter(sprs))
+        arglib.assert_arg(arg)
+
+        sprs2 = list(arglib.iter_arg_sprs(arg, use_leaves=True))
+        self.assertEqual(len(sprs), len(sprs2))
+        for a, b in izip(sprs, sprs2):
+            self.assertEqual(a[0], b[0])
+            self.assertEqual(sorted(a[1][0]), sorted(b[1][0]))
+            self.assertEqual(sorted(a[2][0]), sorted(b[2][0]))
+            self.assertAlmostEqual(a[1][1], b[1][1])
+            self.assertAlmostEqual(a[2][1], b[2][1])
+
+    def test_sample_smc_sprs_compact(self):
+        """Compact SPRs give leaf sets as bitmasks"""
+
+        length = 100000    # length of locus
+        k = 8              # number of lineages
+        n = 2*10000        # effective popsize
+        rho = 1.5e-8       # recomb/site/gen
+
+        random.seed(1)
+        it = arglib.sample_smc_sprs(k, n, rho, 0, length)
+        leaves = sorted(it.next().leaf_names())
+        sprs = list(it)
+
+        random.seed(1)
+        it = arglib.sample_smc_sprs(k, n, rho, 0, length, compact=True)
+        it.next()
+        for spr, spr2 in izip(sprs, it):
+            rleaves = [leaves[i] for i in arglib.iter_mask_bits(spr2[1][0])]
+            cleaves = [leaves[i] for i in arglib.iter_mask_bits(spr2[2][0])]
+            self.assertEqual(spr, (spr2[0], (rleaves, spr2[1][1]),
+                                   (cleaves, spr2[2][1])))
+
+    def test_sample_smc_sprs_simple(self):
+        """sample_smc_sprs() and sample_smc_sprs_simple() agree"""
+
+        length = 2000000   # length of locus
+        k = 20             # number of lineages
+        n = 2*10000        # effective popsize
+        rho = 1.5e-8       # recomb/site/gen
+
+        def sample_stats(sample_sprs):
+            it = sample_sprs(k, n, rho, 0, length)
+            it.next()
+            return zip(*[(ctime - rtime, rtime)
+                         for pos, (rleaves, rtime), (cleaves, ctime) in it])
+
+        for a, b in zip(sample_stats(arglib.sample_smc_sprs),
+                        sample_stats(arglib.sample_smc_sprs_simple)):
+            se = (stats.variance(a) / len(a) +
+                  stats.variance(b) / len(b)) ** .5
+            self.assertTrue(abs(stats.mean(a) - stats.mean(b)) < 4 * se,
+                            (stats.mean(a), stats.mean(b), se))
+
+    def test_sample_arg_smcprime(self):
+        """Sample an ARG using the SMC' process"""
+
+        length = 200000    # length of locus
+        k = 5              # number of lineages
+        n = 1e4            # effective popsize
+        rho = 1.5e-8       # recomb/site/gen
+
+        arg = arglib.sample_arg_smc(k, n, rho, 0, length, smcprime=True)
+        arglib.assert_arg(arg)
+
+        # SMC' allows recoalescence with the recombining branch
+        it = arglib.sample_smc_sprs(k, n, rho, 0, 10 * length, smcprime=True)
+        it.next()
+        self.assertTrue(any(rleaves == cleaves
+                            for pos, (rleaves, rtime), (cleaves, ctime)
+                            in it))
+
+    #----------------------------
+    # mutations
+
+    def test_sample_mutation_sites(self):
+        """Mutation leaf sets agree with the marginal trees"""
+
+        length = 100000    # length of locus
+        k = 10             # number of lineages
+        n = 2*10000        # effective popsize
+        rho = 1.5e-8       # recomb/site/gen
+        mu = 2.5e-8        # mut/site/gen
+
+        arg = arglib.sample_arg(k, n, rho, 0, length)
+        sites = arglib.sample_mutation_sites(arg, mu)
+        self.assertEqual(sites.positions, sorted(sites.positions))
+
+        for i, (pos, t, leaves) in enumerate(sites.iter_mutations()):
+            node, parent = [arg[name] for name in sites.branches[i]]
+            self.assertEqual(arg.get_local_parent(node, pos), parent)
+            self.assertTrue(node.age <= t <= parent.age)
+            self.assertEqual(
+                sorted(leaves),
+                sorted(x.name for x in arglib.get_marginal_leaves(
+                    arg, node, pos)))
+            self.assertTrue(0 < len(leaves) < k)
+
+        # expected number of mutations
+        nmuts = [len(arglib.sample_mutation_sites(arg, mu))
+                 for i in xrange(100)]
+        expected = mu * arglib.arglen(arg)
+        self.assertTrue(abs(stats.mean(nmuts) - expected) <
+                        4 * (expected / len(nmuts)) ** .5)
+
+    def test_mutation_genotypes(self):
+        """Genotype matrix from mutation sites"""
+
+        leaves = ["n%d" % i for i in range(10)]
+        masks = [1, 2**9, 0b1100110011, 2**10 - 2]
+        sites = arglib.MutationSites(leaves, [1.5, 2.5, 3.5, 4.5],
+                                     [10.0, 20.0, 30.0, 40.0], masks,
+                                     start=0, end=6)
+        geno = sites.genotypes()
+        self.assertEqual(geno.shape, (4, 10))
+        for i, mask in enumerate(masks):
+            self.assertEqual(list(geno[i]),
+                             [(mask >> j) & 1 for j in range(10)])
+        self.assertEqual(sites.get_leaves(0), ["n0"])
+        self.assertEqual(sites.get_leaves(1), ["n9"])
+
+        packed = sites.genotypes(packed=True)
+        self.assertEqual(packed.shape, (4, 2))
+        self.assertEqual(list(packed[1]), [0, 64])
+
+        aln = arglib.make_alignment_sites(sites)
+        self.assertEqual(aln.keys(), leaves)
+        self.assertEqual(aln["n0"], "ACACAA")
+        self.assertEqual(aln["n9"], "AACCCA")
+
+    def test_write_mutation_sites(self):
+        """Write mutation sites"""
+
+        length = 20000     # length of locus
+        k = 6              # number of lineages
+        n = 2*10000        # effective popsize
+        rho = 1.5e-8       # recomb/site/gen
+        mu = 2.5e-8        # mut/site/gen
+
+        arg = arglib.sample_arg(k, n, rho, 0, length)
+        sites = arglib.sample_mutation_sites(arg, mu)
+
+        stream = StringIO.StringIO()
+        arglib.write_mutation_sites(stream, sites)
+        rows = [line.rstrip("\n").split("\t")
+                for line in stream.getvalue().splitlines()]
+        self.assertEqual(len(rows), len(sites))
+        for row, (pos, t, leaves) in izip(rows, sites.iter_mutations()):
+            self.assertEqual(row[2].split(","), leaves)
+
+        stream = StringIO.StringIO()
+        arglib.write_vcf(stream, sites, chrom="chr1")
+        lines = stream.getvalue().splitlines()
+        header = [line for line in lines if line.startswith("#")]
+        rows = [line.split("\t") for line in lines
+                if not line.startswith("#")]
+        self.assertEqual(header[-1].split("\t")[9:], sites.leaves)
+        self.assertEqual(len(rows), len(sites))
+        geno = sites.genotypes()
+        for i, row in enumerate(rows):
+            self.assertEqual(row[0], "chr1")
+            self.assertEqual(int(row[1]), int(sites.positions[i]) + 1)
+            self.assertEqual(row[9:], map(str, geno[i]))
+
+    #----------------------------
+    # splits
+
+    def test_site_patterns(self):
+        """Unique site patterns of an alignment"""
+
+        aln = fasta.FastaDict()
+        aln["a"] = "AACAAGTA"
+        aln["b"] = "AACCAGTA"
+        aln["c"] = "ATAATGTC"
+        aln["d"] = "ATACTGAC"
+
+        patterns = arglib.get_site_patterns(aln)
+        self.assertEqual(patterns.names, ["a", "b", "c", "d"])
+        self.assertEqual(patterns.patterns, [0b1100, 0b1010, 0b1000])
+        self.assertEqual(patterns.counts, [4, 1, 1])
+        self.assertEqual(patterns.positions, [[1, 2, 4, 7], [3], [6]])
+        self.assertEqual(list(patterns.columns), [1, 2, 3, 4, 6, 7])
+        self.assertEqual(list(patterns.site_patterns), [0, 0, 1, 0, 2, 0])
+        self.assertEqual(patterns.get_split(0), (("a", "b"), ("c", "d")))
+        self.assertEqual(patterns.get_split(2), (("d",), ("a", "b", "c")))
+        self.assertEqual(patterns.matrix().tolist(),
+                         [[0, 0, 1, 1], [0, 1, 0, 1], [0, 0, 0, 1]])
+
+        compat = patterns.compatibility_matrix()
+        self.assertEqual(compat.tolist(), [[True, False, True],
+                                           [False, True, True],
+                                           [True, True, True]])
+
+    def test_iter_align_splits(self):
+        """Splits of an alignment"""
+
+        length = 100000    # length of locus
+        k = 12             # number of lineages
+        n = 2*10000        # effective popsize
+        rho = 1.5e-8       # recomb/site/gen
+        mu = 2.5e-8        # mut/site/gen
+
+        arg = arglib.sample_arg(k, n, rho, 0, length)
+        sites = arglib.sample_mutation_sites(arg, mu)
+        aln = arglib.make_alignment_sites(sites)
+
+        self.assertEqual(list(arglib.iter_align_splits(aln)),
+                         list(arglib.iter_align_splits_simple(aln)))
+
+        # compatibility agrees with split functions
+        patterns = arglib.get_site_patterns(aln)
+        compat = patterns.compatibility_matrix(chunksize=7)
+        full = 2**k - 1
+        for i in xrange(len(patterns)):
+            split1 = patterns.get_split(i)[0]
+            for j in xrange(len(patterns)):
+                split2 = patterns.get_split(j)[0]
+                self.assertEqual(compat[i, j],
+                                 arglib.is_split_compatible_unpolar2(
+                                     split1, split2, patterns.names))
+                self.assertEqual(compat[i, j], arglib.is_mask_compatible(
+                    patterns.patterns[i], patterns.patterns[j], full))
+
+    def test_mask_relation(self):
+        """Relations of splits as bitmasks"""
+
+        names = ["a", "b", "c", "d", "e"]
+        splits = [("a",), ("a", "b"), ("a", "b"), ("b", "c"), ("d", "e")]
+        masks = [sum(1 << names.index(x) for x in split)
+                 for split in splits]
+        for split1, mask1 in izip(splits, masks):
+            for split2, mask2 in izip(splits, masks):
+                self.assertEqual(arglib.mask_relation(mask1, mask2),
+                                 arglib.split_relation(split1, split2))
+                self.assertEqual(arglib.is_mask_compatible(mask1, mask2),
+                                 arglib.is_split_compatible(split1, split2))
@@ -0,0 +1,76 @@
+
+import random
+from unittest import TestCase
+
+from rasmus import tablelib
+from rasmus.sets import UnionFind
+from rasmus.testing import make_clean_dir
+
+from compbio import blastcluster
+
+
+def write_blast(filename, hits):
+    out = open(filename, "w")
+    out.write("# comment\n")
+    for gene1, gene2, score in hits:
+        out.write("\t".join(map(str, [
+            gene1, gene2, 90.0, 100, 0, 0, 1, 100, 1, 100, 1e-10, score])))
+        out.write("\n")
+    out.close()
+
+
+class BlastCluster (TestCase):
+
+    def test_union_find(self):
+        """Array union-find should match UnionFind"""
+        random.seed(0)
+        n = 200
+        edges = [(random.randint(0, n-1), random.randint(0, n-1))
+                 for i in range(150)]
+        labels = blastcluster.union_find(n, [e[0] for e in edges],
+                                         [e[1] for e in edges])
+
+        sets = [UnionFind([i]) for i in range(n)]
+        for i, j in edges:
+            sets[i].union(sets[j])
+        for i in range(n):
+            self.assertEqual(labels[i], min(sets[i].members()))
+
+    def test_cluster_blast_families(self):
+        """Families should join genes with hits near their best score"""
+        outdir = "test/tmp/test_blastcluster/"
+        make_clean_dir(outdir)
+
+        random.seed(1)
+        genes = ["g%d" % i for i in range(100)]
+        hits = [(random.choice(genes), random.choice(genes),
+                 random.randint(10, 1000))
+                for i in range(120)]
+        write_blast(outdir + "a.blast", hits[:60])
+        write_blast(outdir + "b.blast", hits[60:])
+
+        # expected clusters
+        best = {}
+        pair_best = {}
+        for gene1, gene2, score in hits:
+            if gene1 == gene2:
+                continue
+            best[gene1] = max(best.get(gene1, 0), score)
+            best[gene2] = max(best.get(gene2, 0), score)
+            pair = tuple(sorted([gene1, gene2]))
+            pair_best[pair] = max(pair_best.get(pair, 0), score)
+        sets = dict((gene, UnionFind([gene])) for gene in genes)
+        for (gene1, gene2), score in pair_best.items():
+            if (score >= best[gene1] * .5 or score >= best[gene2] * .5):
+                sets[gene1].union(sets[gene2])
+        expected = set(frozenset(s.members()) for s in sets.values())
+
+        for nproc in [1, 2]:
+            famtab = blastcluster.cluster_blast_families(
+                [outdir + "a.blast", outdir + "b.blast"],
+                outdir + "fams.tab", genes=genes, relcutoff=.5,
+                nproc=nproc)
+            parts = set(frozenset(row["genes"].split(","))
+                        for row in tablelib.read_table(outdir + "fams.tab"))
+            self.assertEqual(parts, expected)
+            self.assertEqual(len(famtab), len(expected))
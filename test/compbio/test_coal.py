@@ -1,5 +1,6 @@
 
 from math import exp
+import random
 import unittest
 
 from compbio import coal
@@ -415,6 +416,151 @@ class CoalCounts (unittest.TestCase):
                 j = coal.prob_coal_counts_slow(a, b, t, n)
                 fequal(i, j)
 
+    def test_prob_coal_counts_matrix(self):
+        n = 1000
+
+        for t in [0.0, 100.0, 1000.0, 5000.0]:
+            P = coal.prob_coal_counts_matrix(t, n, 20)
+            self.assertEqual(P.shape, (21, 21))
+            for a in xrange(21):
+                for b in xrange(21):
+                    if 1 <= b <= a:
+                        fequal(P[a, b], coal.prob_coal_counts(a, b, t, n))
+                    else:
+                        self.assertEqual(P[a, b], 0.0)
+                if a > 0:
+                    fequal(P[a].sum(), 1.0)
+
+        # matrices are cached and read-only
+        P = coal.prob_coal_counts_matrix(100.0, n, 20)
+        self.assertTrue(P is coal.prob_coal_counts_matrix(100.0, n, 20))
+        self.assertRaises(ValueError, P.__setitem__, (1, 1), 0.0)
+        coal.clear_prob_coal_counts_cache()
+        self.assertFalse(P is coal.prob_coal_counts_matrix(100.0, n, 20))
+
+    def test_prob_coal_counts_matrix_large(self):
+        """Matrices stay stochastic for many lineages and short times"""
+
+        for t, n, M in [(1.0, 1000, 50), (5.0, 10000, 100),
+                        (1e6, 100, 200)]:
+            P = coal.prob_coal_counts_matrix(t, n, M)
+            self.assertTrue(P.min() >= 0.0)
+            for a in xrange(1, M+1):
+                fequal(P[a].sum(), 1.0, rel=1e-12)
+
+                # no coalescence and a single coalescence
+                rate = a*(a-1)/2.0/n
+                fequal(P[a, a], exp(-rate * t), rel=1e-10)
+                if a > 1:
+                    rate2 = (a-1)*(a-2)/2.0/n
+                    fequal(P[a, a-1], rate / (rate - rate2) *
+                           (exp(-rate2 * t) - exp(-rate * t)), rel=1e-8)
+
+            # the series of prob_coal_counts() is accurate for few lineages
+            for a in xrange(1, 11):
+                for b in xrange(1, a+1):
+                    p = coal.prob_coal_counts(a, b, t, n)
+                    if p > 1e-6:
+                        fequal(P[a, b], p)
+
+        # Chapman-Kolmogorov
+        P = coal.prob_coal_counts_matrix(300.0, 1000, 60)
+        P1 = coal.prob_coal_counts_matrix(100.0, 1000, 60)
+        P2 = coal.prob_coal_counts_matrix(200.0, 1000, 60)
+        fequals(P.ravel(), P1.dot(P2).ravel(), rel=1e-10, eabs=1e-15)
+
+    def test_calc_prob_counts_table(self):
+        stree = treelib.parse_newick(
+            "(((A:200, B:200):800, C:1000):500, (D:700, E:700):800);")
+        n = 1000
+        T = 2000
+        gene_counts = {"A": 3, "B": 1, "C": 4, "D": 2, "E": 5}
+        popsizes = coal.init_popsizes(stree, n)
+        stimes = treelib.get_tree_timestamps(stree)
+        sleaves = set(stree.leaves())
+
+        for T in [2000, None]:
+            table = coal.calc_prob_counts_table(
+                gene_counts, T, stree, popsizes, stree.root, sleaves, stimes)
+            table2 = coal.calc_prob_counts_table_slow(
+                gene_counts, T, stree, popsizes, stree.root, sleaves, stimes)
+
+            for node in stree:
+                for probs, probs2 in zip(table[node], table2[node]):
+                    self.assertEqual(len(probs), len(probs2))
+                    fequals(probs, probs2, eabs=1e-10)
+
+
+#=============================================================================
+# allele frequencies
+
+class AlleleFreq (unittest.TestCase):
+
+    def test_legendre_table(self):
+        r = [-1.0, -.3, 0.0, .5, 1.0]
+        leg = coal.legendre_table(r, 30)
+        geg = coal.gegenbauer_table(r, 30)
+        self.assertEqual(leg.shape, (31, 5))
+        for j, x in enumerate(r):
+            legx = coal.legendre(x)
+            for i in xrange(31):
+                fequal(leg[i, j], legx(i))
+            for i in xrange(1, 10):
+                fequal(geg[i-1, j] * 2.0 / (i * (i+1)),
+                       coal.hypergeo(1-i, i+2, 2, (1 - x) / 2.0))
+
+        # tables of small grids are cached
+        self.assertTrue(leg is coal.legendre_table(r, 30))
+        self.assertFalse(leg is coal.legendre_table(r, 30, cache=False))
+        r = [i / 5000.0 for i in xrange(5001)]
+        self.assertFalse(coal.legendre_table(r, 3) is
+                         coal.legendre_table(r, 3))
+        self.assertTrue(coal.legendre_table(r, 3, cache=True) is
+                        coal.legendre_table(r, 3, cache=True))
+        coal.legendre_table(r, 3)[0, 0] = 0.0
+
+    def test_freq_arrays(self):
+        N = 1000
+        T = [0.0, .1, .4, .9, 1.0]
+        x = [0.0, .1, .5, .7, 1.0]
+
+        for p in [.01, .2, .5, .8]:
+            for t in [100.0, 1000.0]:
+                fequals(coal.freq_CDF_array(p, N, t, T),
+                        [coal.freq_CDF(p, N, t, y) for y in T], eabs=1e-5)
+                fequal(coal.prob_fix_array(p, N, t),
+                       coal.prob_fix(p, N, t), eabs=1e-5)
+                fequal(coal.freq_prob_range_array(p, N, t, .2, .6),
+                       coal.freq_prob_range(p, N, t, .2, .6), eabs=1e-5)
+                fequals(coal.freq_pdf_array(x, p, N, t),
+                        [coal.freq_pdf(y, p, N, t) for y in x], eabs=1e-5)
+
+        # the CDF is a distribution for any number of terms
+        for k in [1, 5, 50]:
+            fequal(coal.freq_CDF_array(.3, N, 10.0, 1.0, k=k), 1.0,
+                   rel=1e-10)
+
+        # arguments are broadcast
+        t = [[10.0], [100.0], [1000.0]]
+        cdf = coal.freq_CDF_array(.3, N, t, T)
+        self.assertEqual(cdf.shape, (3, 5))
+        for i in xrange(3):
+            fequals(cdf[i], coal.freq_CDF_array(.3, N, t[i][0], T))
+
+    def test_sample_freq_CDF_array(self):
+        p = .3
+        N = 1000
+        t = 200.0
+        nsamples = 20000
+
+        freqs = coal.sample_freq_CDF_array([p] * nsamples, N, t)
+        for T in [0.0, .1, .3, .5, .7]:
+            fequal((freqs <= T).mean(), coal.freq_CDF(p, N, t, T), eabs=.02)
+
+        # special cases
+        self.assertEqual(list(coal.sample_freq_CDF_array(
+            [0.0, 1.0, .4], N, [100.0, 100.0, 0.0])), [0.0, 1.0, .4])
+
 
 #=============================================================================
 # multicoal
@@ -538,6 +684,90 @@ class _MultiCoal (unittest.TestCase):
         fequals(a, b, eabs=.05)
 
 
+class MultiCoalBatch (unittest.TestCase):
+
+    def test_sample_multicoal_trees(self):
+        """Sample many gene trees at once"""
+
+        stree = treelib.parse_newick(
+            "((A:1000, B:1000):500, (C:700, D:700):800);")
+        n = 1000
+        leaf_counts = {"A": 3, "B": 1, "C": 2, "D": 4}
+        stimes = treelib.get_tree_timestamps(stree)
+        trees = coal.sample_multicoal_trees(stree, n, 200,
+                                            leaf_counts=leaf_counts)
+        k = sum(leaf_counts.values())
+
+        self.assertEqual(len(trees), 200)
+        self.assertEqual(sorted(trees.names),
+                         ["A_1", "A_2", "A_3", "B_1",
+                          "C_1", "C_2", "D_1", "D_2", "D_3", "D_4"])
+        self.assertEqual(trees.parents.shape, (200, 2*k - 1))
+
+        for i, newick in enumerate(trees.iter_newick()):
+            self.assertEqual(newick, trees.get_newick(i))
+            tree, recon = trees.get_tree(i)
+            self.assertEqual(tree.get_one_line_newick(), newick)
+            self.assertEqual(sorted(tree.leaf_names()), sorted(trees.names))
+            for leaf in tree.leaves():
+                self.assertEqual(recon[leaf].name, leaf.name.split("_")[0])
+
+            # gene nodes are younger than their parents and within their
+            # species branch
+            for j in xrange(2*k - 1):
+                age = trees.ages[i, j]
+                parent = trees.parents[i, j]
+                snode = trees.snodes[trees.recon[i, j]]
+                self.assertTrue(parent == -1 or trees.ages[i, parent] >= age)
+                self.assertTrue(age >= stimes[snode] - 1e-6)
+                if snode.parent:
+                    self.assertTrue(age <= stimes[snode.parent] + 1e-6)
+
+    def test_sample_multicoal_trees_top(self):
+        """Test gene tree topology frequency of a three species tree"""
+
+        stree = treelib.parse_newick("((A:1000, B:1000):500, C:1500);")
+        n = 1000
+        nsamples = 20000
+        trees = coal.sample_multicoal_trees(stree, n, nsamples)
+
+        # the first coalescence joins A and B
+        a, b = trees.names.index("A_1"), trees.names.index("B_1")
+        first = trees.get_children()[:, 0, :]
+        p = ((first.min(axis=1) == min(a, b)) &
+             (first.max(axis=1) == max(a, b))).mean()
+        fequal(p, 1.0 - 2.0/3.0 * exp(-500.0 / n), .02)
+
+        # compare the TMRCA with sample_multicoal_tree
+        tmrcas = trees.ages[:, -1]
+        tmrcas2 = [max(treelib.get_tree_timestamps(
+            coal.sample_multicoal_tree(stree, n)[0]).values())
+            for i in xrange(2000)]
+        fequal(tmrcas.mean(), stats.mean(tmrcas2), .05)
+
+    def test_sample_multicoal_trees_seed(self):
+        """Sampling is reproducible with the random module's seed"""
+
+        stree = treelib.parse_newick("((A:1000, B:1000):500, C:1500);")
+        random.seed(10)
+        trees = coal.sample_multicoal_trees(stree, 1000, 10)
+        random.seed(10)
+        trees2 = coal.sample_multicoal_trees(stree, 1000, 10)
+        self.assertEqual(list(trees.iter_newick()),
+                         list(trees2.iter_newick()))
+
+    def test_sample_multicoal_trees_empty(self):
+        """Sampling no replicates gives no trees"""
+
+        stree = treelib.parse_newick("((A:1000, B:1000):500, C:1500);")
+        trees = coal.sample_multicoal_trees(stree, 1000, 0)
+        self.assertEqual(len(trees), 0)
+        self.assertEqual(trees.parents.shape, (0, 5))
+        self.assertEqual(list(trees.iter_newick()), [])
+        self.assertRaises(Exception, coal.sample_multicoal_trees,
+                          stree, 1000, -1)
+
+
 class BMC (unittest.TestCase):
 
     def test_cdf_bmc_simple(self):
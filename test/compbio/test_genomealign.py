@@ -0,0 +1,63 @@
+
+import random
+from unittest import TestCase
+
+from rasmus import tablelib
+from rasmus.testing import make_clean_dir
+
+from compbio import fasta
+from compbio import genomealign
+
+
+def rand_row(alignlen, gap=.3):
+    return "".join("-" if random.random() < gap else random.choice("ACGT")
+                   for i in range(alignlen))
+
+
+class AlignStore (TestCase):
+
+    def test_align_store(self):
+        """AlignStore should return the same alignments as GenomeAlign"""
+
+        outdir = "test/tmp/test_genomealign/"
+        make_clean_dir(outdir)
+
+        # make alignment blocks along one chromosome
+        random.seed(0)
+        master = tablelib.Table(headers=["species", "chromosome", "start",
+                                         "end", "filename"])
+        start = 1
+        for i in range(10):
+            alignlen = random.randint(1, 2000)
+            aln = fasta.FastaDict()
+            aln["human"] = rand_row(alignlen)
+            aln["mouse"] = rand_row(alignlen)
+            aln["dog"] = rand_row(alignlen) if i % 3 else ""
+            nres = alignlen - aln["human"].count("-")
+            filename = outdir + "block%d.fa" % i
+            fasta.write_fasta(filename, aln, order=["human", "mouse", "dog"])
+            master.append({"species": "human", "chromosome": "chr1",
+                           "start": start, "end": start + nres - 1,
+                           "filename": filename})
+            start += nres + random.randint(0, 50)
+        master.write(outdir + "master.txt", comments=True)
+
+        genomealign.write_align_store(outdir + "aln.store",
+                                      outdir + "master.txt", step=16)
+        galn = genomealign.GenomeAlign(outdir + "master.txt")
+        store = genomealign.AlignStore(outdir + "aln.store", cache_size=3)
+
+        for i in range(100):
+            qstart = random.randint(1, start)
+            qend = qstart + random.randint(0, 3000)
+            for collapse in [False, True]:
+                self.assertEqual(
+                    galn.get_aligns("human", "chr1", qstart, qend,
+                                    collapse=collapse),
+                    store.get_aligns("human", "chr1", qstart, qend,
+                                     collapse=collapse))
+            self.assertEqual(galn.get_align("human", "chr1", qstart, qend),
+                             store.get_align("human", "chr1", qstart, qend))
+
+        self.assertEqual(store.get_aligns("human", "chr2", 1, 100), [])
+        store.close()
@@ -0,0 +1,76 @@
+import random
+import unittest
+
+from compbio import arglib
+from compbio import replicates
+from rasmus import treelib
+
+
+class Replicates (unittest.TestCase):
+
+    def test_derive_seed(self):
+        seeds = [replicates.derive_seed(1, i) for i in range(100)]
+        self.assertEqual(len(set(seeds)), 100)
+        self.assertEqual(seeds, [replicates.derive_seed(1, i)
+                                 for i in range(100)])
+        self.assertNotEqual(seeds[0], replicates.derive_seed(2, 0))
+
+    def test_nproc(self):
+        """Replicates are identical for any number of processes"""
+
+        stree = treelib.parse_newick("((A:1000,B:1000):500,C:1500);")
+        models = {
+            "arg": ((10, 2*10000, 1.5e-8, 0, 50000), replicates.format_arg),
+            "arg_smc": ((10, 2*10000, 1.5e-8, 0, 50000),
+                        replicates.format_arg),
+            "multicoal": ((stree, 1000), replicates.format_tree),
+            "bounded_multicoal": ((stree, 1000, 5000),
+                                  replicates.format_tree),
+            "birthdeath": ((stree, .002, .001), replicates.format_tree),
+        }
+        self.assertEqual(sorted(models), sorted(replicates.MODELS))
+
+        for model, (args, summary) in sorted(models.items()):
+            reps_list = []
+            for nproc in (1, 2, 3):
+                reps_list.append(replicates.sample_replicates(
+                    model, 12, args, seed=10, nproc=nproc, summary=summary))
+            self.assertEqual(reps_list[0], reps_list[1], model)
+            self.assertEqual(reps_list[0], reps_list[2], model)
+
+            # replicates differ from each other
+            self.assertTrue(len(set(reps_list[0])) > 1, model)
+
+    def test_random_state(self):
+        """The random module is not disturbed by replicates"""
+
+        random.seed(1)
+        state = random.getstate()
+        stats = list(replicates.iter_replicates(
+            arglib.sample_arg_smc, 3, (5, 2*10000, 1.5e-8, 0, 10000),
+            seed=1, summary=replicates.summarize_arg))
+        self.assertEqual(len(stats), 3)
+
+        # base seed is drawn from the random module if not given
+        random.setstate(state)
+        stats2 = replicates.sample_replicates(
+            arglib.sample_arg_smc, 3, (5, 2*10000, 1.5e-8, 0, 10000),
+            summary=replicates.summarize_arg)
+        random.setstate(state)
+        stats3 = replicates.sample_replicates(
+            arglib.sample_arg_smc, 3, (5, 2*10000, 1.5e-8, 0, 10000),
+            summary=replicates.summarize_arg)
+        self.assertEqual(stats2, stats3)
+
+    def test_multicoal(self):
+        stree = treelib.parse_newick("((A:1000,B:1000):500,C:1500);")
+        trees = replicates.sample_replicates(
+            "multicoal", 5, (stree, 1000), seed=3, nproc=2,
+            summary=replicates.format_tree)
+        trees2 = replicates.sample_replicates(
+            "multicoal", 5, (stree, 1000), seed=3,
+            summary=replicates.format_tree)
+        self.assertEqual(trees, trees2)
+        for newick in trees:
+            tree = treelib.parse_newick(newick)
+            self.assertEqual(len(tree.leaves()), 3)
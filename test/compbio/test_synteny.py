@@ -0,0 +1,72 @@
+
+from StringIO import StringIO
+from unittest import TestCase
+
+from compbio import regionlib
+from compbio.synteny import strict
+
+
+def make_genes(species, chroms, ngenes):
+    """Make evenly spaced genes on each chromosome"""
+    genes = []
+    for chrom in chroms:
+        for i in range(ngenes):
+            gene = regionlib.Region(
+                species, chrom, "gene", i * 100 + 1, i * 100 + 50,
+                1 if i % 3 else -1,
+                data={"ID": "%s_%s_%d" % (species, chrom, i)})
+            genes.append(gene)
+    return genes
+
+
+def block_key(block):
+    return (block.region1.species, block.region1.seqname,
+            block.region1.start, block.region1.end,
+            block.region2.species, block.region2.seqname,
+            block.region2.start, block.region2.end,
+            block.dir)
+
+
+class Synteny (TestCase):
+
+    def setUp(self):
+        chroms = ["chr1", "chr2"]
+        self.species = ["a", "b", "c"]
+        self.regions = {}
+        for sp in self.species:
+            self.regions[sp] = make_genes(sp, chroms, 20)
+
+        # orthologs are collinear except for an inversion and some losses
+        self.orths = []
+        for i, sp1 in enumerate(self.species):
+            for sp2 in self.species[i+1:]:
+                for chrom in chroms:
+                    for j in range(20):
+                        if j % 7 == 3:
+                            continue
+                        k = 15 - (j - 10) if 10 <= j <= 15 else j
+                        self.orths.append(("%s_%s_%d" % (sp1, chrom, j),
+                                           "%s_%s_%d" % (sp2, chrom, k)))
+
+    def test_find_synteny_all(self):
+        """Multi-genome synteny should match pairwise synteny"""
+
+        expected = []
+        for i, sp1 in enumerate(self.species):
+            for sp2 in self.species[i+1:]:
+                orths = [row for row in self.orths
+                         if row[0].startswith(sp1 + "_") and
+                         row[1].startswith(sp2 + "_")]
+                blocks = strict.find_synteny(
+                    sp1, sp2, self.regions[sp1], self.regions[sp2], orths)
+                expected.extend(sorted(map(block_key, blocks)))
+        self.assertTrue(len(expected) > 0)
+
+        regions = sum(self.regions.values(), [])
+        for nproc in [1, 2]:
+            out = StringIO()
+            blocks = strict.find_synteny_all(regions, self.orths,
+                                             nproc=nproc, out=out)
+            self.assertEqual(sorted(map(block_key, blocks)),
+                             sorted(expected))
+            self.assertEqual(len(out.getvalue().splitlines()), len(blocks))
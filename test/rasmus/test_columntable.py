@@ -0,0 +1,157 @@
+
+from StringIO import StringIO
+import unittest
+
+from rasmus import tablelib
+from rasmus.columntable import ColumnTable
+from rasmus.columntable import iter_table_chunks
+from rasmus.columntable import read_column_table
+
+
+TEXT = """\
+##types:string	int	float	bool
+name	num	real	truth
+matt	-123	10.0	True
+alex	456	2.5	False
+mike	789	-30.0	False
+alex	12	1.5	True
+"""
+
+
+class Test (unittest.TestCase):
+
+    def test_read_write(self):
+        """ColumnTable should read and write the same format as Table"""
+        tab = read_column_table(StringIO(TEXT))
+        self.assertEqual(len(tab), 4)
+        self.assertEqual(list(tab), tablelib.read_table(StringIO(TEXT)))
+        self.assertEqual(tab.types, {'name': str, 'num': int,
+                                     'real': float, 'truth': bool})
+
+        out = StringIO()
+        tab.write(out, comments=True)
+        self.assertEqual(out.getvalue(), TEXT)
+
+        # guess types
+        tab = read_column_table(StringIO(TEXT.split("\n", 1)[1]))
+        self.assertEqual(list(tab), tablelib.read_table(StringIO(TEXT)))
+
+    def test_read_error(self):
+        text = """\
+##types:str	int	int
+name	num	num2
+matt	123	0
+alex	456	not_an_int
+mike	789	1
+"""
+        try:
+            read_column_table(StringIO(text))
+        except tablelib.TableException, e:
+            self.assertTrue("line 4" in str(e))
+        else:
+            self.fail("expected TableException")
+
+        text = """\
+name	num
+matt	123
+alex
+"""
+        self.assertRaises(tablelib.TableException,
+                          lambda: read_column_table(StringIO(text)))
+
+    def test_convert(self):
+        tab = tablelib.read_table(StringIO(TEXT))
+        ctab = ColumnTable.from_table(tab)
+        self.assertEqual(ctab.to_table(), tab)
+        self.assertEqual(ctab.to_table().types, tab.types)
+        self.assertEqual(ctab[1], tab[1])
+        self.assertEqual(list(ctab.cget('num')), tab.cget('num'))
+
+    def test_filter_sort(self):
+        tab = tablelib.read_table(StringIO(TEXT))
+        ctab = ColumnTable.from_table(tab)
+
+        self.assertEqual(list(ctab.filter(lambda t: t['num'] > 0)),
+                         tab.filter(lambda row: row['num'] > 0))
+        self.assertEqual(list(ctab[ctab['truth']]),
+                         tab.filter(lambda row: row['truth']))
+
+        for col in tab.headers:
+            for reverse in [False, True]:
+                ctab2 = ColumnTable.from_table(tab)
+                ctab2.sort(col=col, reverse=reverse)
+                tab2 = tab[:]
+                tab2.sort(col=col, reverse=reverse)
+                self.assertEqual(list(ctab2), tab2)
+
+        ctab.sort(cols=['name', 'num'])
+        self.assertEqual(list(ctab.cget('num')), [12, 456, -123, 789])
+
+    def test_groupby_lookup(self):
+        tab = tablelib.read_table(StringIO(TEXT))
+        ctab = ColumnTable.from_table(tab)
+
+        groups = ctab.groupby('name')
+        groups2 = tab.groupby('name')
+        self.assertEqual(sorted(groups.keys()), sorted(groups2.keys()))
+        for key in groups:
+            self.assertEqual(list(groups[key]), groups2[key])
+
+        groups = ctab.groupby(['name', 'truth'])
+        self.assertEqual(len(groups[('alex', True)]), 1)
+        self.assertEqual(len(groups[('alex', False)]), 1)
+
+        lookup = ctab.lookup('num')
+        self.assertEqual(lookup[456], 1)
+        self.assertRaises(Exception, lambda: ctab.lookup('name'))
+        self.assertEqual(ctab.lookup('name', 'num')[('alex', 12)], 3)
+        self.assertEqual(list(ctab.find('num', [789, 5, -123])), [2, -1, 0])
+        self.assertEqual(list(ctab.find('name', ['mike', 'bob'])), [2, -1])
+
+    def test_lookup_filtered(self):
+        """Lookups only contain keys of rows in the table"""
+        ctab = ColumnTable({'name': ['a', 'b', 'c'], 'x': [1, 2, 3]},
+                           headers=['name', 'x'])
+
+        ctab2 = ctab.filter(ctab['x'] > 1)
+        self.assertEqual(ctab2.lookup('name'), {'b': 0, 'c': 1})
+        self.assertEqual(ctab2.lookup('name', 'x'),
+                         {('b', 2): 0, ('c', 3): 1})
+
+        ctab3 = ctab.filter(ctab['x'] > 3)
+        self.assertEqual(ctab3.lookup('name'), {})
+
+    def test_chunks(self):
+        """Chunked reading should not depend on buffer size"""
+        lines = ["##types:string\tint\tfloat", "name\tnum\treal"]
+        for i in range(100):
+            lines.append("gene%d\t%d\t%f" % (i % 7, i, i / 3.0))
+            if i % 10 == 0:
+                lines.append("# comment")
+        text = "\n".join(lines) + "\n"
+
+        tab = tablelib.read_table(StringIO(text))
+        for bufsize in [1, 10, 100, 10000]:
+            ctab = ColumnTable().read(StringIO(text), bufsize=bufsize)
+            self.assertEqual(list(ctab), tab)
+
+            # only read some columns
+            ctab = ColumnTable().read(StringIO(text), bufsize=bufsize,
+                                      usecols=['real', 'name'])
+            self.assertEqual(ctab.headers, ['real', 'name'])
+            self.assertEqual(list(ctab), tab.get(cols=['real', 'name']))
+
+        # report errors by line number in later chunks
+        text2 = text.replace("gene3\t94\t", "gene3\tx94\t")
+        try:
+            ColumnTable().read(StringIO(text2), bufsize=100)
+        except tablelib.TableException, e:
+            self.assertTrue("line 107:" in str(e), str(e))
+        else:
+            self.fail("expected TableException")
+
+        # read plain delimited files
+        chunks = list(iter_table_chunks(StringIO("1\t2.5\n3\t4.5\n"),
+                                        nheaders=0, usecols=[1]))
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(list(chunks[0][1]), [2.5, 4.5])
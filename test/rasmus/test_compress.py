@@ -0,0 +1,121 @@
+
+import bz2
+import gzip
+from unittest import TestCase
+
+from rasmus import compress
+from rasmus import util
+from rasmus.testing import make_clean_dir
+
+
+def make_text(nlines=20000):
+    return "".join("line %d\t%s\n" % (i, "x" * (i % 50))
+                   for i in xrange(nlines))
+
+
+class Test (TestCase):
+
+    def test_open_stream(self):
+        """open_stream should decompress gzip and bzip2 files"""
+
+        outdir = "test/tmp/test_compress/"
+        make_clean_dir(outdir)
+        text = make_text()
+
+        out = gzip.open(outdir + "text.gz", "w")
+        out.write(text)
+        out.close()
+
+        out = bz2.BZ2File(outdir + "text.bz2", "w")
+        out.write(text)
+        out.close()
+
+        # gzip without extension is detected by magic bytes
+        out = gzip.open(outdir + "text.tab", "w")
+        out.write(text)
+        out.close()
+
+        for filename in ["text.gz", "text.bz2", "text.tab"]:
+            infile = util.open_stream(outdir + filename, sniff=True)
+            self.assertEqual(infile.readline(), "line 0\t\n")
+            self.assertEqual(infile.read(7), "line 1\t")
+            self.assertEqual("".join(infile), text[15:])
+            infile.close()
+
+        self.assertEqual(compress.detect_compression(outdir + "text.tab"),
+                         "gz")
+
+        # without sniffing, unknown extensions are opened as plain files
+        infile = util.open_stream(outdir + "text.tab", "rb")
+        self.assertTrue(isinstance(infile, file))
+        self.assertEqual(infile.read(2), "\x1f\x8b")
+        infile.close()
+
+        # concatenated gzip members
+        out = open(outdir + "multi.gz", "w")
+        for i in range(3):
+            out2 = gzip.GzipFile(fileobj=out, mode="w")
+            out2.write(text)
+            out2.close()
+        out.close()
+        infile = util.open_stream(outdir + "multi.gz")
+        self.assertEqual(infile.read(), text * 3)
+        infile.close()
+
+        # zero padding after a member is ignored, as in gzip
+        for padding in [1, 1000, compress.BUFSIZE]:
+            out = open(outdir + "padded.gz", "w")
+            out.write(open(outdir + "text.gz").read())
+            out.write("\x00" * padding)
+            out.close()
+            self.assertEqual(gzip.open(outdir + "padded.gz").read(), text)
+            infile = util.open_stream(outdir + "padded.gz")
+            self.assertEqual(infile.read(), text)
+            infile.close()
+
+        # writing compressed files
+        out = util.open_stream(outdir + "out.gz", "w")
+        out.write(text)
+        out.close()
+        self.assertEqual(gzip.open(outdir + "out.gz").read(), text)
+
+        # closing early
+        infile = util.open_stream(outdir + "multi.gz")
+        infile.readline()
+        infile.close()
+        self.assertTrue(infile.closed)
+
+    def test_bgzf(self):
+        """read and seek BGZF files"""
+
+        outdir = "test/tmp/test_compress/"
+        make_clean_dir(outdir)
+        text = make_text()
+        lines = text.splitlines(True)
+
+        # write with recorded virtual offsets of each line
+        offsets = []
+        out = compress.BgzfWriter(outdir + "text.bgz")
+        for line in lines:
+            offsets.append(out.tell())
+            out.write(line)
+        out.close()
+
+        self.assertTrue(compress.is_bgzf(outdir + "text.bgz"))
+        self.assertEqual(util.open_stream(outdir + "text.bgz").read(), text)
+
+        for nthreads in [1, 4]:
+            reader = compress.BgzfReader(outdir + "text.bgz",
+                                         nthreads=nthreads, nblocks=2)
+            self.assertEqual(reader.read(), text)
+
+            for i in [0, 1, 5000, 12345, 4000, len(lines) - 1]:
+                reader.seek(offsets[i])
+                self.assertEqual(reader.readline(), lines[i])
+                if i + 1 < len(lines):
+                    self.assertEqual(reader.tell(), offsets[i+1])
+                    self.assertEqual(reader.readline(), lines[i+1])
+
+            reader.seek(offsets[100])
+            self.assertEqual(list(reader), lines[100:])
+            reader.close()
@@ -0,0 +1,125 @@
+
+import os
+import signal
+import time
+from unittest import TestCase
+
+from rasmus import depend
+from rasmus.testing import make_clean_dir
+
+
+def make_pipeline(outdir, **options):
+    """Make a pipeline where each job appends its name to a log file"""
+
+    logfile = os.path.join(outdir, "log")
+
+    def log(name):
+        def func():
+            out = open(logfile, "a")
+            out.write(name + "\n")
+            out.close()
+            return True
+        return func
+
+    pipeline = depend.PoolPipeline(os.path.join(outdir, "status"), **options)
+    pipeline.add("a", log("a"))
+    pipeline.add("b", "echo b >> %s" % logfile)
+    pipeline.add("c", log("c"), ["a", "b"])
+    pipeline.add("d", log("d"), ["a"], cpus=2)
+    pipeline.add("e", "echo e >> %s" % logfile, ["c", "d"])
+    return pipeline
+
+
+def read_log(outdir):
+    return [line.rstrip() for line in open(os.path.join(outdir, "log"))]
+
+
+class Test (TestCase):
+
+    def test_pool_pipeline(self):
+        """run jobs on a process pool in dependency order"""
+
+        for threads in [False, True]:
+            outdir = "test/tmp/test_depend/pool/"
+            make_clean_dir(outdir)
+
+            pipeline = make_pipeline(outdir, maxCpus=2, threads=threads)
+            pipeline.run("e")
+            pipeline.process()
+
+            log = read_log(outdir)
+            self.assertEqual(sorted(log), ["a", "b", "c", "d", "e"])
+            self.assertEqual(log[-1], "e")
+            self.assertTrue(log.index("d") > log.index("a"))
+            self.assertTrue(log.index("c") > log.index("b"))
+            self.assertEqual(
+                set(job.status for job in pipeline.jobs.values()),
+                set([depend.STATUS_DONE]))
+
+            # job states are recovered from the journal
+            pipeline = make_pipeline(outdir)
+            pipeline.undo("d")
+            pipeline.run("e")
+            pipeline.process()
+            self.assertEqual(read_log(outdir)[5:], ["d", "e"])
+
+    def test_pool_pipeline_error(self):
+        """failed jobs raise errors and stop their children"""
+
+        outdir = "test/tmp/test_depend/error/"
+        make_clean_dir(outdir)
+
+        pipeline = make_pipeline(outdir)
+        pipeline.add("f", "exit 1", ["a"])
+        pipeline.add("g", "echo g", ["f"])
+        pipeline.run("g")
+        pipeline.run("e")
+        self.assertRaises(depend.PipelineException, pipeline.process)
+        self.assertEqual(pipeline.jobs["f"].status, depend.STATUS_ERROR)
+        self.assertNotEqual(pipeline.jobs["g"].status, depend.STATUS_DONE)
+
+        # errors are retried when the pipeline is restarted
+        pipeline = make_pipeline(outdir)
+        pipeline.add("f", "true", ["a"])
+        pipeline.run("f")
+        pipeline.process()
+        self.assertEqual(pipeline.jobs["f"].status, depend.STATUS_DONE)
+
+    def test_pool_pipeline_poll(self):
+        """polling returns while jobs are running"""
+
+        outdir = "test/tmp/test_depend/poll/"
+        make_clean_dir(outdir)
+
+        pipeline = make_pipeline(outdir, maxCpus=2)
+        pipeline.add("slow", "sleep .5", ["e"])
+        pipeline.run("slow")
+
+        start = time.time()
+        pipeline.process(poll=True)
+        self.assertTrue(time.time() - start < .5)
+        npolls = 1
+        while pipeline.pending:
+            time.sleep(.05)
+            pipeline.process(poll=True)
+            npolls += 1
+        self.assertTrue(npolls > 1)
+        self.assertEqual(sorted(read_log(outdir)), ["a", "b", "c", "d", "e"])
+        self.assertEqual(pipeline.jobs["slow"].status, depend.STATUS_DONE)
+        self.assertTrue(pipeline.pool is None)
+
+    def test_pool_pipeline_dead_worker(self):
+        """a dead pool worker fails its job instead of hanging"""
+
+        outdir = "test/tmp/test_depend/dead/"
+        make_clean_dir(outdir)
+
+        def crash():
+            os.kill(os.getpid(), signal.SIGKILL)
+
+        pipeline = depend.PoolPipeline(os.path.join(outdir, "status"))
+        pipeline.checkInterval = .1
+        pipeline.add("crash", crash)
+        pipeline.run("crash")
+        self.assertRaises(depend.PipelineException, pipeline.process)
+        self.assertEqual(pipeline.jobs["crash"].status, depend.STATUS_ERROR)
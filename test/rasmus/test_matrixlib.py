@@ -0,0 +1,91 @@
+
+from StringIO import StringIO
+import os
+import subprocess
+from unittest import TestCase
+
+import numpy as np
+
+from rasmus import matrixlib
+from rasmus.testing import make_clean_dir
+
+
+class Test (TestCase):
+
+    def test_dmat_array(self):
+        """read dense matrices into arrays"""
+
+        dmat = [[1.0, 0.0, 2.5], [0.0, 0.0, 0.0], [4.0, 5.0, 0.0]]
+        out = StringIO()
+        matrixlib.write_dmat(out, dmat)
+        text = out.getvalue()
+
+        self.assertEqual(matrixlib.read_dmat(StringIO(text), header=True)[3],
+                         dmat)
+        for header in [True, None]:
+            mat = matrixlib.read_dmat_array(StringIO(text), header=header)
+            self.assertEqual(mat.tolist(), dmat)
+
+        text = "1 2\n3 4\n"
+        mat = matrixlib.read_dmat_array(StringIO(text))
+        self.assertEqual(mat.tolist(), [[1, 2], [3, 4]])
+
+    def test_csr(self):
+        """convert and store compressed-row matrices"""
+
+        outdir = "test/tmp/test_matrixlib/"
+        make_clean_dir(outdir)
+
+        imat = [(2, 0, 4.0), (0, 2, 2.5), (0, 0, 1.0), (2, 1, 5.0),
+                (0, 2, 3.0)]
+        nrows, ncols = 3, 4
+        csr = matrixlib.imat2csr(nrows, ncols, len(imat), imat)
+
+        # repeated entries keep the last value (as in imat2rmat)
+        rmat = matrixlib.imat2rmat(nrows, ncols, len(imat), imat)
+        rmat2 = matrixlib.imat2rmat(nrows, ncols, None,
+                                    matrixlib.csr2imat(csr))
+        self.assertEqual(rmat, rmat2)
+        self.assertEqual(list(csr[0]), [0, 2, 2, 4])
+
+        dense = matrixlib.csr2dense(nrows, ncols, csr)
+        self.assertEqual(dense.tolist(), [[1, 0, 3, 0], [0, 0, 0, 0],
+                                          [4, 5, 0, 0]])
+        nrows2, ncols2, nnz, csr2 = matrixlib.dense2csr(dense)
+        self.assertEqual((nrows2, ncols2, nnz), (3, 4, 4))
+        for a, b in zip(csr, csr2):
+            self.assertEqual(list(a), list(b))
+
+        # binary files
+        matrixlib.write_csr(outdir + "mat.npz", nrows, ncols, csr)
+        nrows2, ncols2, nnz, csr2 = matrixlib.read_csr(outdir + "mat.npz")
+        self.assertEqual((nrows2, ncols2, nnz), (3, 4, 4))
+        for a, b in zip(csr, csr2):
+            self.assertEqual(list(a), list(b))
+
+        matrixlib.write_npy(outdir + "mat.npy", dense)
+        mat = matrixlib.read_npy(outdir + "mat.npy")
+        self.assertTrue(isinstance(mat, np.memmap))
+        self.assertEqual(mat.tolist(), dense.tolist())
+
+    def test_convert_stdin(self):
+        """matrix-convert reads binary matrices from a pipe"""
+
+        outdir = "test/tmp/test_matrixlib/"
+        make_clean_dir(outdir)
+        dense = np.array([[1.0, 0.0, 3.0], [0.0, 4.0, 0.0]])
+        matrixlib.write_npy(outdir + "mat.npy", dense)
+        matrixlib.write_csr(outdir + "mat.npz", 2, 3,
+                            matrixlib.dense2csr(dense)[3])
+
+        env = dict(os.environ, PYTHONPATH=os.getcwd())
+        for fmt in ["npy", "npz"]:
+            data = open(outdir + "mat." + fmt, "rb").read()
+            proc = subprocess.Popen(
+                ["python", "bin-misc/matrix-convert", fmt, "dmat"],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+            out = proc.communicate(data)[0]
+            self.assertEqual(proc.returncode, 0)
+            self.assertEqual(
+                matrixlib.read_dmat_array(StringIO(out), header=True).tolist(),
+                dense.tolist())
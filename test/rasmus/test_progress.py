@@ -0,0 +1,72 @@
+
+import gzip
+import json
+from StringIO import StringIO
+from unittest import TestCase
+
+from rasmus import progress
+from rasmus.testing import make_clean_dir
+
+
+class Test (TestCase):
+
+    def test_throughput(self):
+        """report items and bytes per second"""
+
+        outdir = "test/tmp/test_progress/"
+        make_clean_dir(outdir)
+
+        out = StringIO()
+        prog = progress.ThroughputProgress(
+            "test", total=1000, interval=0.0, check=100, out=out,
+            status_file=outdir + "status.json")
+        for i in xrange(1000):
+            prog.update(1, 10)
+        prog.finish()
+
+        # reports are rate limited by the check count
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 11)
+        self.assertTrue(lines[-1].startswith("test: 1,000 items"))
+        self.assertTrue("100.0%" in lines[-1])
+
+        status = json.load(open(outdir + "status.json"))
+        self.assertEqual(status["items"], 1000)
+        self.assertEqual(status["bytes"], 10000)
+        self.assertEqual(status["fraction"], 1.0)
+        self.assertTrue(status["done"])
+
+    def test_stream(self):
+        """report progress through a file"""
+
+        outdir = "test/tmp/test_progress/"
+        make_clean_dir(outdir)
+        text = "".join("line %d\n" % i for i in xrange(10000))
+
+        out = open(outdir + "text.txt", "w")
+        out.write(text)
+        out.close()
+        out = gzip.open(outdir + "text.txt.gz", "w")
+        out.write(text)
+        out.close()
+
+        for filename in ["text.txt", "text.txt.gz"]:
+            out = StringIO()
+            infile = progress.open_progress_stream(
+                outdir + filename, out=out, status_file=outdir + "status")
+            self.assertEqual("".join(infile), text)
+            infile.close()
+
+            status = json.load(open(outdir + "status"))
+            self.assertEqual(status["items"], 10000)
+            self.assertEqual(status["fraction"], 1.0)
+            self.assertTrue("10,000 lines" in out.getvalue())
+
+        # streams without a known size count bytes read
+        out = StringIO()
+        infile = progress.open_progress_stream(StringIO(text), out=out)
+        self.assertEqual(infile.readline(), "line 0\n")
+        self.assertEqual(len(list(infile)), 9999)
+        infile.close()
+        self.assertEqual(infile.progress.nbytes, len(text))
+        self.assertEqual(infile.progress.getStatus()["fraction"], None)
@@ -1,5 +1,6 @@
 
 from StringIO import StringIO
+import sqlite3
 import unittest
 
 from rasmus import tablelib
@@ -412,6 +413,202 @@ a	b	c
             (tab2, lambda x: (x['a'], x['d']), ['d', 'e']))
         self.assertEqual(join, tab4)
 
+    def test_index(self):
+
+        tab = tablelib.Table([
+            {'a': 1, 'b': 'x', 'c': 3},
+            {'a': 4, 'b': 'y', 'c': 6},
+            {'a': 1, 'b': 'y', 'c': 9}
+        ])
+
+        # single column index
+        index = tab.get_index('a')
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.get_rows(1), [tab[0], tab[2]])
+        self.assertEqual(index[4], tab[1])
+        self.assertEqual(index.get(5), None)
+        self.assertRaises(Exception, lambda: tab.get_index('a', unique=True))
+
+        # composite index
+        index2 = tab.get_index('a', 'b', unique=True)
+        self.assertEqual(index2[(1, 'y')], tab[2])
+        self.assertTrue((4, 'x') not in index2)
+
+        # indexes are reused until the table is modified
+        self.assertTrue(tab.get_index('a') is index)
+        tab.add(a=5, b='z', c=10)
+        index3 = tab.get_index('a')
+        self.assertTrue(index3 is not index)
+        self.assertEqual(index3[5]['c'], 10)
+
+        tab.sort(col='c', reverse=True)
+        self.assertEqual(tab.get_index('a').get_rows(1),
+                         [tab[1], tab[3]])
+
+        del tab[0]
+        self.assertTrue(5 not in tab.get_index('a'))
+
+        tab.extend([{'a': 8, 'b': 'w', 'c': 0}])
+        self.assertTrue(8 in tab.get_index('a'))
+        tab += [{'a': 9, 'b': 'v', 'c': 0}]
+        self.assertTrue(9 in tab.get_index('a'))
+        tab.pop()
+        tab.append({'a': 10, 'b': 'u', 'c': 0})
+        self.assertTrue(9 not in tab.get_index('a'))
+        self.assertTrue(10 in tab.get_index('a'))
+
+        # edits to rows require explicit invalidation
+        tab[0]['a'] = 7
+        tab.invalidate_indexes()
+        self.assertEqual(tab.get_index('a')[7], tab[0])
+
+    def test_pickle(self):
+        """Tables survive a pickle round trip with any protocol"""
+        import cPickle
+        import pickle
+
+        tab = tablelib.Table([
+            {'a': 1, 'b': 'x'},
+            {'a': 4, 'b': 'y'},
+            {'a': 4, 'b': 'z'}
+        ], headers=['a', 'b'])
+        tab.get_index('a')
+
+        for module in (pickle, cPickle):
+            for protocol in (0, 1, 2):
+                tab2 = module.loads(module.dumps(tab, protocol))
+                self.assertEqual(list(tab2), list(tab))
+                self.assertEqual(tab2.headers, tab.headers)
+                tab2.add(a=5, b='w')
+                self.assertEqual(tab2.get_index('a')[5]['b'], 'w')
+
+        # rows built with extend
+        self.assertEqual(list(tab.filter(lambda row: row['a'] == 4)),
+                         tab[1:])
+        self.assertEqual(list(tab.get([2], ['b'])), [{'b': 'z'}])
+        self.assertEqual(list(tab.uniq(col='a')), [tab[0], tab[1]])
+        self.assertEqual(list(tab.uniq()), list(tab))
+        self.assertEqual(list(tab.uniq(key=lambda row: row['a'] > 0)),
+                         [tab[0]])
+
+    def test_join_engine(self):
+
+        tab1 = tablelib.Table([
+            {'a': 1, 'b': 2},
+            {'a': 4, 'b': 5},
+            {'a': 7, 'b': 8},
+        ], headers=['a', 'b'])
+        tab2 = tablelib.Table([
+            {'a': 1, 'd': 'x'},
+            {'a': 7, 'd': 'y'},
+            {'a': 7, 'd': 'z'},
+            {'a': 9, 'd': 'w'},
+        ], headers=['a', 'd'])
+
+        inner = [
+            {'a': 1, 'b': 2, 'd': 'x'},
+            {'a': 7, 'b': 8, 'd': 'y'},
+            {'a': 7, 'b': 8, 'd': 'z'},
+        ]
+        left = [
+            {'a': 1, 'b': 2, 'd': 'x'},
+            {'a': 4, 'b': 5, 'd': None},
+            {'a': 7, 'b': 8, 'd': 'y'},
+            {'a': 7, 'b': 8, 'd': 'z'},
+        ]
+        outer = left + [{'a': None, 'b': None, 'd': 'w'}]
+
+        for method in ['hash', 'merge']:
+            self.assertEqual(list(tablelib.iter_join(
+                tab1, tab2, 'a', method=method)), inner)
+            self.assertEqual(list(tablelib.iter_join(
+                tab1, tab2, 'a', how='left', method=method)), left)
+
+            # outer join rows, keeping key from the right rows
+            rows = list(tablelib.iter_join(
+                tab1, tab2, 'a', how='outer', method=method,
+                right_cols=['d']))
+            self.assertEqual(rows, outer)
+
+            # streamed inputs
+            rows = list(tablelib.iter_join(
+                iter(tab1), iter(tab2), ['a'], how='outer', method=method))
+            self.assertEqual(rows, left + [{'a': 9, 'b': None, 'd': 'w'}])
+
+        # key functions and different keys for each side
+        tab3 = tablelib.Table([{'e': 2, 'f': 1}, {'e': 8, 'f': 2}])
+        rows = list(tablelib.iter_join(
+            tab1, tab3, lambda row: row['b'], lambda row: row['e'],
+            how='right'))
+        self.assertEqual(rows, [{'a': 1, 'b': 2, 'e': 2, 'f': 1},
+                                {'a': 7, 'b': 8, 'e': 8, 'f': 2}])
+
+        # join to table
+        tab = tablelib.join(tab1, tab2, 'a', how='left')
+        self.assertEqual(tab.headers, ['a', 'b', 'd'])
+        self.assertEqual(tab, left)
+        self.assertEqual(tab.types['d'], str)
+
+        # merge join requires sorted input
+        self.assertRaises(Exception, lambda: list(tablelib.iter_join(
+            tab1[::-1], tab2, 'a', method='merge')))
+
+    def test_sql(self):
+
+        tab = tablelib.Table([
+            {'name': 'matt', 'num': 7, 'score': 1.5},
+            {'name': 'al"ex', 'num': 12, 'score': 2.0},
+            {'name': "mi'ke", 'num': 23, 'score': -1.0},
+        ], headers=['name', 'num', 'score'])
+
+        con = sqlite3.connect(':memory:')
+        tablelib.sqlput(con, 't', tab, batchsize=2,
+                        indexes=['name', ('num', 'score')])
+
+        tab2 = tablelib.sqlget(con, 'SELECT * FROM t')
+        self.assertEqual(tab2.headers, tab.headers)
+        self.assertEqual(tab2.nheaders, 1)
+        self.assertEqual(tab2, tab)
+        self.assertEqual(
+            tablelib.sqlget(con, 'SELECT name, num FROM t',
+                            headernum=True).cget(0, 1),
+            tab.cget('name', 'num'))
+        self.assertEqual(
+            tablelib.sqlget(con, 'SELECT * FROM t', maxrows=2), tab[:2])
+        self.assertEqual(
+            tablelib.sqlget(con, 'SELECT num FROM t WHERE num > ?',
+                            params=(10,)).cget('num'), [12, 23])
+
+        # pragmas of a caller's connection are left alone
+        self.assertEqual(
+            con.execute("PRAGMA synchronous").fetchone()[0], 2)
+        tablelib.sqlput(con, 't2', tab, bulk=True)
+        self.assertEqual(
+            con.execute("PRAGMA synchronous").fetchone()[0], 2)
+        self.assertEqual(tablelib.sqlget(con, 'SELECT * FROM t2'), tab)
+
+        # ... even when loading fails
+        bad = tablelib.Table([{'num': 1}, {'num': [2]}], headers=['num'])
+        self.assertRaises(Exception, tablelib.sqlput, con, 't3', bad,
+                          bulk=True)
+        self.assertEqual(
+            con.execute("PRAGMA synchronous").fetchone()[0], 2)
+
+        # indexes
+        names = [row[0] for row in con.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")]
+        self.assertEqual(sorted(names), ['t__name', 't__num__score'])
+
+        # streaming
+        self.assertEqual(
+            list(tablelib.iter_sqlget(con, 'SELECT * FROM t', chunksize=2)),
+            tab)
+        chunks = list(tablelib.iter_sqlget_chunks(
+            con, 'SELECT name, num FROM t', chunksize=2))
+        self.assertEqual(chunks, [{'name': ('matt', 'al"ex'),
+                                   'num': (7, 12)},
+                                  {'name': ("mi'ke",), 'num': (23,)}])
+
     def test_histtab(self):
 
         data = "aaaacbb"
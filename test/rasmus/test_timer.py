@@ -0,0 +1,60 @@
+
+import json
+from StringIO import StringIO
+from unittest import TestCase
+
+from rasmus import timer
+
+
+class Test (TestCase):
+
+    def test_profile(self):
+        """record a call tree of timed sections"""
+
+        out = StringIO()
+        t = timer.Timer(out)
+        profile = t.enableProfile()
+
+        t.start("outer")
+        for i in range(3):
+            t.start("inner")
+            sum(xrange(10000))
+            self.assertTrue(t.time() >= 0.0)
+            t.stop()
+        with profile.section("other"):
+            pass
+        t.stop()
+        t.start("outer")
+        t.stop()
+
+        self.assertTrue("BEGIN outer" in out.getvalue())
+        nodes = list(profile.iterNodes())
+        self.assertEqual([node.name for node in nodes],
+                         ["outer", "inner", "other"])
+        outer, inner, other = nodes
+        self.assertEqual((outer.count, inner.count, other.count), (2, 3, 1))
+        self.assertEqual(inner.path(), ["outer", "inner"])
+        self.assertTrue(outer.wall >= inner.wall + other.wall)
+        self.assertTrue(abs(outer.selfWall() -
+                            (outer.wall - inner.wall - other.wall)) < 1e-9)
+        self.assertTrue(inner.peakMemory > 0)
+
+        # export
+        data = json.loads(self.dump(profile.writeJson))
+        self.assertEqual(data[0]["name"], "outer")
+        self.assertEqual(data[0]["children"][0]["count"], 3)
+
+        lines = self.dump(profile.writeCollapsed).splitlines()
+        self.assertEqual([line.split()[0] for line in lines],
+                         ["outer", "outer;inner", "outer;other"])
+
+        # disabled profiling records nothing
+        t.disableProfile()
+        t.start("outer")
+        t.stop()
+        self.assertEqual(outer.count, 2)
+
+    def dump(self, func):
+        out = StringIO()
+        func(out)
+        return out.getvalue()
@@ -68,3 +68,16 @@ class Test (unittest.TestCase):
         self.assertEqual(util.pretty2int('-10,000'), -10000)
         self.assertEqual(util.pretty2int('-100,000'), -100000)
         self.assertEqual(util.pretty2int('-1,000,000'), -1000000)
+
+    def test_lru_cache(self):
+        """LRUCache should discard the least recently used item"""
+
+        cache = util.LRUCache(2)
+        cache["a"] = 1
+        cache["b"] = 2
+        self.assertEqual(cache["a"], 1)
+        cache["c"] = 3
+        self.assertTrue("a" in cache)
+        self.assertFalse("b" in cache)
+        self.assertEqual(cache.get("b", 0), 0)
+        self.assertEqual(len(cache), 2)